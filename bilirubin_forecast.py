@@ -0,0 +1,251 @@
+"""直近のビリルビン値（TB）から上昇速度を求め、森岡の low/high/交換輸血ライン・村田・井村の基準を
+越える時刻と、次の採血の目安時刻を入院児全体についてまとめて計算する
+
+    python bilirubin_forecast.py --census 5000
+
+基準値は出生後時間（森岡の時間区分）と日齢（0時で変わる。森岡の修正週数群・村田の日齢）で階段状に変わる。
+予測範囲をこれらの境目で区切ると各区間の基準値は一定なので、直線で予測したTBが基準値に達する時刻は
+区間ごとに1回の割り算で求まる。全児 × 区間の2次元配列で計算するため、児の数が増えてもループしない。
+時刻はすべて出生後時間（h）で表す。
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from protocol import MORIOKA_TB_THRESHOLDS
+from sweep import MORIOKA_TIME_BUCKETS, murata_category_index, murata_threshold_matrix
+
+# 予測する基準線（森岡の TB low/high/交換輸血、村田・井村の基準）
+FORECAST_LINES = ("low", "high", "exchange", "murata")
+FORECAST_LINE_LABELS = {"low": "森岡 TB low", "high": "森岡 TB high", "exchange": "森岡 交換輸血", "murata": "村田・井村"}
+
+# 上昇速度は直近の何点から求めるか（最小二乗の傾き）
+FORECAST_WINDOW = 3
+# 何時間先まで予測するか
+FORECAST_HORIZON_HOURS = 72.0
+# 次の採血の目安：最初の基準線に達する予測時刻までの時間の半分。ただし4〜24時間の範囲に収める
+# （基準線を既に越えている場合は最短の4時間）。施設の採血方針に置き換えて使う目安
+FORECAST_SAMPLING_LEAD_FRACTION = 0.5
+FORECAST_SAMPLING_MIN_HOURS = 4.0
+FORECAST_SAMPLING_MAX_HOURS = 24.0
+
+_MORIOKA_GROUPS = list(MORIOKA_TB_THRESHOLDS.keys())
+_MORIOKA_GROUP_LOWS = np.array([low for low, _ in _MORIOKA_GROUPS])
+_MORIOKA_HOUR_EDGES = np.array([b for b in MORIOKA_TIME_BUCKETS if b != float("inf")], dtype=float)
+# (修正週数群, 時間区分, low/high/交換輸血) の3次元配列
+_MORIOKA_TB_TABLE = np.array(
+    [[MORIOKA_TB_THRESHOLDS[g][b] for b in MORIOKA_TIME_BUCKETS] for g in _MORIOKA_GROUPS], dtype=float
+)
+
+
+def first_midnight_hours(birth_dt):
+    """出生から最初の0時（日齢が1になる時刻）までの時間（0より大きく24以下）"""
+    midnight = datetime.combine(birth_dt.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - birth_dt).total_seconds() / 3600
+
+
+def days_old_at(hours, midnight_hours):
+    """出生後時間における日齢（暦日。get_time_state と同じく0時で1日進む）"""
+    hours = np.asarray(hours, dtype=float)
+    return np.where(hours < midnight_hours, 0, 1 + np.floor((hours - midnight_hours) / 24)).astype(np.int64)
+
+
+def _threshold_arrays(tables):
+    # (修正週数群の下限, 時間区分の境目, 森岡の表, 村田の表)。tables は protocol_tables.ProtocolTables
+    if tables is None:
+        return _MORIOKA_GROUP_LOWS, _MORIOKA_HOUR_EDGES, _MORIOKA_TB_TABLE, murata_threshold_matrix()
+    return tables.morioka_group_lows, tables.morioka_hour_edges, tables.morioka_tb_table, tables.murata_matrix
+
+
+def thresholds_at_hours(hours, ga_total_days, midnight_hours, birth_weight, has_kernicterus_risk, tables=None):
+    """出生後時間での基準値 (..., 4)（FORECAST_LINES の順）。森岡の対象外・村田の日齢0・体重未測定はNaN
+    引数はブロードキャストできる配列（(児, 時刻) で引く場合は児ごとの値を (児, 1) にして渡す）
+    tables を渡すとその版の表で引く（省略時は protocol の表）"""
+    group_lows, hour_edges, tb_table, murata_matrix = _threshold_arrays(tables)
+    hours = np.asarray(hours, dtype=float)
+    days_old = days_old_at(hours, midnight_hours)
+    pca_weeks = (np.asarray(ga_total_days) + days_old) // 7
+
+    group = np.searchsorted(group_lows, pca_weeks, side="right") - 1
+    bucket = np.searchsorted(hour_edges, hours, side="right")
+    morioka = tb_table[np.maximum(group, 0), bucket]
+    morioka = np.where((group >= 0)[..., None], morioka, np.nan)
+
+    weight = np.asarray(birth_weight, dtype=float)
+    category = murata_category_index(np.nan_to_num(weight, nan=0.0), np.asarray(has_kernicterus_risk, dtype=bool))
+    murata = murata_matrix[category, np.clip(days_old, 0, 7)]
+    murata = np.where(np.isnan(weight), np.nan, murata)
+    return np.concatenate([morioka, murata[..., None]], axis=-1)
+
+
+def fit_bilirubin_rate(sample_hours, sample_tb):
+    """(児, 点) の配列（欠けはNaN）から、最小二乗の傾き（mg/dL/h）と最後の測定の時刻・値を求める
+    有効な点が2つ未満、または時刻がすべて同じ児の傾きはNaN"""
+    t = np.asarray(sample_hours, dtype=float)
+    y = np.asarray(sample_tb, dtype=float)
+    valid = ~np.isnan(t) & ~np.isnan(y)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t_mean = np.where(valid, t, 0).sum(axis=1) / count
+        y_mean = np.where(valid, y, 0).sum(axis=1) / count
+        dt = np.where(valid, t - t_mean[:, None], 0)
+        dy = np.where(valid, y - y_mean[:, None], 0)
+        sxx = (dt * dt).sum(axis=1)
+        rate = np.where((count >= 2) & (sxx > 0), (dt * dy).sum(axis=1) / sxx, np.nan)
+
+    # 最後の測定：有効な点のうち時刻が最も遅いもの
+    last = np.argmax(np.where(valid, t, -np.inf), axis=1)
+    rows = np.arange(len(t))
+    has_sample = count > 0
+    last_hours = np.where(has_sample, t[rows, last], np.nan)
+    last_tb = np.where(has_sample, y[rows, last], np.nan)
+    return rate, last_hours, last_tb
+
+
+def forecast_bilirubin(sample_hours, sample_tb, now_hours, ga_total_days, midnight_hours, birth_weight,
+                       has_kernicterus_risk=False, horizon_hours=FORECAST_HORIZON_HOURS, tables=None):
+    """入院児全体の予測。sample_hours / sample_tb は (児, 点)、そのほかは1児1要素の配列
+    {"rate": mg/dL/h, "projected_now": 現在の予測TB, "thresholds_now": (児, 4),
+     "crossing_hours": (児, 4) 各基準線に達する予測時刻（予測範囲内に達しなければNaN）,
+     "already_above": (児, 4), "next_sample_hours": 次の採血の目安時刻}"""
+    rate, last_hours, last_tb = fit_bilirubin_rate(sample_hours, sample_tb)
+    now_hours = np.asarray(now_hours, dtype=float)
+    midnight_hours = np.asarray(midnight_hours, dtype=float)
+    start = np.fmax(now_hours, last_hours)
+    start = np.where(np.isnan(start), now_hours, start)
+    end = start + horizon_hours
+    slope = np.where(np.isnan(rate), 0.0, rate)
+
+    # 予測範囲の区切り：開始・時間区分の境目・0時・終了（範囲外の候補は両端に寄せる）
+    days = np.arange(int(np.ceil(horizon_hours / 24)) + 2)
+    midnights = (midnight_hours[:, None] + 24 * days[None, :]
+                 + 24 * np.floor(np.maximum(start - midnight_hours, 0) / 24)[:, None])
+    hour_edges = _threshold_arrays(tables)[1]
+    edges = np.broadcast_to(hour_edges, (len(start), len(hour_edges)))
+    breaks = np.concatenate([start[:, None], edges, midnights, end[:, None]], axis=1)
+    breaks = np.sort(np.clip(breaks, start[:, None], end[:, None]), axis=1)
+    seg_start, seg_end = breaks[:, :-1], breaks[:, 1:]
+
+    infant_args = (
+        np.asarray(ga_total_days)[:, None],
+        midnight_hours[:, None],
+        np.asarray(birth_weight, dtype=float)[:, None],
+        np.asarray(has_kernicterus_risk, dtype=bool)[:, None],
+    )
+    # 区間内の基準値は一定。境目ちょうどの時刻は丸め誤差で前後の区間を取り違えうるため、区間の中点で引く
+    thresholds = thresholds_at_hours((seg_start + seg_end) / 2, *infant_args, tables=tables)
+    projected = last_tb[:, None] + slope[:, None] * (seg_start - np.where(np.isnan(last_hours), start, last_hours)[:, None])
+    projected = projected[..., None]  # (児, 区間, 1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # 区間の開始時点で既に越えていれば開始時刻、上昇中なら区間内で達する時刻
+        reach = seg_start[..., None] + (thresholds - projected) / slope[:, None, None]
+        at_start = projected >= thresholds
+        inside = (slope[:, None, None] > 0) & (reach < seg_end[..., None])
+    crossing = np.where(at_start, seg_start[..., None], np.where(inside, reach, np.nan))
+    crossing = np.where(np.isnan(thresholds), np.nan, crossing)
+    crossing_hours = np.where(np.isnan(crossing), np.inf, crossing).min(axis=1)
+    crossing_hours = np.where(np.isinf(crossing_hours), np.nan, crossing_hours)
+
+    projected_now = last_tb + slope * (start - last_hours)
+    thresholds_now = thresholds_at_hours(start[:, None], *infant_args, tables=tables)[:, 0, :]
+    already_above = projected_now[:, None] >= thresholds_now
+
+    first = np.where(np.isnan(crossing_hours), np.inf, crossing_hours).min(axis=1)
+    lead = np.where(np.isinf(first), FORECAST_SAMPLING_MAX_HOURS, (first - start) * FORECAST_SAMPLING_LEAD_FRACTION)
+    lead = np.clip(lead, FORECAST_SAMPLING_MIN_HOURS, FORECAST_SAMPLING_MAX_HOURS)
+    return {
+        "rate": rate,
+        "projected_now": projected_now,
+        "thresholds_now": thresholds_now,
+        "crossing_hours": crossing_hours,
+        "already_above": already_above,
+        "next_sample_hours": start + lead,
+    }
+
+
+def pack_bilirubin_samples(histories, window=FORECAST_WINDOW):
+    """児ごとの [(出生後時間, TB), ...] を直近 window 点の (児, 点) 配列にする（足りない分はNaN）"""
+    hours = np.full((len(histories), window), np.nan)
+    tb = np.full((len(histories), window), np.nan)
+    for i, samples in enumerate(histories):
+        recent = sorted(samples)[-window:]
+        for j, (h, value) in enumerate(recent):
+            hours[i, j] = h
+            tb[i, j] = value
+    return hours, tb
+
+
+def census_forecast_inputs(infants, now):
+    """入院児の一覧（census_scheduler と同じ項目＋ tb_samples: [(測定日時, TB)]）を forecast_bilirubin の引数にする"""
+    birth = [datetime.combine(i["birth_date"], i["birth_time"]) for i in infants]
+    histories = [
+        [((when - b).total_seconds() / 3600, value) for when, value in i.get("tb_samples", ())]
+        for i, b in zip(infants, birth)
+    ]
+    sample_hours, sample_tb = pack_bilirubin_samples(histories)
+    return {
+        "sample_hours": sample_hours,
+        "sample_tb": sample_tb,
+        "now_hours": np.array([max((now - b).total_seconds() / 3600, 0.0) for b in birth]),
+        "ga_total_days": np.array([i["gestational_weeks"] * 7 + i["gestational_days"] for i in infants]),
+        "midnight_hours": np.array([first_midnight_hours(b) for b in birth]),
+        "birth_weight": np.array([np.nan if i.get("birth_weight") is None else i["birth_weight"] for i in infants], dtype=float),
+        "has_kernicterus_risk": np.array([bool(i.get("has_kernicterus_risk", False)) for i in infants]),
+    }
+
+
+def synthetic_census(n, now, seed=0):
+    """速度測定用の架空の入院児（直近3回のTBつき）"""
+    rng = np.random.default_rng(seed)
+    infants = []
+    for _ in range(n):
+        birth_dt = now - timedelta(hours=float(rng.uniform(6, 240)))
+        ga_days = int(rng.integers(24 * 7, 41 * 7 + 7))
+        rate = float(rng.normal(0.12, 0.08))
+        base = float(rng.uniform(3, 12))
+        samples = [
+            (now - timedelta(hours=h), round(base - rate * h, 1))
+            for h in sorted(rng.uniform(1, 36, size=3), reverse=True)
+        ]
+        infants.append({
+            "birth_date": birth_dt.date(),
+            "birth_time": birth_dt.time(),
+            "gestational_weeks": ga_days // 7,
+            "gestational_days": ga_days % 7,
+            "birth_weight": int(rng.uniform(600, 4000)),
+            "has_kernicterus_risk": bool(rng.random() < 0.2),
+            "tb_samples": samples,
+        })
+    return infants
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="架空の入院児でビリルビン予測の計算時間を測る")
+    parser.add_argument("--census", type=int, default=5000, help="入院児の数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    now = datetime.now()
+    inputs = census_forecast_inputs(synthetic_census(args.census, now, args.seed), now)
+    best = None
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        result = forecast_bilirubin(**inputs)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"{args.census:,}人：{best * 1000:.1f} ms（最速{args.repeat}回中）")
+    for i, line in enumerate(FORECAST_LINES):
+        within = np.isfinite(result["crossing_hours"][:, i]) & ~result["already_above"][:, i]
+        print(f"  {FORECAST_LINE_LABELS[line]}: 既に超過 {int(result['already_above'][:, i].sum()):,}人 / "
+              f"{FORECAST_HORIZON_HOURS:.0f}時間以内に到達 {int(within.sum()):,}人")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
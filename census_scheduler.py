@@ -0,0 +1,274 @@
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+
+from protocol import (
+    MORIOKA_TB_THRESHOLDS,
+    MURATA_PHOTOTHERAPY_THRESHOLDS,
+    get_due_schedule,
+    get_phototherapy_threshold,
+)
+from time_schedule import MORIOKA_HOUR_EDGES, get_time_state
+
+# 入院中の全児について「次に基準値が変わる時刻」と「次の実施予定（ケイツー・スクリーニング）」を
+# 優先度付きキューで管理し、その時刻にだけ起きて購読者に通知する。
+
+# 村田の日齢キー（日齢7以降は同じ値）。日齢が変わる0時のうち基準値が変わりうるのはこの範囲
+MURATA_DAY_KEYS = sorted({day for by_day in MURATA_PHOTOTHERAPY_THRESHOLDS.values() for day in by_day.keys()})
+# 森岡の修正週数群の下限。修正週数がここに達する0時に群が変わる
+MORIOKA_GROUP_LOWS = sorted({low for low, _ in MORIOKA_TB_THRESHOLDS.keys()})
+
+
+def get_census_thresholds(infant, now, tables=None):
+    """1児の現在の基準値（村田・森岡）。比較して変化を検出するためタプルで持つ
+    tables（protocol_tables.ProtocolTables）を渡すとその版の表で引く"""
+    state = get_time_state(
+        infant["birth_date"], infant["birth_time"], infant["gestational_weeks"], infant["gestational_days"], now,
+        tables=tables,
+    )
+    murata = None
+    if infant.get("birth_weight") is not None:
+        lookup = get_phototherapy_threshold if tables is None else tables.get_phototherapy_threshold
+        category, threshold, _, _, _, _ = lookup(
+            infant["birth_weight"], state["days_old"], infant.get("has_kernicterus_risk", False)
+        )
+        murata = (category, threshold)
+    morioka = state["morioka"]
+    if morioka is not None:
+        morioka = (
+            morioka["pca_group"],
+            morioka["time_bucket_hours"],
+            tuple(morioka["tb"].values()),
+            tuple(morioka["ub"].values()),
+        )
+    return {"murata": murata, "morioka": morioka}
+
+
+def next_threshold_change(infant, now, tables=None):
+    """次に村田・森岡の基準値が変わりうる時刻。以後変わらなければ None"""
+    if tables is None:
+        hour_edges, day_keys, group_lows = MORIOKA_HOUR_EDGES, MURATA_DAY_KEYS, MORIOKA_GROUP_LOWS
+    else:
+        hour_edges, day_keys, group_lows = tables.MORIOKA_HOUR_EDGES, tables.MURATA_DAY_KEYS, tables.MORIOKA_GROUP_LOWS
+    birth_date = infant["birth_date"]
+    birth_dt = datetime.combine(birth_date, infant["birth_time"])
+    ga_days = infant["gestational_weeks"] * 7 + infant["gestational_days"]
+
+    candidates = [birth_dt + timedelta(hours=h) for h in hour_edges]
+    midnight = datetime.min.time()
+    candidates += [datetime.combine(birth_date + timedelta(days=d), midnight) for d in day_keys[1:]]
+    candidates += [
+        datetime.combine(birth_date + timedelta(days=low * 7 - ga_days), midnight)
+        for low in group_lows
+        if low * 7 - ga_days > 0
+    ]
+    future = [t for t in candidates if t > now]
+    return min(future) if future else None
+
+
+class CensusScheduler:
+    """入院児ごとの基準値変化・実施予定を時刻順に処理する（次の時刻まで眠る）"""
+
+    def __init__(self, clock=datetime.now, tables=None):
+        self.clock = clock
+        self.tables = tables  # 森岡・村田の基準の表（protocol_tables.ProtocolTables。None は protocol の表）
+        self._heap = []
+        self._seq = itertools.count()
+        self._infants = {}
+        self._subscribers = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def subscribe(self, callback):
+        """callback(event) を登録し、登録解除用の関数を返す"""
+        with self._cond:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._cond:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _push(self, when, patient_id, version, kind, payload=None):
+        heapq.heappush(self._heap, (when, next(self._seq), patient_id, version, kind, payload))
+
+    def admit(self, patient_id, infant, now=None):
+        """入院（または情報更新）。以前の予定は版番号で無効化する"""
+        now = now or self.clock()
+        with self._cond:
+            previous = self._infants.get(patient_id)
+            version = 1 if previous is None else previous["version"] + 1
+            thresholds = get_census_thresholds(infant, now, self.tables)
+            due = [item for item in get_due_schedule(infant["birth_date"]) if item[0] >= now.date()]
+            self._infants[patient_id] = {
+                "infant": infant,
+                "version": version,
+                "thresholds": thresholds,
+                "due": due,
+                "due_index": 0,
+            }
+            change_at = next_threshold_change(infant, now, self.tables)
+            if change_at is not None:
+                self._push(change_at, patient_id, version, "thresholds")
+            if due:
+                self._push(datetime.combine(due[0][0], datetime.min.time()), patient_id, version, "due")
+            self._cond.notify()
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, [{"type": "admitted", "patient_id": patient_id, "at": now, "thresholds": thresholds}])
+
+    def set_tables(self, tables, now=None):
+        """基準の表を持ち替え、全員の基準値と次の変化時刻を新しい表で求め直す（キューに残った古い版の項目は捨てられる）
+        基準値が変わった児は "thresholds" イベントを送る"""
+        now = now or self.clock()
+        events = []
+        with self._cond:
+            self.tables = tables
+            for patient_id, entry in self._infants.items():
+                entry["version"] += 1
+                new = get_census_thresholds(entry["infant"], now, tables)
+                if new != entry["thresholds"]:
+                    events.append({
+                        "type": "thresholds",
+                        "patient_id": patient_id,
+                        "at": now,
+                        "thresholds": new,
+                        "previous": entry["thresholds"],
+                    })
+                    entry["thresholds"] = new
+                change_at = next_threshold_change(entry["infant"], now, tables)
+                if change_at is not None:
+                    self._push(change_at, patient_id, entry["version"], "thresholds")
+                if entry["due_index"] < len(entry["due"]):
+                    next_date = entry["due"][entry["due_index"]][0]
+                    self._push(datetime.combine(next_date, datetime.min.time()), patient_id, entry["version"], "due")
+            self._cond.notify()
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, events)
+        return events
+
+    def discharge(self, patient_id):
+        with self._cond:
+            # キューの項目は残るが、取り出したときに患者がいないため捨てられる
+            self._infants.pop(patient_id, None)
+            self._cond.notify()
+
+    def thresholds(self, patient_id):
+        with self._cond:
+            entry = self._infants.get(patient_id)
+            return None if entry is None else entry["thresholds"]
+
+    def census_size(self):
+        with self._cond:
+            return len(self._infants)
+
+    def next_wakeup(self):
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap:
+            _, _, patient_id, version, _, _ = self._heap[0]
+            entry = self._infants.get(patient_id)
+            if entry is not None and entry["version"] == version:
+                return
+            heapq.heappop(self._heap)
+
+    def run_due(self, now=None):
+        """時刻 now までに来た項目を処理し、発生したイベントを購読者に送って返す"""
+        now = now or self.clock()
+        events = []
+        with self._cond:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                when, _, patient_id, version, kind, _ = heapq.heappop(self._heap)
+                entry = self._infants[patient_id]
+                if kind == "thresholds":
+                    events.extend(self._process_threshold_change(patient_id, entry, when))
+                else:
+                    events.extend(self._process_due(patient_id, entry, when))
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, events)
+        return events
+
+    def _process_threshold_change(self, patient_id, entry, when):
+        # 境目の時刻ちょうどで再計算する（処理が遅れても時刻ごとの変化を取りこぼさない）
+        infant = entry["infant"]
+        new = get_census_thresholds(infant, when, self.tables)
+        events = []
+        if new != entry["thresholds"]:
+            events.append({
+                "type": "thresholds",
+                "patient_id": patient_id,
+                "at": when,
+                "thresholds": new,
+                "previous": entry["thresholds"],
+            })
+            entry["thresholds"] = new
+        change_at = next_threshold_change(infant, when, self.tables)
+        if change_at is not None:
+            self._push(change_at, patient_id, entry["version"], "thresholds")
+        return events
+
+    def _process_due(self, patient_id, entry, when):
+        events = []
+        due = entry["due"]
+        # 同じ日の項目はまとめて通知する
+        while entry["due_index"] < len(due) and due[entry["due_index"]][0] <= when.date():
+            due_date, item_id, label = due[entry["due_index"]]
+            events.append({
+                "type": "due",
+                "patient_id": patient_id,
+                "at": when,
+                "due_date": due_date,
+                "item_id": item_id,
+                "label": label,
+            })
+            entry["due_index"] += 1
+        if entry["due_index"] < len(due):
+            next_date = due[entry["due_index"]][0]
+            self._push(datetime.combine(next_date, datetime.min.time()), patient_id, entry["version"], "due")
+        return events
+
+    def _publish(self, subscribers, events):
+        for event in events:
+            for callback in subscribers:
+                callback(event)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name="census-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            thread.join()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._drop_stale()
+                if self._heap:
+                    timeout = max((self._heap[0][0] - self.clock()).total_seconds(), 0)
+                else:
+                    timeout = None
+                if timeout is None or timeout > 0:
+                    # 入院・退院・停止の通知か、次の予定時刻まで待つ
+                    self._cond.wait(timeout)
+                    continue
+            self.run_due()
@@ -0,0 +1,249 @@
+"""コホート全体を出生体格の平面（体重Z × 身長Z）に重ねて表示する
+
+    python cohort_plane.py --synthetic 100000
+
+在胎週数・性別・出生順位が異なる児を同じ平面に載せるため、LMSでZスコアに直してから描く。
+Zスコアの平面では -2SD/10%ile/90%ile の線が全児共通になるので、SGA/LFD/AGA/HFD の領域は1組で済む。
+点の数が COHORT_SCATTER_MAX_POINTS を超えたら、サーバー側で格子に集計してヒートマップで描く。
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import sys
+import time
+
+import numpy as np
+import plotly.graph_objects as go
+
+from lms import get_birth_size_thresholds_batch, value_to_lms_z_values
+
+Z_MINUS2 = -2.0
+Z_P10 = -1.281551565545
+Z_P90 = 1.281551565545
+
+# これより多い点は Scattergl でも重くなるため、格子集計に切り替える
+COHORT_SCATTER_MAX_POINTS = 20000
+COHORT_BIN_SIZE_Z = 0.1
+COHORT_Z_RANGE = (-5.0, 5.0)
+
+# アップロードするコホートの列（JSON Lines のキーも同じ）
+COHORT_FIELDS = ("gender", "is_first_child", "gestational_weeks", "gestational_days", "birth_weight_g", "birth_length_cm")
+# 任意の列（頭囲・病棟・出生日はZスコアのドリフト監視、risk_mask は列指向ストアの適応判定に使う）
+COHORT_OPTIONAL_FIELDS = ("birth_hc_cm", "unit", "birth_date", "risk_mask")
+
+
+def cohort_birth_size_z_all(taikaku_rows, patients):
+    """患者の一覧から {"weight", "length", "hc"} のZスコア配列を作る。性別・出生順位ごとにまとめて計算する
+    患者は birth_weight_g / birth_length_cm / birth_hc_cm（任意）/ gestational_weeks / gestational_days / gender / is_first_child を持つ"""
+    n = len(patients)
+    fields = {"weight": ("birth_weight_g", "weight_lms"), "length": ("birth_length_cm", "height_lms"), "hc": ("birth_hc_cm", "hc_lms")}
+    result = {measure: np.full(n, np.nan) for measure in fields}
+    groups = {}
+    for i, p in enumerate(patients):
+        groups.setdefault((p["gender"], bool(p["is_first_child"])), []).append(i)
+
+    for (gender, first), index in groups.items():
+        index = np.array(index)
+        subset = [patients[i] for i in index]
+        lms = get_birth_size_thresholds_batch(
+            taikaku_rows, gender, first,
+            [p["gestational_weeks"] for p in subset],
+            [p["gestational_days"] for p in subset],
+        )
+        for measure, (field, lms_key) in fields.items():
+            values = np.array([np.nan if p.get(field) is None else p[field] for p in subset], dtype=float)
+            table = lms[lms_key]
+            result[measure][index] = value_to_lms_z_values(table[:, 0], table[:, 1], table[:, 2], values)
+    return result
+
+
+def cohort_birth_size_z(taikaku_rows, patients):
+    """患者の一覧から (体重Z, 身長Z) の配列を作る"""
+    z = cohort_birth_size_z_all(taikaku_rows, patients)
+    return z["weight"], z["length"]
+
+
+# 体格の領域（画面の体格分類と同じ規則。SGA (GH) は SGA に含めず別に数える）
+# 身長がない児は画面と同じく体重だけで LFD / AGA / HFD に分け、体重がない児は評価不能
+BIRTH_SIZE_CLASSES = ("SGA (GH)", "SGA", "LFD", "AGA", "HFD / LGA", "評価不能")
+
+
+def classify_birth_size_codes(weight_z, length_z):
+    """児ごとの領域を BIRTH_SIZE_CLASSES の位置（int8）で返す"""
+    w_lt_p10 = weight_z < Z_P10
+    w_gt_p90 = weight_z > Z_P90
+    h_lt_p10 = length_z < Z_P10  # 身長がない児は False（体重 10%ile 未満なら LFD）
+    gh = (weight_z < Z_MINUS2) | (length_z < Z_MINUS2)
+    has_weight = ~np.isnan(weight_z)
+    sga = has_weight & ~np.isnan(length_z) & w_lt_p10 & h_lt_p10
+    conditions = [
+        sga & gh,
+        sga & ~gh,
+        has_weight & w_lt_p10 & ~h_lt_p10,
+        has_weight & ~w_lt_p10 & ~w_gt_p90,
+        has_weight & w_gt_p90,
+    ]
+    return np.select(conditions, range(len(conditions)), default=len(conditions)).astype(np.int8)
+
+
+def classify_birth_size_z(weight_z, length_z):
+    """領域ごとの人数"""
+    counts = np.bincount(classify_birth_size_codes(weight_z, length_z), minlength=len(BIRTH_SIZE_CLASSES))
+    return {zone: int(count) for zone, count in zip(BIRTH_SIZE_CLASSES, counts)}
+
+
+def _add_zone_shapes(fig, lo, hi):
+    # build_birth_size_plane_fig と同じ塗り分け。Zスコアの平面では境界が全児共通
+    zones = [
+        (Z_P90, hi, lo, hi, "rgba(255, 120, 180, 0.14)"),  # HFD/LGA
+        (lo, Z_P10, lo, hi, "rgba(255, 220, 120, 0.08)"),  # LFD
+        (lo, Z_P10, lo, Z_P10, "rgba(110, 230, 160, 0.12)"),  # SGA
+        (lo, Z_MINUS2, lo, Z_P10, "rgba(110, 230, 160, 0.28)"),  # SGA(GH) 左列
+        (Z_MINUS2, Z_P10, lo, Z_MINUS2, "rgba(110, 230, 160, 0.28)"),  # SGA(GH) 下段
+    ]
+    for x0, x1, y0, y1, color in zones:
+        fig.add_shape(type="rect", x0=x0, x1=x1, y0=y0, y1=y1, fillcolor=color, line=dict(width=0), layer="below")
+    for z, dash in [(Z_MINUS2, "dot"), (Z_P10, None), (Z_P90, None)]:
+        fig.add_vline(x=z, line=dict(color="rgba(255,255,255,0.35)", width=1, dash=dash), layer="below")
+    for z, dash in [(Z_MINUS2, "dot"), (Z_P10, None)]:
+        fig.add_hline(y=z, line=dict(color="rgba(255,255,255,0.35)", width=1, dash=dash), layer="below")
+
+    label_font = dict(size=12, color="rgba(255,255,255,0.80)")
+    for x, y, text in [
+        ((Z_P90 + hi) / 2, (Z_P10 + hi) / 2, "HFD / LGA"),
+        ((Z_P10 + Z_P90) / 2, (Z_P10 + hi) / 2, "AGA"),
+        ((lo + Z_P10) / 2, (Z_P10 + hi) / 2, "LFD"),
+        ((Z_MINUS2 + Z_P10) / 2, (Z_MINUS2 + Z_P10) / 2, "SGA"),
+        ((lo + Z_MINUS2) / 2, (lo + Z_MINUS2) / 2, "SGA (GH)"),
+    ]:
+        fig.add_annotation(x=x, y=y, text=text, showarrow=False, font=label_font, bgcolor="rgba(0,0,0,0.22)")
+
+
+def bin_cohort_z(weight_z, length_z, bin_size=COHORT_BIN_SIZE_Z, z_range=COHORT_Z_RANGE):
+    """格子（bin_size 刻み）ごとの人数。範囲外の点は端の格子に寄せる"""
+    edges = np.arange(z_range[0], z_range[1] + bin_size / 2, bin_size)
+    valid = ~np.isnan(weight_z) & ~np.isnan(length_z)
+    x = np.clip(weight_z[valid], z_range[0], z_range[1] - 1e-9)
+    y = np.clip(length_z[valid], z_range[0], z_range[1] - 1e-9)
+    counts, _, _ = np.histogram2d(x, y, bins=[edges, edges])
+    return edges, counts.T  # 行が身長Z、列が体重Z
+
+
+def build_cohort_plane_fig(weight_z, length_z, max_points=COHORT_SCATTER_MAX_POINTS, bin_size=COHORT_BIN_SIZE_Z):
+    """コホートの体格平面。max_points 以下は1点ずつ（WebGL）、超えたら格子集計のヒートマップ"""
+    lo, hi = COHORT_Z_RANGE
+    fig = go.Figure()
+    _add_zone_shapes(fig, lo, hi)
+
+    valid = ~np.isnan(weight_z) & ~np.isnan(length_z)
+    if int(valid.sum()) <= max_points:
+        fig.add_trace(go.Scattergl(
+            x=weight_z[valid],
+            y=length_z[valid],
+            mode="markers",
+            marker=dict(size=4, color="rgba(120, 200, 255, 0.55)"),
+            hovertemplate="体重 %{x:+.2f}SD<br>身長 %{y:+.2f}SD<extra></extra>",
+            showlegend=False,
+        ))
+    else:
+        edges, counts = bin_cohort_z(weight_z, length_z, bin_size)
+        centers = (edges[:-1] + edges[1:]) / 2
+        fig.add_trace(go.Heatmap(
+            x=centers,
+            y=centers,
+            z=np.where(counts > 0, counts, np.nan),  # 0人の格子は塗らない
+            colorscale="Viridis",
+            colorbar=dict(title="人数"),
+            hovertemplate="体重 %{x:+.2f}SD<br>身長 %{y:+.2f}SD<br>%{z:.0f}人<extra></extra>",
+        ))
+
+    fig.update_layout(
+        xaxis=dict(title="出生体重 Zスコア", range=[lo, hi], zeroline=False),
+        yaxis=dict(title="出生身長 Zスコア", range=[lo, hi], zeroline=False),
+        template="plotly_dark",
+        height=560,
+        margin=dict(l=10, r=10, t=40, b=10),
+    )
+    return fig
+
+
+def _parse_csv_row(row):
+    def number(value, cast):
+        value = (value or "").strip()
+        return cast(value) if value else None
+
+    first = (row.get("is_first_child") or "").strip().lower()
+    return {
+        "gender": row["gender"].strip(),
+        "is_first_child": first in ("1", "true", "yes", "初産"),
+        "gestational_weeks": int(row["gestational_weeks"]),
+        "gestational_days": int(row["gestational_days"]),
+        "birth_weight_g": number(row.get("birth_weight_g"), float),
+        "birth_length_cm": number(row.get("birth_length_cm"), float),
+        "birth_hc_cm": number(row.get("birth_hc_cm"), float),
+        "unit": (row.get("unit") or "").strip() or None,
+        "birth_date": (row.get("birth_date") or "").strip() or None,
+        "risk_mask": number(row.get("risk_mask"), int),
+    }
+
+
+def parse_cohort_file(name, data):
+    """アップロードされたコホート（JSON Lines または CSV。列は COHORT_FIELDS と任意の COHORT_OPTIONAL_FIELDS）を患者の一覧にする"""
+    text = data.decode("utf-8-sig")
+    if name.lower().endswith(".csv"):
+        return [_parse_csv_row(row) for row in csv.DictReader(io.StringIO(text))]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def synthetic_cohort(n, seed=0):
+    """動作確認・速度測定用の架空のコホート"""
+    rng = random.Random(seed)
+    cohort = []
+    for _ in range(n):
+        ga_days = min(max(int(rng.gauss(38.5 * 7, 14)), 22 * 7), 41 * 7 + 6)
+        weeks = ga_days / 7.0
+        weight = max(300.0, rng.gauss(3000 - (40 - weeks) * 180, 380))
+        cohort.append({
+            "gender": rng.choice(["男児", "女児"]),
+            "is_first_child": rng.random() < 0.5,
+            "gestational_weeks": ga_days // 7,
+            "gestational_days": ga_days % 7,
+            "birth_weight_g": round(weight),
+            "birth_length_cm": round(max(25.0, rng.gauss(49 - (40 - weeks) * 1.1, 2.0)), 1),
+        })
+    return cohort
+
+
+def main(argv=None):
+    from reference_registry import build_reference_registry
+
+    parser = argparse.ArgumentParser(description="架空のコホートで体格平面の作成時間を測る")
+    parser.add_argument("--synthetic", type=int, default=100000, help="架空のコホートの人数")
+    parser.add_argument("--max-points", type=int, default=COHORT_SCATTER_MAX_POINTS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    registry = build_reference_registry()
+    rows = registry.get(registry.dataset_ids()[0])
+    cohort = synthetic_cohort(args.synthetic, args.seed)
+
+    started = time.perf_counter()
+    weight_z, length_z = cohort_birth_size_z(rows, cohort)
+    z_s = time.perf_counter() - started
+    fig = build_cohort_plane_fig(weight_z, length_z, args.max_points)
+    fig_s = time.perf_counter() - started - z_s
+    payload = fig.to_json()
+    total_s = time.perf_counter() - started
+
+    mode = "格子集計" if len(cohort) > args.max_points else "Scattergl"
+    print(f"{len(cohort):,}人（{mode}）：Zスコア {z_s * 1000:.0f} ms / 図の作成 {fig_s * 1000:.0f} ms / "
+          f"JSON {len(payload) / 1024:.0f} KB / 合計 {total_s * 1000:.0f} ms")
+    for zone, count in classify_birth_size_z(weight_z, length_z).items():
+        print(f"  {zone}: {count:,}人")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""採点済みの出生（Zスコア・体格分類・管理のポイントの適応・光線療法の基準区分）を列指向で保存し、集計する
+
+    python cohort_store.py --synthetic 1000000 --store cohort_store
+    python cohort_store.py --store cohort_store          # 作成済みのストアに集計だけ実行
+
+年別の SGA (GH) 率・在胎区分別の AABR 適応率のような品質指標は、全出生の数列だけを読めば求まる。
+採点結果を列ごとの固定長配列にして、CHUNK_ROWS 行ずつのチャンクに分けて保存する。
+- pyarrow があれば Arrow IPC（非圧縮）で1ファイルに、なければ列ごとの .npy に書く。どちらもメモリマップで開き、コピーせずに読む
+- チャンクごとの最小・最大（ビット列は論理和）を meta.json に持ち、条件に当たりえないチャンクは読まない（述語プッシュダウン）
+- 書き込み時に出生年・在胎日数の順に並べるので、年や在胎での絞り込みはチャンクの読み飛ばしが効く
+条件は (列, 演算子, 値) のタプルの並び（すべて AND）。符号化した列（病棟・性別・体格分類など）は表示名で指定できる。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from cohort_plane import BIRTH_SIZE_CLASSES, Z_P90, classify_birth_size_codes, cohort_birth_size_z_all
+from protocol import MURATA_CATEGORY_ORDER
+from risk_mask import RISK_FLAG_BITS, RISK_FLAGS, guidance_indications, murata_category_index_batch
+from sweep import SWEEP_CHECKS
+
+COHORT_STORE_FORMAT = 1
+CHUNK_ROWS = 1 << 16
+
+# 列名 → 型。値がない場合は整数列は -1、小数列は NaN（Arrow でも null を使わず、常にコピーなしで読めるようにする）
+STORE_COLUMNS = {
+    "birth_year": "int16",
+    "unit": "int16",
+    "gender": "int8",
+    "first_child": "int8",
+    "ga_days": "int16",
+    "ga_band": "int8",
+    "birth_weight_g": "float32",
+    "birth_length_cm": "float32",
+    "weight_z": "float32",
+    "length_z": "float32",
+    "hc_z": "float32",
+    "size_class": "int8",
+    "risk_mask": "int32",
+    "guidance": "int8",
+    "murata_category": "int8",
+}
+
+GENDERS = ("男児", "女児")
+# 在胎区分（get_prematurity_category と同じ境界。34・37・42週0日から上の区分）
+GA_BANDS = ("早産", "後期早産", "正期産", "過期産")
+GA_BAND_CUTS_DAYS = (34 * 7, 37 * 7, 42 * 7)
+# ビット列：guidance は SWEEP_CHECKS の順、risk_mask は risk_mask.RISK_FLAGS の順
+STORE_BIT_LABELS = {
+    "guidance": SWEEP_CHECKS,
+    "risk_mask": RISK_FLAGS,
+}
+# 集計結果の「値なし」の表示
+STORE_MISSING_LABEL = "不明"
+
+STORE_OPERATORS = ("==", "!=", "<", "<=", ">", ">=", "in", "has")
+
+
+def build_cohort_columns(taikaku_rows, patients):
+    """患者の一覧（parse_cohort_file の形）を採点し、(列の辞書, 符号の表示名の辞書) を返す
+    risk_mask（任意）は risk_mask.pack_risk_mask の値。出生体重90%ile以上のビットはZスコアから立てる"""
+    n = len(patients)
+    z = cohort_birth_size_z_all(taikaku_rows, patients)
+    units = sorted({str(p["unit"]) for p in patients if p.get("unit")})
+    unit_codes = {unit: i for i, unit in enumerate(units)}
+
+    def field(name, dtype, missing):
+        return np.array([missing if p.get(name) is None else p[name] for p in patients], dtype=dtype)
+
+    ga_days = np.array([p["gestational_weeks"] * 7 + p["gestational_days"] for p in patients], dtype=np.int64)
+    weight = field("birth_weight_g", float, np.nan)
+    risk = field("risk_mask", np.int64, 0)
+    risk = np.where(z["weight"] >= Z_P90, risk | RISK_FLAG_BITS["weight_ge_p90"], risk)
+
+    guidance = np.zeros(n, dtype=np.int64)
+    indications = guidance_indications(risk, ga_days / 7.0, weight, SWEEP_CHECKS)
+    for i, check in enumerate(SWEEP_CHECKS):
+        guidance |= indications[check].astype(np.int64) << i
+
+    columns = {
+        "birth_year": np.array([int(str(p["birth_date"])[:4]) if p.get("birth_date") else -1 for p in patients]),
+        "unit": np.array([unit_codes[str(p["unit"])] if p.get("unit") else -1 for p in patients]),
+        "gender": np.array([GENDERS.index(p["gender"]) for p in patients]),
+        "first_child": np.array([bool(p["is_first_child"]) for p in patients]),
+        "ga_days": ga_days,
+        "ga_band": np.searchsorted(GA_BAND_CUTS_DAYS, ga_days, side="right"),
+        "birth_weight_g": weight,
+        "birth_length_cm": field("birth_length_cm", float, np.nan),
+        "weight_z": z["weight"],
+        "length_z": z["length"],
+        "hc_z": z["hc"],
+        "size_class": classify_birth_size_codes(z["weight"], z["length"]),
+        "risk_mask": risk,
+        "guidance": guidance,
+        "murata_category": np.where(np.isnan(weight), -1, murata_category_index_batch(np.nan_to_num(weight), risk)),
+    }
+    dictionaries = {
+        "unit": units,
+        "gender": list(GENDERS),
+        "ga_band": list(GA_BANDS),
+        "size_class": list(BIRTH_SIZE_CLASSES),
+        "murata_category": list(MURATA_CATEGORY_ORDER),
+    }
+    return {name: columns[name].astype(dtype) for name, dtype in STORE_COLUMNS.items()}, dictionaries
+
+
+def _zone_maps(columns, chunk_rows):
+    n = len(next(iter(columns.values())))
+    zones = {name: [] for name in columns}
+    bits_any = {name: [] for name in STORE_BIT_LABELS}
+    for start in range(0, n, chunk_rows):
+        for name, values in columns.items():
+            chunk = values[start:start + chunk_rows]
+            if np.issubdtype(chunk.dtype, np.floating):
+                finite = chunk[~np.isnan(chunk)]
+                zones[name].append([float(finite.min()), float(finite.max())] if len(finite) else None)
+            else:
+                zones[name].append([int(chunk.min()), int(chunk.max())])
+            if name in bits_any:
+                bits_any[name].append(int(np.bitwise_or.reduce(chunk)))
+    return zones, bits_any
+
+
+def write_cohort_store(path, columns, dictionaries, chunk_rows=CHUNK_ROWS, use_arrow=None):
+    """列をディレクトリ path に保存する。出生年・在胎日数の順に並べ替え、meta.json を最後に書く"""
+    order = np.lexsort((columns["ga_days"], columns["birth_year"]))
+    columns = {name: np.ascontiguousarray(columns[name][order]) for name in STORE_COLUMNS}
+    n = len(order)
+    if use_arrow is None:
+        try:
+            import pyarrow  # noqa: F401
+            use_arrow = True
+        except ImportError:
+            use_arrow = False
+
+    os.makedirs(path, exist_ok=True)
+    if use_arrow:
+        import pyarrow as pa
+
+        schema = pa.schema([(name, pa.from_numpy_dtype(np.dtype(dtype))) for name, dtype in STORE_COLUMNS.items()])
+        with pa.OSFile(os.path.join(path, "cohort.arrow"), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            for start in range(0, n, chunk_rows):
+                writer.write_batch(pa.record_batch(
+                    [pa.array(columns[name][start:start + chunk_rows]) for name in STORE_COLUMNS], schema=schema
+                ))
+    else:
+        for name, values in columns.items():
+            np.save(os.path.join(path, f"{name}.npy"), values)
+
+    zones, bits_any = _zone_maps(columns, chunk_rows)
+    meta = {
+        "format": COHORT_STORE_FORMAT,
+        "storage": "arrow" if use_arrow else "npy",
+        "rows": n,
+        "chunk_rows": chunk_rows,
+        "columns": STORE_COLUMNS,
+        "dictionaries": dictionaries,
+        "bit_labels": {name: list(labels) for name, labels in STORE_BIT_LABELS.items()},
+        "zones": zones,
+        "bits_any": bits_any,
+    }
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+class CohortStore:
+    """保存した列をメモリマップで開く。scan で条件に合う行の列を、count / rate で集計を返す"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["format"] != COHORT_STORE_FORMAT:
+            raise ValueError(f"ストアの形式が違います（{self.meta['format']}）。作り直してください")
+        self.rows = self.meta["rows"]
+        self.chunk_rows = self.meta["chunk_rows"]
+        self.chunks = -(-self.rows // self.chunk_rows)
+        self.last_scan = {"chunks": self.chunks, "read": 0}
+        if self.meta["storage"] == "arrow":
+            import pyarrow as pa
+
+            self._reader = pa.ipc.open_file(pa.memory_map(os.path.join(path, "cohort.arrow"), "r"))
+            self._arrays = None
+        else:
+            self._reader = None
+            self._arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in self.meta["columns"]}
+
+    def _chunk(self, i, names):
+        if self._reader is not None:
+            batch = self._reader.get_batch(i)
+            return {name: batch.column(name).to_numpy(zero_copy_only=True) for name in names}
+        start = i * self.chunk_rows
+        return {name: self._arrays[name][start:start + self.chunk_rows] for name in names}
+
+    def _resolve(self, column, op, value):
+        # 表示名 → 符号・ビット
+        if column not in self.meta["columns"]:
+            raise KeyError(f"列がありません: {column}")
+        if op not in STORE_OPERATORS:
+            raise ValueError(f"使えない演算子です: {op}")
+        if op == "has":
+            return column, op, 1 << self.meta["bit_labels"][column].index(value)
+        labels = self.meta["dictionaries"].get(column)
+        if labels is not None:
+            if op == "in":
+                value = [labels.index(v) if isinstance(v, str) else v for v in value]
+            elif isinstance(value, str):
+                value = labels.index(value)
+        return column, op, value
+
+    def _chunk_may_match(self, i, predicate):
+        column, op, value = predicate
+        if op == "has":
+            return bool(self.meta["bits_any"][column][i] & value)
+        zone = self.meta["zones"][column][i]
+        if zone is None:  # 値がすべてNaN
+            return op == "!="
+        lo, hi = zone
+        if op == "==":
+            return lo <= value <= hi
+        if op == "!=":
+            return not (lo == hi == value)
+        if op == "<":
+            return lo < value
+        if op == "<=":
+            return lo <= value
+        if op == ">":
+            return hi > value
+        if op == ">=":
+            return hi >= value
+        return any(lo <= v <= hi for v in value)
+
+    @staticmethod
+    def _evaluate(values, op, value):
+        if op == "has":
+            return (values & value) != 0
+        if op == "in":
+            return np.isin(values, value)
+        return {
+            "==": np.equal, "!=": np.not_equal, "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+        }[op](values, value)
+
+    def _matching_chunks(self, where):
+        """(条件に当たりうるチャンクの番号, 符号に直した条件)。読み飛ばした数は last_scan に残す"""
+        predicates = [self._resolve(*p) for p in where]
+        chunks = [i for i in range(self.chunks) if all(self._chunk_may_match(i, p) for p in predicates)]
+        self.last_scan = {"chunks": self.chunks, "read": len(chunks)}
+        return chunks, predicates
+
+    def _chunk_mask(self, arrays, predicates):
+        mask = None
+        for column, op, value in predicates:
+            hit = self._evaluate(arrays[column], op, value)
+            mask = hit if mask is None else mask & hit
+        return mask
+
+    def scan(self, columns, where=()):
+        """条件に合う行の列をチャンクごとに {列: 配列} で返す"""
+        chunks, predicates = self._matching_chunks(where)
+        names = sorted(set(columns) | {p[0] for p in predicates})
+        for i in chunks:
+            arrays = self._chunk(i, names)
+            mask = self._chunk_mask(arrays, predicates)
+            yield {name: arrays[name] if mask is None else arrays[name][mask] for name in columns}
+
+    def _grouped(self, by, where, target):
+        chunks, predicates = self._matching_chunks(where)
+        targets = [self._resolve(*p) for p in target]
+        names = sorted({p[0] for p in predicates + targets} | ({by} if by else set()))
+        totals = {}
+        hits = {}
+        for i in chunks:
+            arrays = self._chunk(i, names)
+            mask = self._chunk_mask(arrays, predicates)
+            size = min(self.chunk_rows, self.rows - i * self.chunk_rows)
+            keys = arrays[by] if by else np.zeros(size, dtype=np.int8)
+            hit = self._chunk_mask(arrays, targets)
+            if mask is not None:
+                keys = keys[mask]
+                hit = None if hit is None else hit[mask]
+            for counts, selected in ((totals, keys), (hits, None if hit is None else keys[hit])):
+                if selected is None:
+                    continue
+                values, n = np.unique(selected, return_counts=True)
+                for value, count in zip(values.tolist(), n.tolist()):
+                    counts[value] = counts.get(value, 0) + count
+        return totals, hits
+
+    def _label(self, by, key):
+        if key == -1:
+            return STORE_MISSING_LABEL
+        labels = self.meta["dictionaries"].get(by)
+        return labels[key] if labels is not None else key
+
+    def count(self, by=None, where=()):
+        """条件に合う人数。by（列名）を渡せば {値の表示名: 人数}"""
+        if not self.rows:
+            return {} if by else 0
+        totals, _ = self._grouped(by, where, ())
+        if not by:
+            return totals.get(0, 0)
+        return {self._label(by, key): totals[key] for key in sorted(totals)}
+
+    def rate(self, target, by=None, where=(), percent=True):
+        """where に合う児のうち target（条件の並び）にも合う割合。by を渡せば {値の表示名: (該当, 母数, 割合)}"""
+        if not self.rows:
+            return {} if by else (0, 0, None)
+        totals, hits = self._grouped(by, where, target)
+        scale = 100.0 if percent else 1.0
+
+        def entry(key):
+            total = totals.get(key, 0)
+            hit = hits.get(key, 0)
+            return hit, total, hit / total * scale if total else None
+
+        if not by:
+            return entry(0)
+        return {self._label(by, key): entry(key) for key in sorted(totals)}
+
+
+# 集計の見本（CLI で表示する）。(見出し, 関数)
+STORE_EXAMPLE_QUERIES = (
+    ("出生年別の SGA (GH) 率", lambda s: s.rate([("size_class", "==", "SGA (GH)")], by="birth_year")),
+    ("在胎区分別の AABR 適応率", lambda s: s.rate([("guidance", "has", "aabr")], by="ga_band")),
+    ("病棟別の眼底検査の適応率（在胎34週以上）", lambda s: s.rate([("guidance", "has", "eye")], by="unit", where=[("ga_days", ">=", 34 * 7)])),
+    ("2025年の早産児の人数（体格分類別）", lambda s: s.count(by="size_class", where=[("birth_year", "==", 2025), ("ga_band", "==", "早産")])),
+    ("出生体重 +2SD 超の人数", lambda s: s.count(where=[("weight_z", ">", 2.0)])),
+)
+
+
+def main(argv=None):
+    from cohort_plane import parse_cohort_file
+    from reference_registry import build_reference_registry
+    from zscore_drift import synthetic_unit_cohort
+
+    parser = argparse.ArgumentParser(description="採点済みの出生を列指向で保存し、品質指標を集計する")
+    parser.add_argument("--store", default="cohort_store", help="ストアのディレクトリ")
+    parser.add_argument("--input", help="保存するコホート（JSON Lines または CSV。cohort_plane と同じ列）")
+    parser.add_argument("--synthetic", type=int, default=0, help="架空のコホートの人数（3年分）で作り直す")
+    parser.add_argument("--npy", action="store_true", help="pyarrow があっても .npy で保存する")
+    args = parser.parse_args(argv)
+
+    if args.input or args.synthetic:
+        registry = build_reference_registry()
+        rows = registry.get(registry.dataset_ids()[0])
+        if args.input:
+            with open(args.input, "rb") as f:
+                cohort = parse_cohort_file(args.input, f.read())
+        else:
+            cohort = synthetic_unit_cohort(rows, args.synthetic, months=36)
+        started = time.perf_counter()
+        columns, dictionaries = build_cohort_columns(rows, cohort)
+        scored_s = time.perf_counter() - started
+        meta = write_cohort_store(args.store, columns, dictionaries, use_arrow=False if args.npy else None)
+        print(f"{len(cohort):,}人を採点 {scored_s:.1f} 秒 / 保存 {time.perf_counter() - started - scored_s:.1f} 秒"
+              f"（{meta['storage']}・{-(-meta['rows'] // meta['chunk_rows'])}チャンク）")
+
+    store = CohortStore(args.store)
+    print(f"{args.store}: {store.rows:,}人（{store.meta['storage']}）")
+    for title, query in STORE_EXAMPLE_QUERIES:
+        started = time.perf_counter()
+        result = query(store)
+        elapsed = time.perf_counter() - started
+        print(f"■ {title}：{elapsed * 1000:.0f} ms（{store.last_scan['read']}/{store.last_scan['chunks']}チャンクを読んだ）")
+        if not isinstance(result, dict):
+            result = {"全体": result}
+        for key, value in result.items():
+            if isinstance(value, tuple):
+                rate = "-" if value[2] is None else f"{value[2]:.2f}%"
+                print(f"  {key}: {rate}（{value[0]:,}/{value[1]:,}人）")
+            else:
+                print(f"  {key}: {value:,}人")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""入院児の実施予定（ケイツー・マススクリーニング・甲状腺・眼底・退院前のMRI/AABR）を実施日順の索引で持つ
+
+    python due_worklist.py --census 2000 --days 14
+
+管理のポイントの日付（get_due_schedule のケイツー・日齢4のスクリーニング、日齢5の甲状腺検査、生後2〜3週毎の
+眼底検査、退院予定日の前のMRI・AABR）を (実施日, 患者ID, 項目ID) で整列したリストに入れておき、
+「今日の予定」「この勤務帯の予定」を二分探索の範囲取得で答える。「期限切れ」は期限日（眼底検査は前回から21日目、
+ほかは実施日と同じ）で整列したもう1つのリストから取る。
+出生日・フラグ・実施済みの記録が変わった児は、その児の項目だけを差し替える（全患者を走査しない）。
+"""
+import argparse
+import bisect
+import sys
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta
+
+import numpy as np
+
+from protocol import GUIDANCE_RULES, get_due_schedule
+from risk_mask import guidance_indications
+
+# 日付を決められる検査と、その実施日
+WORKLIST_CHECKS = ("thyroid", "eye", "mri", "aabr")
+WORKLIST_THYROID_DAY = 5  # 日齢5でTSH/FT4
+WORKLIST_EYE_INTERVAL_DAYS = (14, 21)  # 生後2〜3週毎（前回から14日目を実施日、21日目を期限とする）
+WORKLIST_PREDISCHARGE_LEAD_DAYS = 3  # 退院予定日の何日前にMRI・AABRを予定するか
+WORKLIST_ELBW_MRI_WEEKS = 37  # 極低出生体重児のMRIは修正37週以降
+
+# 勤務帯（開始時刻, 終了時刻）。終了が開始より前なら翌日まで
+WORKLIST_SHIFTS = (
+    ("日勤", dt_time(8, 30), dt_time(17, 0)),
+    ("夜勤", dt_time(17, 0), dt_time(8, 30)),
+)
+
+
+def worklist_items(infant):
+    """1児の未実施の予定 {項目ID: (実施日, 表示名, 期限日)}（期限日は眼底検査だけ実施日より後）
+    infant は census_scheduler と同じ項目に加えて risk_mask・completed（ward_counters と同じ）と、
+    任意で last_eye_exam（最後の眼底検査日）・discharge_date（退院予定日）を持つ"""
+    birth_date = infant["birth_date"]
+    completed = set(infant.get("completed", ()))
+    items = {
+        item_id: (due_date, label, due_date)
+        for due_date, item_id, label in get_due_schedule(birth_date)
+        if item_id not in completed
+    }
+    if infant.get("birth_weight") is None:
+        return items
+
+    ga_days = infant["gestational_weeks"] * 7 + infant["gestational_days"]
+    indications = guidance_indications(infant.get("risk_mask", 0), ga_days / 7.0, infant["birth_weight"], WORKLIST_CHECKS)
+    needed = {check for check in WORKLIST_CHECKS if indications[check] and check not in completed}
+    if "thyroid" in needed:
+        thyroid_date = birth_date + timedelta(days=WORKLIST_THYROID_DAY)
+        items["thyroid"] = (thyroid_date, f"{GUIDANCE_RULES['thyroid']['title']}（日齢5）", thyroid_date)
+    if "eye" in needed:
+        last = infant.get("last_eye_exam") or birth_date
+        first, limit = (last + timedelta(days=d) for d in WORKLIST_EYE_INTERVAL_DAYS)
+        items["eye"] = (first, f"{GUIDANCE_RULES['eye']['title']}（{limit.strftime('%m/%d')}まで）", limit)
+
+    discharge_date = infant.get("discharge_date")
+    for check in ("mri", "aabr"):
+        if check not in needed:
+            continue
+        due_date = None if discharge_date is None else discharge_date - timedelta(days=WORKLIST_PREDISCHARGE_LEAD_DAYS)
+        if check == "mri" and infant["birth_weight"] < 1000:
+            # 極低出生体重児は修正37週に達してから
+            earliest = birth_date + timedelta(days=max(WORKLIST_ELBW_MRI_WEEKS * 7 - ga_days, 0))
+            due_date = earliest if due_date is None else max(due_date, earliest)
+        if due_date is not None:
+            items[check] = (due_date, f"{GUIDANCE_RULES[check]['title']}（退院前）", due_date)
+    return items
+
+
+def shift_window(now, shifts=WORKLIST_SHIFTS):
+    """now を含む勤務帯の (名前, 開始, 終了)"""
+    for name, start, end in shifts:
+        for day in (now.date() - timedelta(days=1), now.date()):
+            begin = datetime.combine(day, start)
+            finish = datetime.combine(day + timedelta(days=1) if end <= start else day, end)
+            if begin <= now < finish:
+                return name, begin, finish
+    raise ValueError("勤務帯が1日を覆っていません")
+
+
+class DueWorklist:
+    """(実施日, 患者ID, 項目ID) と (期限日, 患者ID, 項目ID) の整列リスト（二分探索で範囲取得）と、患者ごとの現在の項目"""
+
+    def __init__(self):
+        self._index = []
+        self._limits = []
+        self._patients = {}
+        self._lock = threading.Lock()
+        self.changed = 0
+
+    def _remove(self, patient_id, item_id, item):
+        due_date, _, limit = item
+        del self._index[bisect.bisect_left(self._index, (due_date, patient_id, item_id))]
+        del self._limits[bisect.bisect_left(self._limits, (limit, patient_id, item_id))]
+        self.changed += 1
+
+    def _insert(self, patient_id, item_id, item):
+        due_date, _, limit = item
+        bisect.insort(self._index, (due_date, patient_id, item_id))
+        bisect.insort(self._limits, (limit, patient_id, item_id))
+        self.changed += 1
+
+    def upsert(self, patient_id, infant):
+        """入院または情報更新。実施日・表示名・期限日が変わった項目だけ索引を差し替える"""
+        items = worklist_items(infant)
+        with self._lock:
+            old = self._patients.get(patient_id, {})
+            for item_id, item in old.items():
+                if items.get(item_id) != item:
+                    self._remove(patient_id, item_id, item)
+            for item_id, item in items.items():
+                if old.get(item_id) != item:
+                    self._insert(patient_id, item_id, item)
+            self._patients[patient_id] = items
+
+    def discharge(self, patient_id):
+        with self._lock:
+            for item_id, item in self._patients.pop(patient_id, {}).items():
+                self._remove(patient_id, item_id, item)
+
+    def due_between(self, first, last):
+        """first〜last（両端を含む日付）の予定 [(実施日, 患者ID, 項目ID, 表示名)]（実施日・患者ID順）"""
+        with self._lock:
+            lo = bisect.bisect_left(self._index, (first,))
+            hi = bisect.bisect_left(self._index, (last + timedelta(days=1),))
+            return [key + (self._patients[key[1]][key[2]][1],) for key in self._index[lo:hi]]
+
+    def due_on(self, day):
+        return self.due_between(day, day)
+
+    def overdue(self, today):
+        """期限日が today より前のまま残っている予定 [(実施日, 患者ID, 項目ID, 表示名)]（実施日・患者ID順）"""
+        with self._lock:
+            hi = bisect.bisect_left(self._limits, (today,))
+            items = [(patient_id, item_id, self._patients[patient_id][item_id]) for _, patient_id, item_id in self._limits[:hi]]
+        return sorted((due_date, patient_id, item_id, label) for patient_id, item_id, (due_date, label, _) in items)
+
+    def due_in_shift(self, now, shifts=WORKLIST_SHIFTS):
+        """(勤務帯の名前, 勤務帯にかかる日付の予定)。夜勤は翌日の分も含む"""
+        name, begin, finish = shift_window(now, shifts)
+        return name, self.due_between(begin.date(), (finish - timedelta(microseconds=1)).date())
+
+    def entries(self):
+        with self._lock:
+            return list(self._index)
+
+    def stats(self):
+        with self._lock:
+            return {"patients": len(self._patients), "items": len(self._index), "changed": self.changed}
+
+
+def rebuild_worklist(infants):
+    """全患者の予定を作り直して並べる（差分更新と比べる・速度を測るための従来のやり方）"""
+    return sorted(
+        (due_date, patient_id, item_id)
+        for patient_id, infant in infants.items()
+        for item_id, (due_date, _, _) in worklist_items(infant).items()
+    )
+
+
+def main(argv=None):
+    from ward_counters import synthetic_ward
+
+    parser = argparse.ArgumentParser(description="架空の入院児で実施予定の索引の差分更新と作り直しを比べる")
+    parser.add_argument("--census", type=int, default=2000, help="入院児の数")
+    parser.add_argument("--days", type=int, default=14, help="1日ずつ進める日数（毎日 1割の児の記録を更新する）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    now = datetime(2024, 1, 1, 9, 0)
+    infants = synthetic_ward(args.census, now, args.seed)
+    rng = np.random.default_rng(args.seed)
+    for infant in infants.values():
+        if rng.random() < 0.5:
+            infant["discharge_date"] = now.date() + timedelta(days=int(rng.integers(1, 30)))
+
+    worklist = DueWorklist()
+    started = time.perf_counter()
+    for patient_id, infant in infants.items():
+        worklist.upsert(patient_id, infant)
+    print(f"{len(infants):,}人の登録：{(time.perf_counter() - started) * 1000:.0f} ms（予定 {worklist.stats()['items']:,}件）")
+
+    ids = list(infants)
+    update_s = query_s = rebuild_s = 0.0
+    mismatches = 0
+    for day in range(args.days):
+        at = now + timedelta(days=day)
+        # 実施済みの記録（ケイツー・眼底）を付けて更新する
+        started = time.perf_counter()
+        for patient_id in rng.choice(ids, size=max(len(ids) // 10, 1), replace=False):
+            infant = infants[patient_id]
+            infant = dict(infant, completed=tuple(infant.get("completed", ())) + tuple(
+                f"k2_{n}" for n in range(1, 13) if rng.random() < 0.1
+            ))
+            if rng.random() < 0.2:
+                infant["last_eye_exam"] = at.date()
+            infants[patient_id] = infant
+            worklist.upsert(patient_id, infant)
+        update_s += time.perf_counter() - started
+
+        started = time.perf_counter()
+        today = worklist.due_on(at.date())
+        shift_name, shift = worklist.due_in_shift(at)
+        query_s += time.perf_counter() - started
+
+        started = time.perf_counter()
+        rebuilt = rebuild_worklist(infants)
+        expected = [key for key in rebuilt if key[0] == at.date()]
+        rebuild_s += time.perf_counter() - started
+        mismatches += [entry[:3] for entry in today] != expected or worklist.entries() != rebuilt
+
+    print(f"{args.days}日分：更新 {update_s / args.days * 1000:.1f} ms/日（1割の児） / 今日・{shift_name}の予定の取得 "
+          f"{query_s / args.days * 1000:.2f} ms / 作り直し {rebuild_s / args.days * 1000:.0f} ms・不一致 {mismatches}回")
+    print(f"最終日：今日の予定 {len(today):,}件・{shift_name} {len(shift):,}件・期限切れ {len(worklist.overdue(at.date())):,}件")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,802 @@
+"""従来の判定関数と高速版（配列版・スイープ・コンパイル済み基準）の出力が一致するかを
+Hypothesis で生成した患者で確かめ、両方の処理速度を表示する
+
+    python equivalence_harness.py --examples 2000
+
+hypothesis は検証用のため requirements.txt には含めていない（pip install hypothesis）。
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from bilirubin_forecast import first_midnight_hours, thresholds_at_hours
+from due_worklist import DueWorklist, rebuild_worklist, worklist_items
+from ga_estimator import GA_ESTIMATE_MEASURES, estimate_gestational_age_batch
+from lms import (
+    get_birth_size_thresholds,
+    get_birth_size_thresholds_batch,
+    get_lms_keys,
+    lms_to_value,
+    lms_to_values,
+    parse_lms_sheet,
+)
+from protocol import (
+    MORIOKA_TB_THRESHOLDS,
+    MURATA_CATEGORY_ORDER,
+    GUIDANCE_RULES,
+    evaluate_guidance_rules,
+    get_guidance_records,
+    get_kernicterus_risk_factors,
+    get_management_guidance,
+    get_due_schedule,
+    get_morioka_thresholds,
+    get_phototherapy_threshold,
+)
+from guidance_baseline import baseline_guidance_checks
+from offline_bundle import OFFLINE_COMPONENT_DIR, build_offline_bundle
+from protocol_tables import builtin_protocol_tables, compile_protocol_tables, protocol_tables_to_json
+from census_scheduler import get_census_thresholds, next_threshold_change
+from time_schedule import get_time_state, next_time_boundary
+from ward_counters import WARD_COUNTERS, WARD_DUE_CHECKS, WARD_MORIOKA_LINES, WardCounters, recount_ward
+from reference_registry import build_reference_registry
+from risk_mask import (
+    KERNICTERUS_FLAGS,
+    get_guidance_records_from_mask,
+    guidance_indications,
+    kernicterus_risk_factors,
+    pack_risk_mask,
+)
+from sweep import (
+    MORIOKA_TIME_BUCKETS,
+    SWEEP_CHECKS,
+    SWEEP_FLAG_INPUTS,
+    flags_to_mask,
+    morioka_threshold_arrays,
+    phototherapy_threshold_arrays,
+    run_sweep,
+)
+
+# 生成する入力の範囲（在胎20週0日〜42週6日、出生体重500〜6000g）
+GA_MIN_DAYS = 20 * 7
+GA_MAX_DAYS = 42 * 7 + 6
+WEIGHT_MIN_G = 500
+WEIGHT_MAX_G = 6000
+
+# 配列版の LMS と従来版を比べるときの相対誤差（1ulp の違いを許す）
+LMS_REL_TOL = 1e-12
+
+# 管理のポイントで適応理由を表示している行の書き出し
+REASON_PREFIXES = ("・適応理由：", "・保険適応理由：")
+
+
+def _same(a, b):
+    """None と NaN を同じ「値なし」とみなして完全一致を確かめる"""
+    a_missing = a is None or (isinstance(a, float) and math.isnan(a))
+    b_missing = b is None or (isinstance(b, float) and math.isnan(b))
+    if a_missing or b_missing:
+        return a_missing and b_missing
+    return a == b
+
+
+def _close(a, b):
+    """_same の許容誤差つき。配列版の LMS（np.power・np.exp）は libm の pow と最終桁が異なることがある"""
+    a_missing = a is None or (isinstance(a, float) and math.isnan(a))
+    b_missing = b is None or (isinstance(b, float) and math.isnan(b))
+    if a_missing or b_missing:
+        return a_missing and b_missing
+    return math.isclose(a, b, rel_tol=LMS_REL_TOL)
+
+
+def patient_strategy(st):
+    """全入力範囲・全フラグ組合せの患者"""
+    flags = {name: st.booleans() for name in SWEEP_FLAG_INPUTS if name != "apgar_5min_lt7"}
+    flags.update({name: st.booleans() for name in KERNICTERUS_FLAGS if name != "apgar_5min_le3"})
+    return st.fixed_dictionaries({
+        "ga_total_days": st.integers(GA_MIN_DAYS, GA_MAX_DAYS),
+        "weight": st.integers(WEIGHT_MIN_G, WEIGHT_MAX_G),
+        "gender": st.sampled_from(["男児", "女児"]),
+        "is_first_child": st.booleans(),
+        "apgar_score_5min": st.integers(0, 10),
+        "days_old": st.integers(0, 60),
+        "hours_old": st.floats(0, 24 * 14, allow_nan=False),
+        **flags,
+    })
+
+
+def lms_strategy(st, taikaku_rows):
+    """基準表の実際の (L, M, S) と、L=0 の分岐を通す人工的な値"""
+    table_lms = st.sampled_from(sorted(
+        lms for row in taikaku_rows.values() for lms in row.values()
+        if None not in lms
+    ))
+    synthetic = st.tuples(
+        st.sampled_from([0.0, -1.5, -0.5, 0.5, 1.0, 2.0]),
+        st.floats(0.5, 5000),
+        st.floats(0.02, 0.2),
+    )
+    return st.tuples(st.one_of(table_lms, synthetic), st.floats(-4, 4, allow_nan=False))
+
+
+def guidance_inputs(patient):
+    inputs = {
+        "weight": patient["weight"],
+        "gestational_age": patient["ga_total_days"] // 7 + (patient["ga_total_days"] % 7) / 7.0,
+        "apgar_score_5min": patient["apgar_score_5min"],
+    }
+    for flag_name, (field, _, off_value) in SWEEP_FLAG_INPUTS.items():
+        if field not in inputs:
+            inputs[field] = patient.get(flag_name, off_value)
+    for flag_name in KERNICTERUS_FLAGS:
+        if flag_name != "apgar_5min_le3":
+            inputs[flag_name] = patient.get(flag_name, False)
+    return inputs
+
+
+def legacy_records(inputs):
+    return get_guidance_records(
+        inputs["weight"], True, "経腟分娩", inputs["gestational_age"], 0,
+        inputs["maternal_diabetes"], inputs["maternal_thyroid_abnormal"], inputs["apgar_score_5min"],
+        inputs["delivery_stress"], None, None, inputs["exchange_transfusion"], inputs["intracranial_hemorrhage"],
+        inputs["apnea_treatment"], inputs["aminoglycoside_history"], inputs["high_oxygen"],
+        weight_ge_p90=inputs["weight_ge_p90"],
+    )
+
+
+def guidance_flag_inputs(inputs):
+    """管理のポイントの判定に渡すキーワード引数（Apgar と SWEEP_FLAG_INPUTS の各項目）"""
+    fields = ["apgar_score_5min"] + [field for field, _, _ in SWEEP_FLAG_INPUTS.values()]
+    return {field: inputs[field] for field in fields}
+
+
+def legacy_guidance(patient):
+    """GUIDANCE_RULES 導入前の if/elif 実装（guidance_baseline）の判定を {check: (needed, 適応理由の行)} に直す"""
+    inputs = guidance_inputs(patient)
+    checks = baseline_guidance_checks(
+        inputs["weight"], inputs["gestational_age"],
+        **guidance_flag_inputs(inputs)
+    )
+    result = {}
+    for check, special in checks.items():
+        reason_lines = [item for item in special["items"] if item.startswith(REASON_PREFIXES)]
+        result[check] = (special["needed"], reason_lines)
+    return result
+
+
+def management_guidance_mismatches(patient):
+    """get_management_guidance の検査項目を、元の if/elif 実装の表示（見出し・文言・要否）と比べる"""
+    inputs = guidance_inputs(patient)
+    expected = baseline_guidance_checks(
+        inputs["weight"], inputs["gestational_age"],
+        **guidance_flag_inputs(inputs)
+    )
+    titles = {rule["title"]: check for check, rule in GUIDANCE_RULES.items()}
+    guidance = get_management_guidance(
+        inputs["weight"], patient["is_first_child"], "経腟分娩", inputs["gestational_age"], patient["days_old"],
+        **guidance_flag_inputs(inputs)
+    )
+    actual = {}
+    for special in guidance["special_management"]:
+        check = titles.get(special["title"])
+        if check is not None:
+            actual[check] = {key: special.get(key) for key in ("title", "items", "needed")}
+    return [f"{check}.items" for check in SWEEP_CHECKS if actual.get(check) != expected[check]]
+
+
+def compiled_guidance(patient, sweep_result):
+    """スイープの格子（在胎×体重）とフラグ表、GUIDANCE_RULES の適応理由から同じ形を作る"""
+    inputs = guidance_inputs(patient)
+    ga_idx = patient["ga_total_days"] - GA_MIN_DAYS
+    w_idx = patient["weight"] - WEIGHT_MIN_G
+    flags = {name: bool(patient.get(name)) for name in SWEEP_FLAG_INPUTS}
+    flags["apgar_5min_lt7"] = patient["apgar_score_5min"] < 7
+    flag_mask = flags_to_mask(flags)
+    rules = evaluate_guidance_rules(inputs)
+
+    result = {}
+    for check in SWEEP_CHECKS:
+        needed = bool(sweep_result["base"][check][ga_idx, w_idx] or sweep_result["flag"][check][flag_mask])
+        result[check] = (needed, rules[check][1])
+    return result
+
+
+def guidance_mismatches(legacy, compiled):
+    fields = []
+    for check in SWEEP_CHECKS:
+        legacy_needed, reason_lines = legacy[check]
+        needed, reasons = compiled[check]
+        if legacy_needed != needed:
+            fields.append(f"{check}.needed")
+        # 適応理由は従来版が表示している項目（MRI・AABR・眼底）だけ文言まで比べる
+        if any(line.split("：", 1)[1] != "、".join(reasons) for line in reason_lines):
+            fields.append(f"{check}.reasons")
+    return fields
+
+
+MURATA_ROW_FIELDS = ("category", "threshold", "adjusted", "original_category", "is_day0", "day0_threshold")
+
+
+def murata_row(arrays, i):
+    """phototherapy_threshold_arrays の1要素を get_phototherapy_threshold と同じ6要素のタプルにする"""
+    threshold = float(arrays["threshold"][i])
+    return (
+        MURATA_CATEGORY_ORDER[arrays["category_index"][i]],
+        None if math.isnan(threshold) else threshold,
+        bool(arrays["adjusted"][i]),
+        MURATA_CATEGORY_ORDER[arrays["original_index"][i]],
+        bool(arrays["is_day0"][i]),
+        None,
+    )
+
+
+def morioka_row(pca_weeks, hours_old):
+    """morioka_threshold_arrays の1要素を get_morioka_thresholds と同じ形にする"""
+    arrays = morioka_threshold_arrays(np.array([pca_weeks]), hours_old)
+    group_index = int(arrays["group_index"][0])
+    if group_index < 0:
+        return None
+    tb = arrays["tb"][0]
+    ub = arrays["ub"][0]
+    return {
+        "pca_group": list(MORIOKA_TB_THRESHOLDS.keys())[group_index],
+        "time_bucket_hours": arrays["time_bucket_hours"],
+        "tb": {"low": tb[0], "high": tb[1], "exchange": tb[2]},
+        "ub": {"low": ub[0], "high": ub[1], "exchange": ub[2]},
+    }
+
+
+def morioka_mismatches(legacy, compiled):
+    if legacy is None or compiled is None:
+        return [] if legacy is None and compiled is None else ["found"]
+    fields = []
+    for field in ("pca_group", "time_bucket_hours"):
+        if legacy[field] != compiled[field]:
+            fields.append(field)
+    for part in ("tb", "ub"):
+        for name in ("low", "high", "exchange"):
+            if not _same(legacy[part][name], compiled[part][name]):
+                fields.append(f"{part}.{name}")
+    return fields
+
+
+def birth_size_mismatches(legacy, batch, i):
+    if legacy is None:
+        return [] if not batch["found"][i] else ["found"]
+    if not batch["found"][i]:
+        return ["found"]
+    fields = []
+    for field, value in legacy.items():
+        if field.endswith("_lms"):
+            compiled = tuple(None if math.isnan(v) else float(v) for v in batch[field][i])
+            if tuple(value) != compiled:
+                fields.append(field)
+        elif not _close(value, float(batch[field][i])):
+            fields.append(field)
+    return fields
+
+
+# 在胎週数推定に渡す測定値の範囲
+GA_ESTIMATE_RANGES = {"weight": (200.0, 5500.0), "length": (20.0, 60.0), "hc": (15.0, 40.0)}
+GA_ESTIMATE_ARGS = {"weight": "weight_g", "length": "length_cm", "hc": "hc_cm"}
+
+
+def ga_estimate_strategy(st):
+    return st.fixed_dictionaries({
+        "gender": st.sampled_from(["男児", "女児"]),
+        "is_first_child": st.booleans(),
+        "measure": st.sampled_from(GA_ESTIMATE_MEASURES),
+        "fraction": st.floats(0, 1),
+    }).map(lambda c: dict(c, value=GA_ESTIMATE_RANGES[c["measure"]][0] + c["fraction"] * (
+        GA_ESTIMATE_RANGES[c["measure"]][1] - GA_ESTIMATE_RANGES[c["measure"]][0])))
+
+
+def scan_ga_estimate(taikaku_rows, column, value):
+    """全 (週, 日) 行を順に見て、10〜90%ile に入る在胎日数の範囲と 50%ile の在胎日数を求める（従来の方法）"""
+    in_range = []
+    previous = None
+    p50_days = None
+    median_found = False
+    for week, day in sorted(taikaku_rows):
+        L, M, S = taikaku_rows[(week, day)][column]
+        total_days = week * 7 + day
+        if lms_to_value(L, M, S, -1.281551565545) <= value <= lms_to_value(L, M, S, 1.281551565545):
+            in_range.append(total_days)
+        if not median_found and M >= value:
+            median_found = True
+            if previous is not None:
+                prev_days, prev_m = previous
+                p50_days = prev_days + (value - prev_m) / (M - prev_m) * (total_days - prev_days)
+            elif M == value:
+                p50_days = float(total_days)
+        previous = (total_days, M)
+    return (min(in_range), max(in_range)) if in_range else None, p50_days
+
+
+def legacy_thresholds_at(p, birth_minute):
+    """get_time_state・get_phototherapy_threshold で求めた (森岡 low, high, 交換輸血, 村田) と出生後時間・最初の0時"""
+    birth_dt = datetime(2024, 1, 1) + timedelta(minutes=birth_minute)
+    now = birth_dt + timedelta(hours=p["hours_old"])
+    state = get_time_state(birth_dt.date(), birth_dt.time(), p["ga_total_days"] // 7, p["ga_total_days"] % 7, now)
+    risk = bool(kernicterus_risk_factors(pack_risk_mask(guidance_inputs(p))))
+    murata = get_phototherapy_threshold(p["weight"], state["days_old"], risk)[1]
+    morioka = state["morioka"]
+    tb = (None, None, None) if morioka is None else tuple(float(v) for v in morioka["tb"].values())
+    return tb + (murata,), state["hours_old"], first_midnight_hours(birth_dt)
+
+
+# 病棟の集計の操作列：時刻はこの時刻から進める
+WARD_START = datetime(2024, 1, 1, 8, 0)
+WARD_OPERATIONS = ("upsert", "tb", "complete", "discharge")
+WARD_COMPLETED_ITEMS = WARD_DUE_CHECKS + ("k2_1", "k2_2", "k2_3", "k2_4")
+
+
+def ward_ops_strategy(st):
+    """(患者番号, 操作, 患者, TB, 実施済みにする項目, 次の操作までの時間) の並び"""
+    return st.lists(st.tuples(
+        st.integers(0, 4),
+        st.sampled_from(WARD_OPERATIONS),
+        patient_strategy(st),
+        st.floats(0, 30, allow_nan=False),
+        st.sampled_from(WARD_COMPLETED_ITEMS),
+        st.floats(0, 96, allow_nan=False),
+    ), min_size=1, max_size=20)
+
+
+def ward_infant(p):
+    """(WardCounters に渡す児, get_guidance_records の入力)。出生は WARD_START の hours_old 時間前"""
+    birth_dt = WARD_START - timedelta(hours=p["hours_old"])
+    inputs = guidance_inputs(p)
+    mask = pack_risk_mask(inputs)
+    return {
+        "birth_date": birth_dt.date(),
+        "birth_time": birth_dt.time(),
+        "gestational_weeks": p["ga_total_days"] // 7,
+        "gestational_days": p["ga_total_days"] % 7,
+        "birth_weight": p["weight"],
+        "has_kernicterus_risk": bool(kernicterus_risk_factors(mask)),
+        "risk_mask": mask,
+        "completed": (),
+    }, inputs
+
+
+def legacy_ward_counts(model, now):
+    """get_guidance_records・get_due_schedule・get_time_state で全員を数え直す"""
+    counts = dict.fromkeys(WARD_COUNTERS, 0)
+    for infant, inputs in model.values():
+        completed = set(infant["completed"])
+        for record in legacy_records(inputs)["records"]:
+            if record.rule_id in WARD_DUE_CHECKS and record.needed and record.rule_id not in completed:
+                counts[f"due_{record.rule_id}"] += 1
+        if any(d == now.date() and i.startswith("k2_") and i not in completed for d, i, _ in get_due_schedule(infant["birth_date"])):
+            counts["k2_today"] += 1
+        if infant.get("tb") is not None:
+            morioka = get_time_state(
+                infant["birth_date"], infant["birth_time"], infant["gestational_weeks"], infant["gestational_days"], now
+            )["morioka"]
+            for line in WARD_MORIOKA_LINES if morioka is not None else ():
+                counts[f"morioka_{line}"] += infant["tb"] >= morioka["tb"][line]
+    return counts
+
+
+def replay_ward(ops, check_each=True):
+    """操作列を差分更新のカウンタに流す。check_each なら操作ごとに数え直しと比べ、不一致の項目名を返す"""
+    counters = WardCounters()
+    model = {}
+    now = WARD_START
+    for index, operation, p, tb, item, step_hours in ops:
+        patient_id = f"P{index}"
+        if operation == "upsert" or patient_id not in model:
+            model[patient_id] = ward_infant(p)
+            counters.upsert(patient_id, model[patient_id][0], now)
+        elif operation == "discharge":
+            del model[patient_id]
+            counters.discharge(patient_id)
+        else:
+            infant, inputs = model[patient_id]
+            changes = {"tb": round(tb, 1)} if operation == "tb" else {"completed": infant["completed"] + (item,)}
+            model[patient_id] = (dict(infant, **changes), inputs)
+            counters.update(patient_id, now, **changes)
+        now += timedelta(hours=step_hours)
+        if check_each:
+            counts = counters.counts(now)
+            expected = legacy_ward_counts(model, now)
+            mismatched = [key for key in WARD_COUNTERS if counts[key] != expected[key]]
+            if mismatched:
+                return mismatched
+    return counters, model, now
+
+
+def replay_worklist(ops):
+    """同じ操作列を実施予定の索引に流し、操作ごとに作り直した索引と比べる（TBの操作は退院予定日の変更に読み替える）"""
+    worklist = DueWorklist()
+    infants = {}
+    now = WARD_START
+    for index, operation, p, tb, item, step_hours in ops:
+        patient_id = f"P{index}"
+        if operation == "upsert" or patient_id not in infants:
+            infants[patient_id] = ward_infant(p)[0]
+        elif operation == "discharge":
+            del infants[patient_id]
+            worklist.discharge(patient_id)
+            continue
+        elif operation == "tb":
+            infants[patient_id] = dict(infants[patient_id], discharge_date=now.date() + timedelta(days=int(tb)))
+        else:
+            infant = infants[patient_id]
+            infants[patient_id] = dict(infant, completed=infant["completed"] + (item,), last_eye_exam=now.date())
+        worklist.upsert(patient_id, infants[patient_id])
+        now += timedelta(hours=step_hours)
+
+        rebuilt = rebuild_worklist(infants)
+        if worklist.entries() != rebuilt:
+            return ["entries"]
+        if [entry[:3] for entry in worklist.due_on(now.date())] != [key for key in rebuilt if key[0] == now.date()]:
+            return ["due_on"]
+        expected_overdue = sorted(
+            (due_date, patient_id, item_id)
+            for patient_id, infant in infants.items()
+            for item_id, (due_date, _, limit) in worklist_items(infant).items()
+            if limit < now.date()
+        )
+        if [entry[:3] for entry in worklist.overdue(now.date())] != expected_overdue:
+            return ["overdue"]
+    return []
+
+
+# ブラウザ内評価（evaluator.js）の村田・井村の基準を node で引き、protocol と比べる。日齢は出生日時が未来の負の値も含める
+OFFLINE_MURATA_WEIGHTS = (800, 999, 1000, 1499, 1500, 1999, 2000, 2499, 2500, 3500)
+OFFLINE_MURATA_DAYS = range(-3, 11)
+OFFLINE_NODE_SCRIPT = """
+const api = require(process.argv[1]);
+let text = "";
+process.stdin.on("data", (chunk) => { text += chunk; });
+process.stdin.on("end", () => {
+  const data = JSON.parse(text);
+  const out = data.cases.map(([w, d, risk]) => api.phototherapyThreshold(data.bundle, w, d, risk));
+  process.stdout.write(JSON.stringify(out));
+});
+"""
+
+
+def offline_murata_mismatches(bundle):
+    """evaluator.js の phototherapyThreshold と get_phototherapy_threshold が異なる (体重, 日齢, 危険因子) の一覧"""
+    cases = [(w, d, risk) for w in OFFLINE_MURATA_WEIGHTS for d in OFFLINE_MURATA_DAYS for risk in (False, True)]
+    result = subprocess.run(
+        ["node", "-e", OFFLINE_NODE_SCRIPT, os.path.join(OFFLINE_COMPONENT_DIR, "evaluator.js")],
+        input=json.dumps({"bundle": bundle, "cases": cases}), capture_output=True, text=True, check=True,
+    )
+    mismatches = []
+    for (w, d, risk), js in zip(cases, json.loads(result.stdout)):
+        category, threshold, adjusted, original_category, is_day0, _ = get_phototherapy_threshold(w, d, risk)
+        if (js["category"], js.get("threshold"), js["adjusted"], js["originalCategory"], js["isDay0"]) != (
+            category, threshold, adjusted, original_category, is_day0
+        ):
+            mismatches.append((w, d, risk))
+    return cases, mismatches
+
+
+def run_property(name, strategy, check, examples, seed, collected):
+    """check が不一致の項目名を返したら失敗。失敗時は縮小した反例を返す"""
+    from hypothesis import given, settings, HealthCheck, seed as hypothesis_seed
+
+    failure = {}
+
+    @hypothesis_seed(seed)
+    @settings(max_examples=examples, deadline=None, database=None,
+              suppress_health_check=[HealthCheck.too_slow, HealthCheck.data_too_large])
+    @given(strategy)
+    def prop(case):
+        collected.append(case)
+        fields = check(case)
+        if fields:
+            failure["case"] = case
+            failure["fields"] = fields
+            raise AssertionError(fields)
+
+    try:
+        prop()
+    except AssertionError:
+        return failure
+    return None
+
+
+def measure(fn, repeat=3):
+    """最速の1回の秒数"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="従来の判定関数と高速版の出力一致を確認し、処理速度を比べる")
+    parser.add_argument("--examples", type=int, default=1000, help="関数ごとに生成する入力の数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workbook", default="taikakubirthlongcross_v1.1.xlsx", help="従来経路で読み込む体格基準ワークブック")
+    parser.add_argument("--reference", help="高速経路で使うコンパイル済み基準（reference_datasets.json のID）")
+    args = parser.parse_args(argv)
+
+    try:
+        from hypothesis import strategies as st
+    except ImportError:
+        print("hypothesis がインストールされていません（pip install hypothesis）")
+        return 2
+
+    legacy_rows = parse_lms_sheet(args.workbook)
+    registry = build_reference_registry()
+    reference_id = args.reference or registry.dataset_ids()[0]
+    compiled_rows = registry.get(reference_id)
+    sweep_result = run_sweep(GA_MIN_DAYS, GA_MAX_DAYS, WEIGHT_MIN_G, WEIGHT_MAX_G, 1)
+
+    collected = {"lms": [], "birth_size": [], "guidance": [], "risk_mask": [], "murata": [], "morioka": [], "ga_estimate": [], "forecast": [], "ward": [], "worklist": [], "protocol_tables": []}
+
+    def check_lms(case):
+        (L, M, S), z = case
+        legacy = lms_to_value(L, M, S, z)
+        optimized = float(lms_to_values(L, M, S, z))
+        if isinstance(legacy, complex):
+            # 1 + LSz が負になる人工的な値は従来版が複素数を返すため対象外
+            return []
+        return [] if _close(legacy, optimized) else ["value"]
+
+    def check_birth_size(p):
+        legacy = get_birth_size_thresholds(
+            legacy_rows, p["gender"], p["is_first_child"], p["ga_total_days"] // 7, p["ga_total_days"] % 7
+        )
+        batch = get_birth_size_thresholds_batch(
+            compiled_rows, p["gender"], p["is_first_child"], [p["ga_total_days"] // 7], [p["ga_total_days"] % 7]
+        )
+        return birth_size_mismatches(legacy, batch, 0)
+
+    def check_guidance(p):
+        return (guidance_mismatches(legacy_guidance(p), compiled_guidance(p, sweep_result))
+                + management_guidance_mismatches(p))
+
+    def check_risk_mask(p):
+        inputs = guidance_inputs(p)
+        mask = pack_risk_mask(inputs)
+        fields = []
+        if legacy_records(inputs) != get_guidance_records_from_mask(inputs["weight"], inputs["gestational_age"], mask):
+            fields.append("records")
+        if tuple(get_kernicterus_risk_factors(inputs)) != kernicterus_risk_factors(mask):
+            fields.append("kernicterus")
+        return fields
+
+    def check_murata(p):
+        risk = bool(kernicterus_risk_factors(pack_risk_mask(guidance_inputs(p))))
+        legacy = get_phototherapy_threshold(p["weight"], p["days_old"], risk)
+        arrays = phototherapy_threshold_arrays([p["weight"]], [p["days_old"]], [risk])
+        optimized = murata_row(arrays, 0)
+        return [name for name, a, b in zip(MURATA_ROW_FIELDS, legacy, optimized) if not _same(a, b)]
+
+    def check_morioka(p):
+        pca_weeks = (p["ga_total_days"] + p["days_old"]) // 7
+        return morioka_mismatches(
+            get_morioka_thresholds(pca_weeks, p["hours_old"]), morioka_row(pca_weeks, p["hours_old"])
+        )
+
+    ga_index = registry.ga_index(reference_id)
+
+    def check_ga_estimate(c):
+        column = get_lms_keys(c["gender"], c["is_first_child"])[c["measure"]]
+        legacy_range, legacy_p50 = scan_ga_estimate(legacy_rows, column, c["value"])
+        estimate = estimate_gestational_age_batch(
+            ga_index, c["gender"], c["is_first_child"], **{GA_ESTIMATE_ARGS[c["measure"]]: [c["value"]]}
+        )
+        lo, hi, p50 = (float(estimate[k][0]) for k in ("lo_days", "hi_days", "p50_days"))
+        fields = []
+        if legacy_range != (None if math.isnan(lo) else (int(lo), int(hi))):
+            fields.append("range_days")
+        if not _same(legacy_p50, p50):
+            fields.append("p50_days")
+        return fields
+
+    def check_forecast_thresholds(case):
+        p, birth_minute = case
+        legacy, hours, midnight = legacy_thresholds_at(p, birth_minute)
+        risk = bool(kernicterus_risk_factors(pack_risk_mask(guidance_inputs(p))))
+        optimized = thresholds_at_hours(hours, p["ga_total_days"], midnight, p["weight"], risk)
+        return [line for line, a, b in zip(("low", "high", "exchange", "murata"), legacy, optimized) if not _same(a, float(b))]
+
+    # protocol.py の表を JSON に書き出して読み直した版（差し替え用のファイルと同じ経路で作る）
+    builtin = builtin_protocol_tables()
+    file_tables = compile_protocol_tables(json.loads(json.dumps(protocol_tables_to_json(
+        "harness", builtin.MURATA_PHOTOTHERAPY_THRESHOLDS, builtin.MORIOKA_TB_THRESHOLDS, builtin.MORIOKA_UB_THRESHOLDS,
+    ))))
+
+    def check_protocol_tables(case):
+        p, birth_minute = case
+        birth_dt = datetime(2024, 1, 1) + timedelta(minutes=birth_minute)
+        now = birth_dt + timedelta(hours=p["hours_old"])
+        args = (birth_dt.date(), birth_dt.time(), p["ga_total_days"] // 7, p["ga_total_days"] % 7, now)
+        state = get_time_state(*args, tables=file_tables)
+        risk = bool(kernicterus_risk_factors(pack_risk_mask(guidance_inputs(p))))
+        fields = []
+        if get_time_state(*args) != state:
+            fields.append("morioka")
+        if get_phototherapy_threshold(p["weight"], state["days_old"], risk) != \
+                file_tables.get_phototherapy_threshold(p["weight"], state["days_old"], risk):
+            fields.append("murata")
+        infant = (p["ga_total_days"], first_midnight_hours(birth_dt), p["weight"], risk)
+        if not np.array_equal(thresholds_at_hours(state["hours_old"], *infant),
+                              thresholds_at_hours(state["hours_old"], *infant, tables=file_tables), equal_nan=True):
+            fields.append("thresholds_at_hours")
+        census_infant = {
+            "birth_date": birth_dt.date(), "birth_time": birth_dt.time(), "gestational_weeks": p["ga_total_days"] // 7,
+            "gestational_days": p["ga_total_days"] % 7, "birth_weight": p["weight"], "has_kernicterus_risk": risk,
+        }
+        if get_census_thresholds(census_infant, now) != get_census_thresholds(census_infant, now, file_tables):
+            fields.append("get_census_thresholds")
+        if next_threshold_change(census_infant, now) != next_threshold_change(census_infant, now, file_tables):
+            fields.append("next_threshold_change")
+        if next_time_boundary(*args[:2], now) != next_time_boundary(*args[:2], now, file_tables):
+            fields.append("next_time_boundary")
+        return fields
+
+    def check_ward(ops):
+        result = replay_ward(ops)
+        return result if isinstance(result, list) else []
+
+    patients = patient_strategy(st)
+    properties = [
+        ("lms_to_value", lms_strategy(st, legacy_rows), check_lms, "lms"),
+        ("get_birth_size_thresholds", patients, check_birth_size, "birth_size"),
+        ("get_management_guidance", patients, check_guidance, "guidance"),
+        ("get_guidance_records（リスクマスク）", patients, check_risk_mask, "risk_mask"),
+        ("get_phototherapy_threshold", patients, check_murata, "murata"),
+        ("get_morioka_thresholds", patients, check_morioka, "morioka"),
+        ("ビリルビン予測の基準値（出生後時間から）", st.tuples(patients, st.integers(0, 24 * 60 - 1)),
+         check_forecast_thresholds, "forecast"),
+        ("基準の表（protocol.py ⇔ 版付きファイルから作った表）", st.tuples(patients, st.integers(0, 24 * 60 - 1)),
+         check_protocol_tables, "protocol_tables"),
+        ("在胎週数の推定（全行走査 ⇔ 二分探索）", ga_estimate_strategy(st), check_ga_estimate, "ga_estimate"),
+        ("病棟の集計（全員の数え直し ⇔ 差分更新）", ward_ops_strategy(st), check_ward, "ward"),
+        ("実施予定の索引（作り直し ⇔ 差分更新）", ward_ops_strategy(st), replay_worklist, "worklist"),
+    ]
+
+    failed = False
+    print(f"一致確認（各{args.examples}件、seed={args.seed}、高速経路の基準: {reference_id}）")
+    for name, strategy, check, bucket in properties:
+        failure = run_property(name, strategy, check, args.examples, args.seed, collected[bucket])
+        if failure:
+            failed = True
+            print(f"  ✗ {name}: 不一致 {', '.join(failure['fields'])}")
+            print(f"      反例: {failure['case']}")
+        else:
+            print(f"  ✓ {name}: {len(collected[bucket])}件すべて一致")
+
+    name = "ブラウザ内評価の村田・井村（evaluator.js ⇔ protocol、負の日齢を含む）"
+    if shutil.which("node") is None:
+        print(f"  - {name}: node がないため省略")
+    else:
+        cases, mismatches = offline_murata_mismatches(build_offline_bundle(legacy_rows))
+        if mismatches:
+            failed = True
+            print(f"  ✗ {name}: 不一致 {len(mismatches)}件（体重, 日齢, 危険因子）{mismatches[:5]}")
+        else:
+            print(f"  ✓ {name}: {len(cases)}件すべて一致")
+
+    print("処理速度（生成した入力をそのまま使用。件/秒）")
+
+    def report(name, n, legacy_fn, optimized_fn):
+        legacy_s = measure(legacy_fn)
+        optimized_s = measure(optimized_fn)
+        print(f"  {name}: 従来 {n / legacy_s:,.0f} / 高速 {n / optimized_s:,.0f}（{legacy_s / optimized_s:.1f}倍）")
+
+    lms_cases = [c for c in collected["lms"] if not isinstance(lms_to_value(*c[0], c[1]), complex)]
+    lms_arrays = [np.array([c[0][i] for c in lms_cases]) for i in range(3)] + [np.array([c[1] for c in lms_cases])]
+    report(
+        "lms_to_value", len(lms_cases),
+        lambda: [lms_to_value(L, M, S, z) for (L, M, S), z in lms_cases],
+        lambda: lms_to_values(*lms_arrays),
+    )
+
+    birth = collected["birth_size"]
+    report(
+        "get_birth_size_thresholds", len(birth),
+        lambda: [
+            get_birth_size_thresholds(legacy_rows, p["gender"], p["is_first_child"], p["ga_total_days"] // 7, p["ga_total_days"] % 7)
+            for p in birth
+        ],
+        lambda: [
+            get_birth_size_thresholds_batch(
+                compiled_rows, gender, first,
+                [p["ga_total_days"] // 7 for p in birth if p["gender"] == gender and p["is_first_child"] == first],
+                [p["ga_total_days"] % 7 for p in birth if p["gender"] == gender and p["is_first_child"] == first],
+            )
+            for gender in ("男児", "女児") for first in (True, False)
+        ],
+    )
+
+    guidance = collected["guidance"]
+    report(
+        "get_management_guidance", len(guidance),
+        lambda: [legacy_guidance(p) for p in guidance],
+        lambda: [compiled_guidance(p, sweep_result) for p in guidance],
+    )
+
+    mask_inputs = [guidance_inputs(p) for p in collected["risk_mask"]]
+    masks = np.array([pack_risk_mask(inputs) for inputs in mask_inputs])
+    mask_ga = np.array([inputs["gestational_age"] for inputs in mask_inputs])
+    mask_weight = np.array([inputs["weight"] for inputs in mask_inputs])
+    report(
+        "get_guidance_records（適応判定・1人1整数）", len(mask_inputs),
+        lambda: [legacy_records(inputs) for inputs in mask_inputs],
+        lambda: guidance_indications(masks, mask_ga, mask_weight),
+    )
+
+    murata = collected["murata"]
+    murata_risk = [bool(kernicterus_risk_factors(pack_risk_mask(guidance_inputs(p)))) for p in murata]
+    murata_weights = np.array([p["weight"] for p in murata])
+    murata_days = np.array([p["days_old"] for p in murata])
+    report(
+        "get_phototherapy_threshold", len(murata),
+        lambda: [get_phototherapy_threshold(p["weight"], p["days_old"], r) for p, r in zip(murata, murata_risk)],
+        lambda: phototherapy_threshold_arrays(murata_weights, murata_days, murata_risk),
+    )
+
+    morioka = collected["morioka"]
+    pca = np.array([(p["ga_total_days"] + p["days_old"]) // 7 for p in morioka])
+    hours = np.array([p["hours_old"] for p in morioka])
+
+    def morioka_batch():
+        # 時間帯ごとにまとめて配列版を呼ぶ
+        buckets = np.searchsorted(np.array(MORIOKA_TIME_BUCKETS[:-1]), hours, side="right")
+        for b in np.unique(buckets):
+            morioka_threshold_arrays(pca[buckets == b], hours[buckets == b][0])
+
+    report(
+        "get_morioka_thresholds", len(morioka),
+        lambda: [get_morioka_thresholds((p["ga_total_days"] + p["days_old"]) // 7, p["hours_old"]) for p in morioka],
+        morioka_batch,
+    )
+
+    ga_cases = collected["ga_estimate"]
+
+    def ga_batch():
+        # 層・測定項目ごとにまとめて配列版を呼ぶ
+        groups = {}
+        for c in ga_cases:
+            groups.setdefault((c["gender"], c["is_first_child"], c["measure"]), []).append(c["value"])
+        for (gender, first, measure), values in groups.items():
+            estimate_gestational_age_batch(ga_index, gender, first, **{GA_ESTIMATE_ARGS[measure]: np.array(values)})
+
+    report(
+        "在胎週数の推定", len(ga_cases),
+        lambda: [
+            scan_ga_estimate(legacy_rows, get_lms_keys(c["gender"], c["is_first_child"])[c["measure"]], c["value"])
+            for c in ga_cases
+        ],
+        ga_batch,
+    )
+
+    # 生成した操作列をつないだ病棟で、表示のたびの集計を比べる（従来は全員を数え直す）
+    ward_ops = [op for ops in collected["ward"] for op in ops]
+    ward_ops = [(i % 200, operation, p, tb, item, 0.5) for i, (_, operation, p, tb, item, _) in enumerate(ward_ops)]
+    ward_counters, ward_model, ward_now = replay_ward(ward_ops, check_each=False)
+    ward_infants = {patient_id: infant for patient_id, (infant, _) in ward_model.items()}
+    report(
+        f"病棟の集計（{len(ward_infants)}人・表示1回）", 1,
+        lambda: legacy_ward_counts(ward_model, ward_now),
+        lambda: ward_counters.counts(ward_now),
+    )
+    report(
+        "病棟の集計（同上・ward_counter_keys で数え直す場合）", 1,
+        lambda: recount_ward(ward_infants, ward_now),
+        lambda: ward_counters.counts(ward_now),
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""出生時の体重・身長・頭囲から在胎週数を推定する（分娩予定日が不確かな児向け）
+
+    python ga_estimator.py --weight 2500 --length 46.0 --hc 32.0 --gender 女児 --first
+
+基準データのキャッシュ作成時に、層（性別・出生順位）の列ごとに 10%ile / 50%ile / 90%ile を
+在胎日数順に並べた単調な索引を作っておく。推定は各行のZスコアを計算せず、二分探索だけで答える。
+- 10〜90%ile に入る在胎日数の範囲：90%ile ≧ 値 となる最初の行 〜 10%ile ≦ 値 となる最後の行
+- 50%ile に当たる在胎日数：50%ile の曲線を挟む2行の間で線形補間
+範囲の両端は基準データの範囲（22週0日〜41週6日など）で打ち切られる。
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from lms import PERCENTILE_CURVES, get_lms_keys
+
+GA_INDEX_CURVES = ("10%ile", "50%ile", "90%ile")
+GA_ESTIMATE_MEASURES = ("weight", "length", "hc")
+GA_ESTIMATE_LABELS = {"weight": "体重", "length": "身長", "hc": "頭囲"}
+
+
+def build_ga_index(curves):
+    """パーセンタイル曲線（lms.build_percentile_curves の形）から推定用の索引を作る
+    {"total_days": 在胎日数の配列, "values": {列キー: (3, 行数) の配列（10・50・90%ile）}}
+    M の単調性は基準データの検証で確かめているが、二分探索が必ず成り立つよう累積最大値にしておく"""
+    rows = [next(i for i, (label, _) in enumerate(PERCENTILE_CURVES) if label == name) for name in GA_INDEX_CURVES]
+    index = {"total_days": curves["total_days"], "values": {}}
+    for column, values in curves["values"].items():
+        selected = values[rows]
+        # 値がない行（NaN）は直前の値を引き継ぐ（先頭のNaNは -inf とみなす）
+        selected = np.where(np.isnan(selected), -np.inf, selected)
+        index["values"][column] = np.maximum.accumulate(selected, axis=1)
+    return index
+
+
+def ga_range_batch(index, column, values):
+    """測定値の配列に対する (10〜90%ile に入る最初の在胎日数, 最後の在胎日数, 50%ile の在胎日数)
+    範囲に入る行がない・値がない要素はNaN"""
+    values = np.asarray(values, dtype=float)
+    total_days = index["total_days"].astype(float)
+    p10, p50, p90 = index["values"][column]
+    n = len(total_days)
+
+    first = np.searchsorted(p90, values, side="left")
+    last = np.searchsorted(p10, values, side="right") - 1
+    valid = ~np.isnan(values) & (first <= last) & (first < n) & (last >= 0)
+    lo = np.where(valid, total_days[np.clip(first, 0, n - 1)], np.nan)
+    hi = np.where(valid, total_days[np.clip(last, 0, n - 1)], np.nan)
+
+    # 50%ile：p50[i - 1] < 値 ≦ p50[i] の2行の間で補間。基準データの範囲外はNaN
+    i = np.searchsorted(p50, values, side="left")
+    inside = ~np.isnan(values) & (i < n) & ((i > 0) | (values == p50[0]))
+    right = np.clip(i, 0, n - 1)
+    left = np.clip(i - 1, 0, n - 1)
+    span = p50[right] - p50[left]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(span > 0, (values - p50[left]) / span, 1.0)
+    median = np.where(inside, total_days[left] + fraction * (total_days[right] - total_days[left]), np.nan)
+    return lo, hi, median
+
+
+def estimate_gestational_age_batch(index, gender, is_first_child_bool, weight_g=None, length_cm=None, hc_cm=None):
+    """同じ性別・出生順位の児をまとめて推定する。測定項目ごとの結果と、全項目の範囲の重なりを返す
+    {"measures": {項目: {"lo_days", "hi_days", "p50_days"}}, "lo_days", "hi_days", "p50_days"}
+    全体の p50_days は測定のある項目の平均。渡さなかった項目は推定に使わない"""
+    keys = get_lms_keys(gender, is_first_child_bool)
+    given = {"weight": weight_g, "length": length_cm, "hc": hc_cm}
+    result = {"measures": {}}
+    for measure in GA_ESTIMATE_MEASURES:
+        if given[measure] is None:
+            continue
+        lo, hi, median = ga_range_batch(index, keys[measure], given[measure])
+        result["measures"][measure] = {"lo_days": lo, "hi_days": hi, "p50_days": median}
+
+    if not result["measures"]:
+        raise ValueError("体重・身長・頭囲のいずれかを指定してください")
+    measures = list(result["measures"].values())
+    # NaN（その項目では範囲なし）が1つでもあれば全体も範囲なし
+    lo = np.max([m["lo_days"] for m in measures], axis=0)
+    hi = np.min([m["hi_days"] for m in measures], axis=0)
+    overlap = lo <= hi
+    result["lo_days"] = np.where(overlap, lo, np.nan)
+    result["hi_days"] = np.where(overlap, hi, np.nan)
+    medians = np.array([m["p50_days"] for m in measures])
+    count = (~np.isnan(medians)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result["p50_days"] = np.where(count > 0, np.nansum(medians, axis=0) / count, np.nan)
+    return result
+
+
+def estimate_gestational_age(index, gender, is_first_child_bool, weight_g=None, length_cm=None, hc_cm=None):
+    """1人分の推定。在胎日数の範囲は (最初, 最後) のタプル、該当なしは None"""
+    batch = estimate_gestational_age_batch(
+        index, gender, is_first_child_bool,
+        None if weight_g is None else [weight_g],
+        None if length_cm is None else [length_cm],
+        None if hc_cm is None else [hc_cm],
+    )
+
+    def scalar(entry):
+        lo, hi, median = entry["lo_days"][0], entry["hi_days"][0], entry["p50_days"][0]
+        return {
+            "range_days": None if np.isnan(lo) else (int(lo), int(hi)),
+            "p50_days": None if np.isnan(median) else float(median),
+        }
+
+    result = scalar(batch)
+    result["measures"] = {measure: scalar(entry) for measure, entry in batch["measures"].items()}
+    return result
+
+
+def format_ga_days(days):
+    """在胎日数を「37週3日」の形にする"""
+    if days is None:
+        return "-"
+    days = int(round(days))
+    return f"{days // 7}週{days % 7}日"
+
+
+def main(argv=None):
+    from reference_registry import build_reference_registry
+
+    parser = argparse.ArgumentParser(description="出生時の体格から在胎週数を推定する")
+    parser.add_argument("--weight", type=float, help="出生体重（g）")
+    parser.add_argument("--length", type=float, help="出生身長（cm）")
+    parser.add_argument("--hc", type=float, help="出生頭囲（cm）")
+    parser.add_argument("--gender", default="男児", choices=["男児", "女児"])
+    parser.add_argument("--first", action="store_true", help="初産")
+    parser.add_argument("--reference", help="基準データ（reference_datasets.json のID）")
+    parser.add_argument("--benchmark", type=int, default=0, help="体重だけでまとめて推定する件数（速度測定）")
+    args = parser.parse_args(argv)
+
+    registry = build_reference_registry()
+    reference_id = args.reference or registry.dataset_ids()[0]
+    index = registry.ga_index(reference_id)
+
+    if args.weight is not None or args.length is not None or args.hc is not None:
+        estimate = estimate_gestational_age(index, args.gender, args.first, args.weight, args.length, args.hc)
+        for measure, entry in estimate["measures"].items():
+            rng = entry["range_days"]
+            text = "該当なし" if rng is None else f"{format_ga_days(rng[0])}〜{format_ga_days(rng[1])}"
+            print(f"{GA_ESTIMATE_LABELS[measure]}: 10〜90%ile {text} / 50%ile {format_ga_days(entry['p50_days'])}")
+        rng = estimate["range_days"]
+        text = "該当なし" if rng is None else f"{format_ga_days(rng[0])}〜{format_ga_days(rng[1])}"
+        print(f"全項目: 10〜90%ile {text} / 50%ile {format_ga_days(estimate['p50_days'])}")
+
+    if args.benchmark:
+        weights = np.random.default_rng(0).uniform(400, 4500, args.benchmark)
+        started = time.perf_counter()
+        estimate_gestational_age_batch(index, args.gender, args.first, weight_g=weights)
+        elapsed = time.perf_counter() - started
+        print(f"{args.benchmark:,}件：{elapsed * 1000:.1f} ms（{args.benchmark / elapsed:,.0f}件/秒）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+from bisect import bisect_right
+
+import plotly.graph_objects as go
+
+from lms import PERCENTILE_CURVES, percentile_curve_slice, value_to_lms_z, get_lms_keys
+
+# 入院中の成長評価：出生時体格基準（LMS）を修正週数で引き、Zスコアの推移を追う
+GROWTH_MEASURES = ("weight", "length", "hc")
+GROWTH_MEASURE_LABELS = {"weight": "体重", "length": "身長", "hc": "頭囲"}
+GROWTH_MEASURE_UNITS = {"weight": "g", "length": "cm", "hc": "cm"}
+
+# EUGR（子宮外発育遅延）の判定
+# - 横断的：修正週数時点で10%ile未満
+# - 縦断的：出生時からZスコアが1SD以上低下
+EUGR_Z_CROSS = -1.281551565545
+EUGR_Z_DROP = -1.0
+
+
+def get_growth_profile(gender, is_first_child_bool, gestational_weeks, gestational_days, birth_date, reference_id=None):
+    # 基準データを切り替えた場合も系列を作り直すため、reference_idを含める
+    return (gender, bool(is_first_child_bool), int(gestational_weeks), int(gestational_days), birth_date, reference_id)
+
+
+def growth_pma_days(profile, measure_date):
+    """測定日の修正日数（在胎日数＋日齢）"""
+    _, _, gw, gd, birth_date, _ = profile
+    return gw * 7 + gd + (measure_date - birth_date).days
+
+
+def score_growth_value(taikaku_rows, lms_keys, measure, pma_days, value):
+    # 1測定につき辞書参照1回＋LMS変換1回（履歴の長さに依存しない）
+    if value is None:
+        return None
+    row = taikaku_rows.get((pma_days // 7, pma_days % 7))
+    if row is None:
+        return None
+    L, M, S = row.get(lms_keys[measure], (None, None, None))
+    return value_to_lms_z(L, M, S, value)
+
+
+def new_growth_series(profile):
+    gender, is_first_child_bool = profile[0], profile[1]
+    return {
+        "profile": profile,
+        "lms_keys": get_lms_keys(gender, is_first_child_bool),
+        "version": 0,
+        "entries": [],
+        "points": {m: {"pma_weeks": [], "value": [], "z": []} for m in GROWTH_MEASURES},
+        "birth_z": {m: None for m in GROWTH_MEASURES},
+        "last_z": {m: None for m in GROWTH_MEASURES},
+        "flags": {m: {"cross": False, "drop": False} for m in GROWTH_MEASURES},
+        "figure": None,
+    }
+
+
+def _update_growth_flags(series, measure, z, is_latest):
+    if z is not None and is_latest:
+        series["last_z"][measure] = z
+    last_z = series["last_z"][measure]
+    birth_z = series["birth_z"][measure]
+    series["flags"][measure] = {
+        "cross": last_z is not None and last_z < EUGR_Z_CROSS,
+        "drop": last_z is not None and birth_z is not None and (last_z - birth_z) <= EUGR_Z_DROP,
+    }
+
+
+def add_growth_measurement(series, taikaku_rows, measure_date, weight_g=None, length_cm=None, hc_cm=None):
+    """測定値を1件追加して、その測定のZスコアとEUGR判定を返す（既存の履歴は再計算しない）"""
+    profile = series["profile"]
+    pma_days = growth_pma_days(profile, measure_date)
+    pma_weeks = pma_days / 7.0
+    values = {"weight": weight_g, "length": length_cm, "hc": hc_cm}
+
+    entry = {"date": measure_date, "pma_days": pma_days, "values": values, "z": {}}
+    for measure in GROWTH_MEASURES:
+        value = values[measure]
+        z = score_growth_value(taikaku_rows, series["lms_keys"], measure, pma_days, value)
+        entry["z"][measure] = z
+        if value is None:
+            continue
+
+        points = series["points"][measure]
+        # 通常は時系列順に追記される。過去日付の追加時のみ挿入位置を探す
+        i = bisect_right(points["pma_weeks"], pma_weeks)
+        is_latest = i == len(points["pma_weeks"])
+        points["pma_weeks"].insert(i, pma_weeks)
+        points["value"].insert(i, value)
+        points["z"].insert(i, z)
+
+        if measure_date == profile[4] and series["birth_z"][measure] is None:
+            series["birth_z"][measure] = z
+        _update_growth_flags(series, measure, z, is_latest)
+
+    series["entries"].append(entry)
+    series["version"] += 1
+    return entry
+
+
+def rebuild_growth_series(series, taikaku_rows, profile, birth=(None, None, None)):
+    """出生情報（出生時の体重・身長・頭囲を含む）が修正された場合のみ、保存済みの測定値から系列を作り直す
+    出生時の測定値は birth で置き換え、それ以外の測定値は引き継ぐ"""
+    rebuilt = new_growth_series(profile)
+    rebuilt["birth"] = birth
+    if any(value is not None for value in birth):
+        add_growth_measurement(rebuilt, taikaku_rows, profile[4], *birth)["is_birth"] = True
+    for entry in sorted(series["entries"] if series else (), key=lambda e: e["date"]):
+        if entry["date"] < profile[4] or entry.get("is_birth"):
+            continue
+        v = entry["values"]
+        add_growth_measurement(rebuilt, taikaku_rows, entry["date"], v["weight"], v["length"], v["hc"])
+    return rebuilt
+
+
+def initial_growth_inputs(profile, birth_weight_g=None, birth_length_cm=None, birth_hc_cm=None):
+    """省メモリモード用：出生時の測定値（日付・体重・身長・頭囲のタプル）
+    出生情報の修正が反映されるよう表示のたびにページの値から作り、セッションには追加した測定値だけを残す"""
+    if birth_weight_g is None and birth_length_cm is None and birth_hc_cm is None:
+        return []
+    return [(profile[4], birth_weight_g, birth_length_cm, birth_hc_cm)]
+
+
+def build_growth_series(profile, taikaku_rows, measurements):
+    """測定値のタプルだけから系列を作る（出生日より前の測定は除く）"""
+    series = new_growth_series(profile)
+    for measure_date, weight_g, length_cm, hc_cm in sorted(measurements, key=lambda m: m[0]):
+        if measure_date < profile[4]:
+            continue
+        add_growth_measurement(series, taikaku_rows, measure_date, weight_g, length_cm, hc_cm)
+    return series
+
+
+def get_growth_series(store, patient_id, profile, taikaku_rows, birth_weight_g=None, birth_length_cm=None, birth_hc_cm=None):
+    """患者ごとの系列をキャッシュ（store）から取得。なければ出生時測定値で初期化し、
+    出生情報・出生時測定値が変わっていれば作り直す"""
+    birth = (birth_weight_g, birth_length_cm, birth_hc_cm)
+    series = store.get(patient_id)
+    if series is None or series["profile"] != profile or series.get("birth") != birth:
+        series = rebuild_growth_series(series, taikaku_rows, profile, birth)
+        store[patient_id] = series
+    return series
+
+
+def build_growth_z_fig(series):
+    """Zスコア推移のグラフ。系列の版（version）が変わらない限り作り直さない"""
+    cached = series.get("figure")
+    if cached is not None and cached[0] == series["version"]:
+        return cached[1]
+
+    colors = {"weight": "#1f77b4", "length": "#2ca02c", "hc": "#ff7f0e"}
+    fig = go.Figure()
+    for measure in GROWTH_MEASURES:
+        points = series["points"][measure]
+        if not points["pma_weeks"]:
+            continue
+        unit = GROWTH_MEASURE_UNITS[measure]
+        fig.add_trace(go.Scatter(
+            x=points["pma_weeks"],
+            y=points["z"],
+            customdata=points["value"],
+            mode="lines+markers",
+            name=GROWTH_MEASURE_LABELS[measure],
+            line=dict(color=colors[measure], width=2),
+            hovertemplate=(
+                "修正%{x:.1f}週<br>%{customdata}" + unit + "<br>%{y:+.2f}SD<extra>"
+                + GROWTH_MEASURE_LABELS[measure] + "</extra>"
+            ),
+        ))
+
+    for y, label, dash in [
+        (0.0, "50%ile", None),
+        (EUGR_Z_CROSS, "10%ile", "dash"),
+        (-2.0, "-2SD", "dot"),
+    ]:
+        fig.add_hline(
+            y=y,
+            line_dash=dash,
+            line_color="rgba(255,255,255,0.35)",
+            line_width=1,
+            annotation_text=label,
+            annotation_position="top left",
+        )
+
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=40, b=10),
+        xaxis_title="修正週数（週）",
+        yaxis_title="Zスコア（SD）",
+        template="plotly_dark",
+        height=380,
+        hovermode="closest",
+    )
+    series["figure"] = (series["version"], fig)
+    return fig
+
+
+PERCENTILE_CURVE_DASHES = {"-2SD": "dot", "10%ile": "dash", "50%ile": None, "90%ile": "dash"}
+
+
+def build_percentile_curve_fig(curves, column, measure, points=()):
+    """在胎週数別のパーセンタイル曲線に本児の値を重ねる。曲線は基準データのキャッシュの配列を切り出すだけ
+    points: [(在胎週数, 測定値)]"""
+    weeks, values = percentile_curve_slice(curves, column)
+    unit = GROWTH_MEASURE_UNITS[measure]
+    fig = go.Figure()
+    for (label, _), curve in zip(PERCENTILE_CURVES, values):
+        fig.add_trace(go.Scatter(
+            x=weeks,
+            y=curve,
+            mode="lines",
+            name=label,
+            line=dict(color="rgba(255,255,255,0.55)", width=1, dash=PERCENTILE_CURVE_DASHES[label]),
+            hovertemplate="在胎%{x:.1f}週<br>%{y:.1f}" + unit + "<extra>" + label + "</extra>",
+        ))
+    if points:
+        fig.add_trace(go.Scatter(
+            x=[x for x, _ in points],
+            y=[v for _, v in points],
+            mode="markers",
+            name="本児",
+            marker=dict(size=12, color="#ff4b4b", line=dict(color="white", width=2)),
+            hovertemplate="在胎%{x:.1f}週<br>%{y}" + unit + "<extra>本児</extra>",
+        ))
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=40, b=10),
+        xaxis_title="在胎週数（週）",
+        yaxis_title=f"{GROWTH_MEASURE_LABELS[measure]}（{unit}）",
+        template="plotly_dark",
+        height=380,
+        hovermode="closest",
+    )
+    return fig
@@ -0,0 +1,202 @@
+"""管理のポイント（血糖・甲状腺・頭部MRI・AABR・眼底）の判定を GUIDANCE_RULES に移す前の if/elif 実装
+
+GUIDANCE_RULES から作る get_management_guidance・スイープ・ブラウザ内評価が、元の判定と文言から
+ずれていないかを確かめるための基準（equivalence_harness と offline_bundle.verify_guidance_rules で使う）。
+規則を意図して変えたとき以外は書き換えないこと。
+"""
+
+
+def baseline_guidance_checks(weight, gestational_age, maternal_diabetes=False, maternal_thyroid_abnormal=False,
+                             apgar_score_5min=9, delivery_stress=False, exchange_transfusion=False,
+                             intracranial_hemorrhage=False, apnea_treatment=False, aminoglycoside_history=False,
+                             high_oxygen=False, weight_ge_p90=False):
+    """{検査名: {"title", "items", "needed"}}（get_management_guidance の special_management と同じ形）"""
+    checks = {}
+
+    # 血糖チェック
+    hypoglycemia_risk = (
+        gestational_age < 37 or
+        weight < 2500 or
+        maternal_diabetes or
+        weight_ge_p90 or
+        delivery_stress or
+        apgar_score_5min < 7
+    )
+    if hypoglycemia_risk:
+        checks["hypoglycemia"] = {
+            'title': '🩸 血糖チェック',
+            'items': [
+                '・出生後できるだけ早期にミルクを開始（糖水は避ける）',
+                '・その後も3時間毎に哺乳を継続',
+                '・出生3/6/12時間後に簡易血糖測定を実施'
+            ],
+            'needed': True
+        }
+    else:
+        reason = []
+        if gestational_age >= 37:
+            reason.append("在胎37週以上")
+        if weight >= 2500:
+            reason.append("体重2500g以上")
+        if not maternal_diabetes:
+            reason.append("糖尿病母体なし")
+        if not delivery_stress:
+            reason.append("分娩ストレスなし")
+        if apgar_score_5min >= 7:
+            reason.append("Apgar5分値7以上")
+        checks["hypoglycemia"] = {
+            'title': '🩸 血糖チェック',
+            'items': [f'・適応なし（{"、".join(reason[:3]) if reason else "低血糖リスク因子なし"}）'],
+            'needed': False
+        }
+
+    # 甲状腺機能検査
+    if maternal_thyroid_abnormal:
+        checks["thyroid"] = {
+            'title': '🦋 甲状腺機能検査',
+            'items': [
+                '・適応理由：母体の甲状腺異常あり',
+                '・日齢5でTSH/FT4を測定',
+                '・必要に応じて小児科内分泌に相談'
+            ],
+            'needed': True
+        }
+    else:
+        checks["thyroid"] = {
+            'title': '🦋 甲状腺機能検査',
+            'items': ['・適応なし（母体の甲状腺関連情報なし）'],
+            'needed': False
+        }
+
+    # 頭部MRI
+    mri_needed = (
+        gestational_age < 34 or
+        weight < 1500 or
+        exchange_transfusion or
+        intracranial_hemorrhage
+    )
+    if mri_needed:
+        mri_reasons = []
+        if gestational_age < 34:
+            mri_reasons.append("在胎34週未満")
+        if weight < 1500:
+            mri_reasons.append("体重1500g未満")
+        if exchange_transfusion:
+            mri_reasons.append("交換輸血を実施")
+        if intracranial_hemorrhage:
+            mri_reasons.append("頭蓋内出血")
+        mri_items = [
+            f'・適応理由：{"、".join(mri_reasons)}',
+            '・退院前に頭部MRIを実施',
+            '・時期：全身状態が安定した頃'
+        ]
+        if weight < 1000:  # 極低出生体重児
+            mri_items.append('・極低出生体重児は修正37-44週で検査時体重1500g以上')
+        checks["mri"] = {'title': '🧠 頭部MRI', 'items': mri_items, 'needed': True}
+    else:
+        reason = []
+        if gestational_age >= 34:
+            reason.append("在胎34週以上")
+        if weight >= 1500:
+            reason.append("体重1500g以上")
+        if not exchange_transfusion:
+            reason.append("交換輸血なし")
+        if not intracranial_hemorrhage:
+            reason.append("頭蓋内出血なし")
+        checks["mri"] = {
+            'title': '🧠 頭部MRI',
+            'items': [f'・適応なし（{"、".join(reason[:2]) if reason else "適応条件を満たさない"}）'],
+            'needed': False
+        }
+
+    # AABR
+    aabr_insurance = (
+        gestational_age < 35 or
+        weight <= 1800 or
+        exchange_transfusion or  # 重症黄疸（交換輸血を実施）
+        apnea_treatment or
+        aminoglycoside_history or
+        intracranial_hemorrhage
+    )
+    if aabr_insurance:
+        aabr_reasons = []
+        if gestational_age < 35:
+            aabr_reasons.append("在胎35週未満")
+        if weight <= 1800:
+            aabr_reasons.append("体重1800g以下")
+        if exchange_transfusion:
+            aabr_reasons.append("交換輸血を実施")
+        if apnea_treatment:
+            aabr_reasons.append("無呼吸発作治療")
+        if aminoglycoside_history:
+            aabr_reasons.append("アミノグリコシド投与歴")
+        if intracranial_hemorrhage:
+            aabr_reasons.append("頭蓋内出血")
+        checks["aabr"] = {
+            'title': '👂 AABR',
+            'items': [
+                f'・保険適応理由：{"、".join(aabr_reasons)}',
+                '・時期：全身状態が安定した頃'
+            ],
+            'needed': True
+        }
+    else:
+        reason = []
+        if gestational_age >= 35:
+            reason.append("在胎35週以上")
+        if weight > 1800:
+            reason.append("体重1800g超")
+        if not exchange_transfusion:
+            reason.append("交換輸血なし")
+        if not apnea_treatment:
+            reason.append("無呼吸発作治療なし")
+        if not aminoglycoside_history:
+            reason.append("アミノグリコシド投与歴なし")
+        if not intracranial_hemorrhage:
+            reason.append("頭蓋内出血なし")
+        checks["aabr"] = {
+            'title': '👂 AABR',
+            'items': [f'・保険適応なし（{"、".join(reason[:2]) if reason else "適応条件を満たさない"}。ご家族の希望により自費で実施可能）'],
+            'needed': False
+        }
+
+    # 眼底検査
+    eye_exam_needed = (
+        gestational_age < 34 or
+        weight < 1800 or
+        high_oxygen
+    )
+    if eye_exam_needed:
+        eye_reasons = []
+        if gestational_age < 34:
+            eye_reasons.append("在胎34週未満")
+        if weight < 1800:
+            eye_reasons.append("体重1800g未満")
+        if high_oxygen:
+            eye_reasons.append("高濃度酸素投与歴")
+        checks["eye"] = {
+            'title': '👁️ 眼底検査',
+            'items': [
+                f'・適応理由：{"、".join(eye_reasons)}',
+                '・眼科に診察を依頼する',
+                '・時期：生後2-3週毎',
+                '・準備：サンドールP点眼液を事前に処方しておく',
+                '・眼科宛の院内紹介状を作成し、眼科受診の指示をしておく',
+                '・必要な場合には、眼科処置前後のミルク量を減らす指示を出しておく'
+            ],
+            'needed': True
+        }
+    else:
+        reason = []
+        if gestational_age >= 34:
+            reason.append("在胎34週以上")
+        if weight >= 1800:
+            reason.append("体重1800g以上")
+        if not high_oxygen:
+            reason.append("高濃度酸素投与歴なし")
+        checks["eye"] = {
+            'title': '👁️ 眼底検査',
+            'items': [f'・適応なし（{"、".join(reason[:2]) if reason else "適応条件を満たさない"}）'],
+            'needed': False
+        }
+    return checks
@@ -0,0 +1,67 @@
+import json
+from functools import lru_cache
+
+from protocol import REASON_TEXTS, GUIDANCE_NOTE_TEXTS, guidance_items, guidance_title, k2_third_to_twelfth_text
+
+# 管理のポイント（GuidanceRecord）の表示形式ごとの変換。判定結果の組み合わせごとにキャッシュする
+
+MUTED_STYLE = "color: gray;"
+
+
+@lru_cache(maxsize=4096)
+def render_guidance_markdown(record):
+    """画面表示用（Streamlit の markdown）。適応なしは灰色で表示する"""
+    title = guidance_title(record)
+    items = guidance_items(record)
+    if record.needed:
+        return "\n\n".join([f"**{title}**"] + list(items))
+    return "\n\n".join(
+        [f"<span style='{MUTED_STYLE}'><b>{title}</b></span>"]
+        + [f"<span style='{MUTED_STYLE}'>{item}</span>" for item in items]
+    )
+
+
+@lru_cache(maxsize=4096)
+def render_guidance_html(record):
+    title = guidance_title(record)
+    style = "" if record.needed else f" style='{MUTED_STYLE}'"
+    lines = "".join(f"<li>{item.lstrip('・')}</li>" for item in guidance_items(record))
+    return f"<section class='guidance' data-rule='{record.rule_id}'{style}><h4>{title}</h4><ul>{lines}</ul></section>"
+
+
+@lru_cache(maxsize=4096)
+def render_guidance_plain(record):
+    title = guidance_title(record)
+    return "\n".join([title] + [f"  {item}" for item in guidance_items(record)])
+
+
+@lru_cache(maxsize=4096)
+def render_guidance_json(record):
+    """API・外部連携用。理由・注記はコードと表示名の両方を持たせる"""
+    payload = {
+        "rule_id": record.rule_id,
+        "title": guidance_title(record),
+        "needed": record.needed,
+        "reasons": [{"code": code, "text": REASON_TEXTS[code]} for code in record.reasons],
+        "dates": {code: d.isoformat() for code, d in record.dates},
+        "notes": [{"code": code, "text": GUIDANCE_NOTE_TEXTS[code].lstrip("・")} for code in record.notes],
+    }
+    if record.rule_id == "k2":
+        payload["k2_third_to_twelfth"] = k2_third_to_twelfth_text(record)
+    return json.dumps(payload, ensure_ascii=False)
+
+
+GUIDANCE_RENDERERS = {
+    "markdown": render_guidance_markdown,
+    "html": render_guidance_html,
+    "plain": render_guidance_plain,
+    "json": render_guidance_json,
+}
+
+
+def render_guidance(records, fmt="markdown"):
+    """複数項目をまとめて変換する（json は配列、それ以外は空行区切り）"""
+    render = GUIDANCE_RENDERERS[fmt]
+    if fmt == "json":
+        return "[" + ",".join(render(record) for record in records) + "]"
+    return "\n\n".join(render(record) for record in records)
@@ -0,0 +1,244 @@
+import openpyxl
+import math
+import numpy as np
+
+
+def lms_to_value(L, M, S, z):
+    if L is None or M is None or S is None:
+        return None
+    if L == 0:
+        return M * (2.718281828459045 ** (S * z))
+    return M * ((1 + L * S * z) ** (1 / L))
+
+
+def lms_to_values(L, M, S, z):
+    """lms_to_value の配列版。LMSが欠けている要素・計算できない要素はNaN
+    （np.power・np.exp は libm の pow と最終桁（1ulp）が異なることがある）"""
+    L, M, S, z = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (L, M, S, z)))
+    out = np.full(L.shape, np.nan)
+    valid = ~(np.isnan(L) | np.isnan(M) | np.isnan(S))
+    zero = valid & (L == 0)
+    base = 1 + L * S * z
+    nonzero = valid & (L != 0) & (base > 0)
+    out[zero] = M[zero] * np.exp(S[zero] * z[zero])
+    out[nonzero] = M[nonzero] * np.power(base[nonzero], 1 / L[nonzero])
+    return out
+
+
+def value_to_lms_z(L, M, S, value):
+    if L is None or M is None or S is None or value is None:
+        return None
+    if value <= 0 or M <= 0 or S == 0:
+        return None
+    if L == 0:
+        return math.log(value / M) / S
+    return (((value / M) ** L) - 1) / (L * S)
+
+
+def value_to_lms_z_values(L, M, S, values):
+    """value_to_lms_z の配列版。計算できない要素はNaN"""
+    L, M, S, values = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (L, M, S, values)))
+    out = np.full(L.shape, np.nan)
+    valid = ~(np.isnan(L) | np.isnan(M) | np.isnan(S) | np.isnan(values)) & (values > 0) & (M > 0) & (S != 0)
+    zero = valid & (L == 0)
+    nonzero = valid & (L != 0)
+    out[zero] = np.log(values[zero] / M[zero]) / S[zero]
+    out[nonzero] = ((values[nonzero] / M[nonzero]) ** L[nonzero] - 1) / (L[nonzero] * S[nonzero])
+    return out
+
+
+def z_to_percentile(z):
+    if z is None:
+        return None
+    return 50.0 * (1.0 + math.erf(z / math.sqrt(2.0)))
+
+
+# 体格標準値ワークブック（新生児referenceシート）の列配置
+# 各キーは (L, M, S) の列番号。頭囲LMS（Cols 28-30）は性別・出生順位に関わらず共通
+TAIKAKU_BIRTH_COLUMNS = {
+    "maleFB_w": (4, 5, 6),
+    "maleSB_w": (10, 11, 12),
+    "femaleFB_w": (16, 17, 18),
+    "femaleSB_w": (22, 23, 24),
+    "birthH": (34, 35, 36),
+    "maleFB_hc": (28, 29, 30),
+    "maleSB_hc": (28, 29, 30),
+    "femaleFB_hc": (28, 29, 30),
+    "femaleSB_hc": (28, 29, 30),
+}
+
+
+def parse_lms_sheet(path, sheet=7, first_row=7, week_col=2, day_col=3, columns=None, skipped_rows=None):
+    """LMSシートを {(週, 日): {列キー: (L, M, S)}} に変換する。sheetはシート名または番号
+    週の列が空の行は直前の週とみなす（結合セル）。skipped_rows を渡すと、日が空で読み飛ばした行のうち
+    L/M/Sに値がある行の行番号を追記する"""
+    if columns is None:
+        columns = TAIKAKU_BIRTH_COLUMNS
+    wb = openpyxl.load_workbook(path, data_only=True)
+    sheet_name = wb.sheetnames[sheet] if isinstance(sheet, int) else sheet
+    sh = wb[sheet_name]
+
+    rows = {}
+    last_week = None
+    for r in range(first_row, sh.max_row + 1):
+        week = sh.cell(r, week_col).value
+        day = sh.cell(r, day_col).value
+        if week is None:
+            week = last_week
+        if week is None or day is None:
+            if skipped_rows is not None and any(
+                sh.cell(r, c).value is not None for cols in columns.values() for c in cols
+            ):
+                skipped_rows.append(r)
+            continue
+
+        last_week = int(week)
+
+        key = (int(week), int(day))
+        rows[key] = {
+            name: tuple(sh.cell(r, c).value for c in cols)
+            for name, cols in columns.items()
+        }
+
+    return rows
+
+
+def resolve_lms_row_key(taikaku_rows, gestational_weeks, gestational_days):
+    """参照する行のキー。該当日がなければその週の0日、さらに前後7週以内の0日を探す"""
+    key = (int(gestational_weeks), int(gestational_days))
+    if key in taikaku_rows:
+        return key
+    key = (int(gestational_weeks), 0)
+    if key in taikaku_rows:
+        return key
+    w = int(gestational_weeks)
+    for dw in range(1, 8):
+        if (w - dw, 0) in taikaku_rows:
+            return (w - dw, 0)
+        if (w + dw, 0) in taikaku_rows:
+            return (w + dw, 0)
+    return None
+
+
+def get_birth_size_thresholds(taikaku_rows, gender, is_first_child_bool, gestational_weeks, gestational_days):
+    key = resolve_lms_row_key(taikaku_rows, gestational_weeks, gestational_days)
+    if key is None:
+        return None
+    row = taikaku_rows[key]
+
+    if gender == "男児":
+        weight_key = "maleFB_w" if is_first_child_bool else "maleSB_w"
+        hc_key = "maleFB_hc" if is_first_child_bool else "maleSB_hc"
+    else:
+        weight_key = "femaleFB_w" if is_first_child_bool else "femaleSB_w"
+        hc_key = "femaleFB_hc" if is_first_child_bool else "femaleSB_hc"
+
+    wL, wM, wS = row[weight_key]
+    hL, hM, hS = row["birthH"]
+    hcL, hcM, hcS = row.get(hc_key, (None, None, None))
+
+    z10 = -1.281551565545
+    z90 = 1.281551565545
+    z_minus2 = -2.0
+
+    return {
+        "weight_p10_g": lms_to_value(wL, wM, wS, z10),
+        "weight_p90_g": lms_to_value(wL, wM, wS, z90),
+        "weight_minus2sd_g": lms_to_value(wL, wM, wS, z_minus2),
+        "height_p10_cm": lms_to_value(hL, hM, hS, z10),
+        "height_p90_cm": lms_to_value(hL, hM, hS, z90),
+        "height_minus2sd_cm": lms_to_value(hL, hM, hS, z_minus2),
+        "hc_p10_cm": lms_to_value(hcL, hcM, hcS, z10),
+        "hc_p90_cm": lms_to_value(hcL, hcM, hcS, z90),
+        "hc_minus2sd_cm": lms_to_value(hcL, hcM, hcS, z_minus2),
+        "weight_lms": (wL, wM, wS),
+        "height_lms": (hL, hM, hS),
+        "hc_lms": (hcL, hcM, hcS),
+    }
+
+
+# get_birth_size_thresholds が返す閾値の列名と (測定項目, z)
+BIRTH_SIZE_THRESHOLD_FIELDS = {
+    "weight_p10_g": ("weight", -1.281551565545),
+    "weight_p90_g": ("weight", 1.281551565545),
+    "weight_minus2sd_g": ("weight", -2.0),
+    "height_p10_cm": ("height", -1.281551565545),
+    "height_p90_cm": ("height", 1.281551565545),
+    "height_minus2sd_cm": ("height", -2.0),
+    "hc_p10_cm": ("hc", -1.281551565545),
+    "hc_p90_cm": ("hc", 1.281551565545),
+    "hc_minus2sd_cm": ("hc", -2.0),
+}
+
+
+def get_birth_size_thresholds_batch(taikaku_rows, gender, is_first_child_bool, gestational_weeks, gestational_days):
+    """在胎週・日の配列に対する get_birth_size_thresholds。値は配列（該当なしはNaN）、found は参照行の有無"""
+    weeks = np.asarray(gestational_weeks, dtype=np.int64)
+    days = np.asarray(gestational_days, dtype=np.int64)
+    keys = get_lms_keys(gender, is_first_child_bool)
+    measures = {"weight": keys["weight"], "height": keys["length"], "hc": keys["hc"]}
+
+    # 参照行の解決は (週, 日) の種類ごとに1回だけ行う
+    uniq, inverse = np.unique(weeks * 7 + days, return_inverse=True)
+    inverse = inverse.reshape(weeks.shape)
+    lms = {measure: np.full((len(uniq), 3), np.nan) for measure in measures}
+    found = np.zeros(len(uniq), dtype=bool)
+    for i, total_days in enumerate(uniq):
+        key = resolve_lms_row_key(taikaku_rows, total_days // 7, total_days % 7)
+        if key is None:
+            continue
+        found[i] = True
+        row = taikaku_rows[key]
+        for measure, column in measures.items():
+            lms[measure][i] = [np.nan if v is None else v for v in row.get(column, (None, None, None))]
+
+    result = {"found": found[inverse]}
+    for field, (measure, z) in BIRTH_SIZE_THRESHOLD_FIELDS.items():
+        table = lms[measure]
+        result[field] = lms_to_values(table[:, 0], table[:, 1], table[:, 2], z)[inverse]
+    for measure in measures:
+        result[f"{measure}_lms"] = lms[measure][inverse]
+    return result
+
+
+# 成長曲線に描くパーセンタイル（表示名, z）
+PERCENTILE_CURVES = (
+    ("-2SD", -2.0),
+    ("10%ile", -1.281551565545),
+    ("50%ile", 0.0),
+    ("90%ile", 1.281551565545),
+)
+
+
+def build_percentile_curves(taikaku_rows, columns=None):
+    """全 (週, 日) 行のパーセンタイル曲線。基準データのキャッシュ作成時に1回だけ計算する
+    {"total_days": 在胎日数の配列, "values": {列キー: (曲線数, 行数) の配列}}"""
+    keys = sorted(taikaku_rows)
+    z = np.array([z for _, z in PERCENTILE_CURVES])[:, None]
+    curves = {"total_days": np.array([w * 7 + d for w, d in keys], dtype=np.int64), "values": {}}
+    for column in columns or TAIKAKU_BIRTH_COLUMNS:
+        lms = np.array(
+            [[np.nan if v is None else v for v in taikaku_rows[key].get(column, (None, None, None))] for key in keys],
+            dtype=float,
+        ).reshape(len(keys), 3)
+        curves["values"][column] = lms_to_values(lms[:, 0], lms[:, 1], lms[:, 2], z)
+    return curves
+
+
+def percentile_curve_slice(curves, column, start_days=None, end_days=None):
+    """(在胎週数の配列, (曲線数, 行数) の配列)。表示範囲は在胎日数で指定する（配列の切り出しのみ）"""
+    total_days = curves["total_days"]
+    lo = 0 if start_days is None else int(np.searchsorted(total_days, start_days, side="left"))
+    hi = len(total_days) if end_days is None else int(np.searchsorted(total_days, end_days, side="right"))
+    return total_days[lo:hi] / 7.0, curves["values"][column][:, lo:hi]
+
+
+def get_lms_keys(gender, is_first_child_bool):
+    """性別・出生順位から体重/身長/頭囲のLMS列キーを返す"""
+    if gender == "男児":
+        weight_key = "maleFB_w" if is_first_child_bool else "maleSB_w"
+        hc_key = "maleFB_hc" if is_first_child_bool else "maleSB_hc"
+    else:
+        weight_key = "femaleFB_w" if is_first_child_bool else "femaleSB_w"
+        hc_key = "femaleFB_hc" if is_first_child_bool else "femaleSB_hc"
+    return {"weight": weight_key, "length": "birthH", "hc": hc_key}
@@ -0,0 +1,272 @@
+"""病棟の複数端末から同時に操作したときの再実行の待ち時間・CPU・メモリを測る
+
+    python load_test.py --sessions 1,5,10,20 --steps 30
+
+ローカルに Streamlit サーバーを1台起動し、ブラウザと同じ WebSocket（/_stcore/stream）で
+複数セッションを同時に接続して操作する。CPU・メモリはサーバープロセスの増分をセッション数で割った値。
+AppTest はプロセス内で1つしか同時に動かせないため、同時接続の測定には使わない。
+
+websockets は負荷試験用のため requirements.txt には含めていない（pip install websockets）。
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+
+# 核黄疸危険因子のチェックボックス（表示名の先頭で探す）
+KERNICTERUS_CHECKBOX_PREFIXES = [
+    "呼吸窮迫", "アシドーシス", "低体温", "低蛋白血症", "低血糖", "溶血", "敗血症を含む中枢神経系",
+]
+UNKNOWN_CHECKBOX_KEYS = ["birth_weight_unknown", "birth_length_unknown", "birth_head_circumference_unknown"]
+
+
+class LoadSession:
+    """1つのブラウザタブ。表示された入力欄を覚えておき、操作したものの値を毎回送る"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}  # id -> (種類, 表示名, 既定値)
+        self.states = {}  # id -> (種類, 値)
+        self.latencies = []
+        self.errors = 0
+
+    def find(self, kind, label_prefix=None, key=None):
+        for widget_id, (widget_kind, label, _) in self.widgets.items():
+            if widget_kind != kind:
+                continue
+            if key is not None and widget_id.endswith(f"-{key}"):
+                return widget_id
+            if label_prefix is not None and label.startswith(label_prefix):
+                return widget_id
+        return None
+
+    def value(self, widget_id):
+        if widget_id in self.states:
+            return self.states[widget_id][1]
+        return self.widgets[widget_id][2]
+
+    def set(self, widget_id, value):
+        self.states[widget_id] = (self.widgets[widget_id][0], value)
+
+    async def rerun(self):
+        """再実行を依頼し、script_finished までの秒数を返す"""
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        for widget_id, (kind, value) in self.states.items():
+            if widget_id not in self.widgets:
+                continue  # 今回の表示にない入力欄（ラベル等が変わったもの）は送らない
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            if kind == "checkbox":
+                state.bool_value = value
+            elif isinstance(value, int):
+                state.int_value = value
+            else:
+                state.double_value = value
+
+        started = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        widgets = {}
+        while True:
+            fm = ForwardMsg()
+            fm.ParseFromString(await self.ws.recv())
+            kind = fm.WhichOneof("type")
+            if kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                element = fm.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type == "exception":
+                    self.errors += 1
+                elif element_type in ("checkbox", "number_input"):
+                    widget = getattr(element, element_type)
+                    default = widget.default
+                    if element_type == "number_input" and widget.data_type == widget.INT:
+                        default = int(default)
+                    widgets[widget.id] = (element_type, widget.label, default)
+            elif kind == "script_finished":
+                break
+        self.widgets = widgets
+        return time.perf_counter() - started
+
+
+def toggle_kernicterus_risk(session, rng):
+    widget_id = session.find("checkbox", label_prefix=rng.choice(KERNICTERUS_CHECKBOX_PREFIXES))
+    session.set(widget_id, not session.value(widget_id))
+
+
+def edit_weight(session, rng):
+    session.set(session.find("number_input", label_prefix="出生体重"), rng.randint(500, 6000))
+
+
+def toggle_unknown(session, rng):
+    widget_id = session.find("checkbox", key=rng.choice(UNKNOWN_CHECKBOX_KEYS))
+    session.set(widget_id, not session.value(widget_id))
+
+
+def edit_gestation(session, rng):
+    session.set(session.find("number_input", label_prefix="在胎週数"), rng.randint(22, 42))
+    session.set(session.find("number_input", label_prefix="（日）"), rng.randint(0, 6))
+
+
+# 病棟での操作の割合（重み）
+INTERACTION_SCRIPTS = [
+    (toggle_kernicterus_risk, 4),
+    (edit_weight, 3),
+    (toggle_unknown, 1),
+    (edit_gestation, 2),
+]
+
+
+def read_process_usage(pid):
+    """(CPU秒, 常駐メモリのバイト数)。Linux の /proc から読む"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    return cpu, rss
+
+
+def start_server(port):
+    proc = subprocess.Popen(
+        [
+            sys.executable, "-m", "streamlit", "run", APP_PATH,
+            "--server.headless", "true",
+            "--server.port", str(port),
+            "--server.enableXsrfProtection", "false",
+            "--browser.gatherUsageStats", "false",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as r:
+                if r.status == 200:
+                    return proc
+        except OSError:
+            time.sleep(0.3)
+    proc.kill()
+    raise RuntimeError("Streamlit サーバーが起動しませんでした")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile_ms(values, p):
+    if len(values) < 2:
+        return values[0] * 1000 if values else float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1] * 1000
+
+
+async def run_level(url, pid, n_sessions, steps, think_ms, seed):
+    """n_sessions 個のセッションを同時に接続・操作し、集計結果を返す"""
+    import websockets
+
+    cpu_before, rss_before = read_process_usage(pid)
+    wall_before = time.perf_counter()
+    first_loads = []
+    sessions = []
+
+    async def clinician(index, ws):
+        rng = random.Random(seed * 1000 + index)
+        scripts = [fn for fn, _ in INTERACTION_SCRIPTS]
+        weights = [w for _, w in INTERACTION_SCRIPTS]
+        session = LoadSession(ws)
+        sessions.append(session)
+        first_loads.append(await session.rerun())
+        for _ in range(steps):
+            if think_ms:
+                await asyncio.sleep(rng.uniform(0, think_ms) / 1000.0)
+            rng.choices(scripts, weights)[0](session, rng)
+            session.latencies.append(await session.rerun())
+
+    connections = [
+        await websockets.connect(url, subprotocols=["streamlit"], max_size=None, open_timeout=60)
+        for _ in range(n_sessions)
+    ]
+    try:
+        await asyncio.gather(*(clinician(i, ws) for i, ws in enumerate(connections)))
+        # 全セッションが接続したままの状態で測る（開いたままのタブの分）
+        wall = time.perf_counter() - wall_before
+        cpu_after, rss_after = read_process_usage(pid)
+    finally:
+        for ws in connections:
+            await ws.close()
+
+    latencies = [x for s in sessions for x in s.latencies]
+    reruns = len(latencies) + len(first_loads)
+    cpu = cpu_after - cpu_before
+    return {
+        "sessions": n_sessions,
+        "reruns": reruns,
+        "errors": sum(s.errors for s in sessions),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+        "first_load_p50_ms": percentile_ms(first_loads, 50),
+        "cpu_s_per_session": cpu / n_sessions,
+        "cpu_ms_per_rerun": cpu / reruns * 1000 if reruns else float("nan"),
+        "cpu_utilization": cpu / wall if wall else float("nan"),
+        "rss_mb_per_session": (rss_after - rss_before) / n_sessions / 2**20,
+        "rss_mb_total": rss_after / 2**20,
+    }
+
+
+async def run_levels(url, pid, levels, steps, think_ms, seed):
+    # 1回目の読み込み（基準データの読み込み・キャッシュ作成）は測定から外す
+    await run_level(url, pid, 1, 0, 0, seed)
+
+    print("同時数  再実行  p50(ms)  p95(ms)  p99(ms)  初回p50(ms)  CPU/再実行(ms)  CPU/セッション(s)  CPU使用率  RSS増/セッション(MB)  RSS(MB)  エラー")
+    for n in levels:
+        r = await run_level(url, pid, n, steps, think_ms, seed)
+        print(
+            f"{r['sessions']:>6}  {r['reruns']:>6}  {r['p50_ms']:>7.0f}  {r['p95_ms']:>7.0f}  {r['p99_ms']:>7.0f}"
+            f"  {r['first_load_p50_ms']:>11.0f}  {r['cpu_ms_per_rerun']:>14.1f}  {r['cpu_s_per_session']:>17.2f}"
+            f"  {r['cpu_utilization'] * 100:>8.0f}%  {r['rss_mb_per_session']:>20.1f}  {r['rss_mb_total']:>7.0f}  {r['errors']:>6}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同時セッション数ごとの再実行の待ち時間・CPU・メモリを測る")
+    parser.add_argument("--sessions", default="1,5,10", help="同時セッション数（カンマ区切りで段階的に増やす）")
+    parser.add_argument("--steps", type=int, default=20, help="1セッションあたりの操作回数")
+    parser.add_argument("--think-ms", type=float, default=0, help="操作の間隔の上限（ミリ秒、0で間隔なし）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, help="起動するサーバーのポート（省略時は空いているポート）")
+    args = parser.parse_args(argv)
+
+    try:
+        import websockets  # noqa: F401
+    except ImportError:
+        print("websockets がインストールされていません（pip install websockets）")
+        return 2
+
+    port = args.port or free_port()
+    server = start_server(port)
+    try:
+        levels = [int(x) for x in args.sessions.split(",")]
+        asyncio.run(run_levels(f"ws://127.0.0.1:{port}/_stcore/stream", server.pid, levels, args.steps, args.think_ms, args.seed))
+    finally:
+        server.terminate()
+        server.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+
+from protocol import (
+    DELIVERY_STRESS_METHODS,
+    GUIDANCE_RULES,
+    KERNICTERUS_RISK_FACTORS,
+    evaluate_guidance_rules,
+    get_management_guidance,
+)
+from protocol_tables import builtin_protocol_tables
+from guidance_baseline import baseline_guidance_checks
+from sweep import SWEEP_FLAG_INPUTS
+
+# ブラウザ内評価用のバンドル。表・LMS・適応条件はすべてPythonの定義から毎回生成する
+OFFLINE_COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "offline_component")
+OFFLINE_BUNDLE_FILENAME = "bundle.js"
+
+
+def _json_number(value):
+    # JSONにinfは書けないため、上限なしは null で表す
+    if value == float("inf"):
+        return None
+    return value
+
+
+def verify_guidance_rules():
+    """GUIDANCE_RULES と get_management_guidance の判定を、元の if/elif 実装（guidance_baseline）と境界値で比べる"""
+    weights = [999, 1000, 1499, 1500, 1799, 1800, 1801, 2499, 2500, 3000]
+    ga_days = [33 * 7 + 6, 34 * 7, 34 * 7 + 6, 35 * 7, 36 * 7 + 6, 37 * 7, 40 * 7]
+    flag_cases = [{}] + [{name: True} for name in SWEEP_FLAG_INPUTS]
+    titles = {rule["title"]: check for check, rule in GUIDANCE_RULES.items()}
+
+    mismatches = []
+    for weight in weights:
+        for total_days in ga_days:
+            for case in flag_cases:
+                gestational_age = total_days // 7 + (total_days % 7) / 7.0
+                flags = {"apgar_score_5min": 9}
+                for flag_name, (field, on_value, off_value) in SWEEP_FLAG_INPUTS.items():
+                    flags[field] = on_value if case.get(flag_name) else off_value
+                inputs = dict(flags, weight=weight, gestational_age=gestational_age)
+
+                expected = baseline_guidance_checks(weight, gestational_age, **flags)
+                guidance = get_management_guidance(weight, True, "経腟分娩", gestational_age, 1, **flags)
+                actual = {}
+                for special in guidance["special_management"]:
+                    check = titles.get(special["title"])
+                    if check is not None:
+                        actual[check] = {key: special.get(key) for key in ("title", "items", "needed")}
+
+                for check, (needed, reasons) in evaluate_guidance_rules(inputs).items():
+                    special = expected[check]
+                    # 表示は見出し・文言まで、規則は要否と適応理由を比べる（甲状腺の理由は固定文言）
+                    ok = actual.get(check) == special and special["needed"] == needed
+                    for item in special["items"]:
+                        for prefix in ("・適応理由：", "・保険適応理由："):
+                            if needed and item.startswith(prefix) and check != "thyroid":
+                                ok = ok and item == prefix + "、".join(reasons)
+                    if not ok:
+                        mismatches.append((check, weight, total_days, case))
+    return mismatches
+
+
+def build_offline_bundle(taikaku_rows, reference_id=None, tables=None):
+    """ブラウザ内評価のバンドル。村田・森岡の表は tables（protocol_tables.ProtocolTables、None は protocol.py）の版を使う"""
+    if tables is None:
+        tables = builtin_protocol_tables()
+    mismatches = verify_guidance_rules()
+    if mismatches:
+        raise ValueError(f"管理のポイントの判定が元の実装と一致しません: {mismatches[:5]}")
+
+    groups = list(tables.MORIOKA_TB_THRESHOLDS.keys())
+    time_buckets = tables.MORIOKA_TIME_BUCKETS
+    labels = tables.MORIOKA_LABELS["ja"]
+
+    # LMS：同じ列（頭囲など）は1本にまとめ、列名からの参照にする
+    keys = sorted(taikaku_rows.keys())
+    series = []
+    series_index = {}
+    columns = {}
+    for name in next(iter(taikaku_rows.values())).keys() if taikaku_rows else []:
+        values = [list(taikaku_rows[k][name]) for k in keys]
+        marker = json.dumps(values)
+        if marker not in series_index:
+            series_index[marker] = len(series)
+            series.append(values)
+        columns[name] = series_index[marker]
+
+    bundle = {
+        "reference_id": reference_id,
+        "protocol_version": tables.version,
+        "protocol_digest": tables.digest,
+        "murata": {
+            "categories": tables.MURATA_CATEGORY_ORDER,
+            "cutoffs_g": [2500, 2000, 1500, 1000],
+            # 日齢0は未定義（null）
+            "thresholds": [[None] + list(row[1:]) for row in tables.MURATA_THRESHOLD_MATRIX],
+        },
+        "morioka": {
+            "groups": [[low, _json_number(high)] for low, high in groups],
+            "buckets": [_json_number(b) for b in time_buckets],
+            "tb": [[list(tables.MORIOKA_TB_THRESHOLDS[g][b]) for b in time_buckets] for g in groups],
+            "ub": [list(tables.MORIOKA_UB_THRESHOLDS[g]) for g in groups],
+            "group_labels": [labels["groups"][g]["label"] for g in groups],
+            "bucket_labels": [labels["buckets"][b]["label"] for b in time_buckets],
+        },
+        "lms": {"keys": [list(k) for k in keys], "series": series, "columns": columns},
+        "guidance_rules": GUIDANCE_RULES,
+        "kernicterus_risk_factors": KERNICTERUS_RISK_FACTORS,
+        "delivery_stress_methods": DELIVERY_STRESS_METHODS,
+    }
+    payload = json.dumps(bundle, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    bundle["version"] = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+    return bundle
+
+
+def write_offline_bundle(bundle, component_dir=OFFLINE_COMPONENT_DIR):
+    """コンポーネントが読み込む bundle.js を書き出す（内容が同じなら書き換えない）"""
+    path = os.path.join(component_dir, OFFLINE_BUNDLE_FILENAME)
+    text = "window.NEONATAL_BUNDLE = " + json.dumps(bundle, ensure_ascii=False, separators=(",", ":")) + ";\n"
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == text:
+                return path
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+    from lms import parse_lms_sheet
+
+    rows = parse_lms_sheet("taikakubirthlongcross_v1.1.xlsx")
+    out = write_offline_bundle(build_offline_bundle(rows))
+    print(f"{out}（{os.path.getsize(out):,} bytes）")
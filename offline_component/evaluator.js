@@ -0,0 +1,208 @@
+// ブラウザ内評価：offline_bundle.py が生成した NEONATAL_BUNDLE だけで判定する
+// （lms.py / protocol.py / streamlit_app.py の判定と同じ手順）
+(function (root) {
+  "use strict";
+
+  var Z10 = -1.281551565545;
+  var Z90 = 1.281551565545;
+
+  function lmsToValue(L, M, S, z) {
+    if (L === null || M === null || S === null) return null;
+    if (L === 0) return M * Math.pow(2.718281828459045, S * z);
+    return M * Math.pow(1 + L * S * z, 1 / L);
+  }
+
+  function valueToLmsZ(L, M, S, value) {
+    if (L === null || M === null || S === null || value === null) return null;
+    if (value <= 0 || M <= 0 || S === 0) return null;
+    if (L === 0) return Math.log(value / M) / S;
+    return (Math.pow(value / M, L) - 1) / (L * S);
+  }
+
+  function lmsIndex(bundle) {
+    if (!bundle._lmsIndex) {
+      var index = {};
+      bundle.lms.keys.forEach(function (k, i) { index[k[0] + ":" + k[1]] = i; });
+      bundle._lmsIndex = index;
+    }
+    return bundle._lmsIndex;
+  }
+
+  // lms.resolve_lms_row_key と同じ探索順
+  function resolveLmsRow(bundle, weeks, days) {
+    var index = lmsIndex(bundle);
+    var candidates = [weeks + ":" + days, weeks + ":0"];
+    for (var dw = 1; dw < 8; dw++) {
+      candidates.push((weeks - dw) + ":0", (weeks + dw) + ":0");
+    }
+    for (var i = 0; i < candidates.length; i++) {
+      if (candidates[i] in index) return index[candidates[i]];
+    }
+    return null;
+  }
+
+  function lmsAt(bundle, row, column) {
+    var s = bundle.lms.columns[column];
+    if (s === undefined) return [null, null, null];
+    return bundle.lms.series[s][row];
+  }
+
+  function lmsKeys(gender, isFirstChild) {
+    var prefix = gender === "男児" ? "male" : "female";
+    var order = isFirstChild ? "FB" : "SB";
+    return { weight: prefix + order + "_w", length: "birthH", hc: prefix + order + "_hc" };
+  }
+
+  function birthSizeThresholds(bundle, gender, isFirstChild, weeks, days) {
+    var row = resolveLmsRow(bundle, weeks, days);
+    if (row === null) return null;
+    var keys = lmsKeys(gender, isFirstChild);
+    var out = {};
+    ["weight", "length", "hc"].forEach(function (m) {
+      var lms = lmsAt(bundle, row, keys[m]);
+      out[m] = {
+        lms: lms,
+        p10: lmsToValue(lms[0], lms[1], lms[2], Z10),
+        p90: lmsToValue(lms[0], lms[1], lms[2], Z90),
+        minus2sd: lmsToValue(lms[0], lms[1], lms[2], -2.0),
+      };
+    });
+    return out;
+  }
+
+  function classifyBirthSize(t, weight, length) {
+    if (t === null || weight === null) return null;
+    var wLt10 = weight < t.weight.p10;
+    var wGe90 = weight > t.weight.p90;
+    var wLt2 = weight < t.weight.minus2sd;
+    if (wGe90) return "heavy-for-dates (HFD) / large for gestational age (LGA)";
+    if (!wLt10) return "appropriate for gestational age (AGA)";
+    if (length === null) return "light-for-dates (LFD)";
+    var hLt10 = length < t.length.p10;
+    var hLt2 = length < t.length.minus2sd;
+    if (hLt10 && (wLt2 || hLt2)) return "small for gestational age (SGA)（GH適応）";
+    if (hLt10) return "small for gestational age (SGA)（GH適応なし）";
+    return "light-for-dates (LFD)";
+  }
+
+  function conditionMet(c, inputs) {
+    var v = inputs[c.field];
+    if (c.op === undefined) return !!v;
+    if (c.op === "lt") return v < c.value;
+    if (c.op === "le") return v <= c.value;
+    throw new Error("未対応の比較です: " + c.op);
+  }
+
+  function kernicterusRiskFactors(bundle, inputs) {
+    return bundle.kernicterus_risk_factors
+      .filter(function (c) { return conditionMet(c, inputs); })
+      .map(function (c) { return c.reason; });
+  }
+
+  function phototherapyThreshold(bundle, weight, daysOld, hasRisk) {
+    var m = bundle.murata;
+    var original = m.cutoffs_g.length;
+    for (var i = 0; i < m.cutoffs_g.length; i++) {
+      if (weight >= m.cutoffs_g[i]) { original = i; break; }
+    }
+    var idx = hasRisk ? Math.min(original + 1, m.categories.length - 1) : original;
+    var isDay0 = daysOld === 0;
+    return {
+      category: m.categories[idx],
+      // protocol.get_phototherapy_threshold と同じく、日齢が負（出生日時が未来）のときは日齢7の値
+      threshold: isDay0 ? null : m.thresholds[idx][daysOld > 0 ? Math.min(daysOld, 7) : 7],
+      adjusted: hasRisk && idx !== original,
+      originalCategory: m.categories[original],
+      isDay0: isDay0,
+    };
+  }
+
+  function moriokaThresholds(bundle, pcaWeeks, hoursOld) {
+    var mo = bundle.morioka;
+    var g = -1;
+    for (var i = 0; i < mo.groups.length; i++) {
+      var high = mo.groups[i][1] === null ? Infinity : mo.groups[i][1];
+      if (mo.groups[i][0] <= pcaWeeks && pcaWeeks <= high) { g = i; break; }
+    }
+    if (g < 0) return null;
+    var b = mo.buckets.length - 1;
+    for (var j = 0; j < mo.buckets.length; j++) {
+      var upper = mo.buckets[j] === null ? Infinity : mo.buckets[j];
+      if (hoursOld < upper) { b = j; break; }
+    }
+    var tb = mo.tb[g][b];
+    var ub = mo.ub[g];
+    return {
+      group: mo.groups[g],
+      groupLabel: mo.group_labels[g],
+      bucket: mo.buckets[b],
+      timeLabel: mo.bucket_labels[b],
+      tb: { low: tb[0], high: tb[1], exchange: tb[2] },
+      ub: { low: ub[0], high: ub[1], exchange: ub[2] },
+    };
+  }
+
+  function guidance(bundle, inputs) {
+    var out = {};
+    Object.keys(bundle.guidance_rules).forEach(function (check) {
+      var rule = bundle.guidance_rules[check];
+      var reasons = rule.any
+        .filter(function (c) { return conditionMet(c, inputs); })
+        .map(function (c) { return c.reason; });
+      out[check] = { title: rule.title, needed: reasons.length > 0, reasons: reasons };
+    });
+    return out;
+  }
+
+  // 画面の入力一式から判定結果一式を作る。now は Date（省略時は現在時刻）
+  function evaluate(bundle, p, now) {
+    now = now || new Date();
+    var birth = new Date(p.birth_datetime);
+    var hoursOld = Math.max(0, (now - birth) / 3600000);
+    var today = new Date(now.getFullYear(), now.getMonth(), now.getDate());
+    var birthDay = new Date(birth.getFullYear(), birth.getMonth(), birth.getDate());
+    var daysOld = Math.round((today - birthDay) / 86400000);
+    var correctedTotal = p.gestational_weeks * 7 + p.gestational_days + daysOld;
+    var correctedWeeks = Math.floor(correctedTotal / 7);
+
+    var t = birthSizeThresholds(bundle, p.gender, p.is_first_child, p.gestational_weeks, p.gestational_days);
+    var z = {};
+    if (t !== null) {
+      z.weight = valueToLmsZ(t.weight.lms[0], t.weight.lms[1], t.weight.lms[2], p.weight);
+      z.length = valueToLmsZ(t.length.lms[0], t.length.lms[1], t.length.lms[2], p.length);
+      z.hc = valueToLmsZ(t.hc.lms[0], t.hc.lms[1], t.hc.lms[2], p.hc);
+    }
+
+    var riskFactors = kernicterusRiskFactors(bundle, p);
+    var inputs = Object.assign({}, p, {
+      gestational_age: p.gestational_weeks + p.gestational_days / 7.0,
+      delivery_stress: bundle.delivery_stress_methods.indexOf(p.delivery_method) >= 0 || p.apgar_score_5min < 7,
+      weight_ge_p90: t !== null && p.weight !== null && p.weight > t.weight.p90,
+    });
+
+    return {
+      days_old: daysOld,
+      hours_old: hoursOld,
+      corrected_weeks: correctedWeeks,
+      corrected_days: correctedTotal % 7,
+      birth_size: { thresholds: t, z: z, label: classifyBirthSize(t, p.weight, p.length) },
+      kernicterus_risk_factors: riskFactors,
+      murata: p.weight === null ? null : phototherapyThreshold(bundle, p.weight, daysOld, riskFactors.length > 0),
+      morioka: moriokaThresholds(bundle, correctedWeeks, hoursOld),
+      guidance: p.weight === null ? null : guidance(bundle, inputs),
+    };
+  }
+
+  var api = {
+    lmsToValue: lmsToValue,
+    valueToLmsZ: valueToLmsZ,
+    birthSizeThresholds: birthSizeThresholds,
+    classifyBirthSize: classifyBirthSize,
+    phototherapyThreshold: phototherapyThreshold,
+    moriokaThresholds: moriokaThresholds,
+    guidance: guidance,
+    evaluate: evaluate,
+  };
+  root.NeonatalEvaluator = api;
+  if (typeof module !== "undefined" && module.exports) module.exports = api;
+})(typeof window !== "undefined" ? window : this);
@@ -0,0 +1,651 @@
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+
+# 村田基準の基準値（グローバル変数として定義）
+MURATA_PHOTOTHERAPY_THRESHOLDS = {
+    "≥ 2,500g": {
+        0: 11.0, 1: 12.0, 2: 15.0, 3: 17.0,
+        4: 18.0, 5: 19.0, 6: 19.5, 7: 20.0
+    },
+    "2,000 ~ 2,499g": {
+        0: 9.5, 1: 10.0, 2: 12.0, 3: 14.0,
+        4: 16.0, 5: 17.0, 6: 18.0, 7: 18.0
+    },
+    "1,500 ~ 1,999g": {
+        0: 7.5, 1: 8.0, 2: 10.0, 3: 12.0,
+        4: 14.0, 5: 15.0, 6: 16.0, 7: 16.0
+    },
+    "1,000 ~ 1,499g": {
+        0: 6.5, 1: 7.0, 2: 7.0, 3: 8.0,
+        4: 9.0, 5: 10.0, 6: 11.0, 7: 12.0
+    },
+    "≤ 999g": {
+        0: 4.5, 1: 5.0, 2: 5.0, 3: 6.0,
+        4: 7.0, 5: 8.0, 6: 9.0, 7: 10.0
+    }
+}
+
+MORIOKA_TB_THRESHOLDS = {
+    (22, 25): {
+        24: (5, 6, 8),
+        48: (5, 8, 10),
+        72: (5, 8, 12),
+        96: (6, 9, 13),
+        120: (7, 10, 13),
+        float("inf"): (8, 10, 13),
+    },
+    (26, 27): {
+        24: (5, 6, 8),
+        48: (5, 9, 10),
+        72: (6, 9, 12),
+        96: (8, 11, 14),
+        120: (9, 12, 15),
+        float("inf"): (10, 12, 15),
+    },
+    (28, 29): {
+        24: (6, 7, 9),
+        48: (7, 10, 12),
+        72: (8, 12, 14),
+        96: (10, 13, 16),
+        120: (11, 14, 18),
+        float("inf"): (12, 14, 18),
+    },
+    (30, 31): {
+        24: (7, 8, 10),
+        48: (8, 12, 14),
+        72: (10, 14, 16),
+        96: (12, 15, 18),
+        120: (13, 16, 20),
+        float("inf"): (14, 16, 20),
+    },
+    (32, 34): {
+        24: (8, 9, 10),
+        48: (10, 14, 16),
+        72: (12, 16, 18),
+        96: (14, 18, 20),
+        120: (15, 19, 22),
+        float("inf"): (16, 19, 22),
+    },
+    (35, float("inf")): {
+        24: (10, 11, 12),
+        48: (12, 16, 18),
+        72: (14, 18, 20),
+        96: (16, 20, 22),
+        120: (17, 22, 25),
+        float("inf"): (18, 22, 25),
+    },
+}
+
+MORIOKA_UB_THRESHOLDS = {
+    (22, 25): (0.4, 0.6, 0.8),
+    (26, 27): (0.4, 0.6, 0.8),
+    (28, 29): (0.5, 0.7, 0.9),
+    (30, 31): (0.6, 0.8, 1.0),
+    (32, 34): (0.7, 0.9, 1.2),
+    (35, float("inf")): (0.8, 1.0, 1.5),
+}
+
+# 森岡の基準の修正週数群・時間区分の表示名。label は本文用、short は表の見出し用
+MORIOKA_LABEL_FORMATS = {
+    "ja": {
+        "group": "{low}-{high}週",
+        "group_single": "{low}週",
+        "group_open": "{low}週以上",
+        "group_short": "{low}-{high}w",
+        "group_short_open": "{low}w-",
+        "bucket": "{end}時間未満",
+        "bucket_open": "{start}時間以上",
+        "bucket_short": "<{end}h",
+        "bucket_short_open": "{start}h-",
+    },
+    "en": {
+        "group": "{low}-{high} wk",
+        "group_single": "{low} wk",
+        "group_open": "{low} wk and over",
+        "group_short": "{low}-{high}w",
+        "group_short_open": "{low}w-",
+        "bucket": "under {end} h",
+        "bucket_open": "{start} h and over",
+        "bucket_short": "<{end}h",
+        "bucket_short_open": "{start}h-",
+    },
+}
+
+
+def build_morioka_labels(locale, tb_thresholds=None):
+    """修正週数群・時間区分ごとの表示名と範囲（{"groups": {群: {...}}, "buckets": {区分: {...}}}）"""
+    if tb_thresholds is None:
+        tb_thresholds = MORIOKA_TB_THRESHOLDS
+    formats = MORIOKA_LABEL_FORMATS[locale]
+    groups = {}
+    for low, high in tb_thresholds.keys():
+        if high == float("inf"):
+            label = formats["group_open"].format(low=low)
+            short = formats["group_short_open"].format(low=low)
+        else:
+            label = formats["group" if low != high else "group_single"].format(low=low, high=high)
+            short = formats["group_short"].format(low=low, high=high)
+        groups[(low, high)] = {"label": label, "short": short, "low": low, "high": high}
+
+    buckets = {}
+    start = 0
+    first_group = next(iter(tb_thresholds.values()))
+    for end in sorted(first_group.keys(), key=float):
+        if end == float("inf"):
+            label = formats["bucket_open"].format(start=start)
+            short = formats["bucket_short_open"].format(start=start)
+        else:
+            label = formats["bucket"].format(end=int(end))
+            short = formats["bucket_short"].format(end=int(end))
+        buckets[end] = {
+            "label": label,
+            "short": short,
+            "start_hours": start,
+            "end_hours": end,
+            # 区分に含まれる日齢（出生後時間から。最後の区分は開始日齢のみ）
+            "first_day": int(start // 24),
+            "last_day": None if end == float("inf") else int((end - 1e-9) // 24),
+        }
+        start = end
+    return {"groups": groups, "buckets": buckets}
+
+
+# 起動時に1回だけ作る。画面・レポートはここから表示名を引く
+MORIOKA_LABELS = {locale: build_morioka_labels(locale) for locale in MORIOKA_LABEL_FORMATS}
+
+
+# 核黄疸危険因子（村田・井村の基準を1段階下げる条件）。いずれかを満たせば危険因子あり
+KERNICTERUS_RISK_FACTORS = [
+    {"field": "apgar_score_5min", "op": "le", "value": 3, "reason": "5分Apgar≦3"},
+    {"field": "respiratory_distress", "reason": "呼吸窮迫（PaO2≦40が2時間以上持続）"},
+    {"field": "acidosis", "reason": "アシドーシス（pH≦7.15）"},
+    {"field": "hypothermia", "reason": "低体温（直腸温<35℃が2時間以上持続）"},
+    {"field": "hypoproteinemia", "reason": "低蛋白血症（血清蛋白≦4.0またはAlb≦2.5）"},
+    {"field": "hypoglycemia", "reason": "低血糖"},
+    {"field": "hemolysis", "reason": "溶血"},
+    {"field": "cns_abnormality", "reason": "敗血症を含む中枢神経系の異常徴候"},
+]
+
+# 分娩ストレスとみなす分娩形式（Apgar5分値7未満も分娩ストレスとする）
+DELIVERY_STRESS_METHODS = ["吸引・鉗子分娩", "緊急帝王切開"]
+
+
+def get_morioka_thresholds(pca_weeks, hours_old):
+    if pca_weeks is None or hours_old is None:
+        return None
+
+    pca_w = int(pca_weeks)
+    group = None
+    for (low, high) in MORIOKA_TB_THRESHOLDS.keys():
+        if low <= pca_w <= high:
+            group = (low, high)
+            break
+    if group is None:
+        return None
+
+    tb_bucket = None
+    for upper_h in sorted(MORIOKA_TB_THRESHOLDS[group].keys(), key=lambda x: float(x)):
+        if hours_old < upper_h:
+            tb_bucket = upper_h
+            break
+    if tb_bucket is None:
+        tb_bucket = float("inf")
+
+    tb_low, tb_high, tb_exchange = MORIOKA_TB_THRESHOLDS[group][tb_bucket]
+    ub_low, ub_high, ub_exchange = MORIOKA_UB_THRESHOLDS[group]
+    labels = MORIOKA_LABELS["ja"]
+
+    return {
+        "pca_group": group,
+        "pca_label": labels["groups"][group]["label"],
+        "time_bucket_hours": tb_bucket,
+        "time_label": labels["buckets"][tb_bucket]["label"],
+        "tb": {"low": tb_low, "high": tb_high, "exchange": tb_exchange},
+        "ub": {"low": ub_low, "high": ub_high, "exchange": ub_exchange},
+    }
+
+
+def get_morioka_pca_group_from_weeks(pca_weeks):
+    if pca_weeks is None:
+        return None
+    w = int(pca_weeks)
+    for (low, high) in MORIOKA_TB_THRESHOLDS.keys():
+        if low <= w <= high:
+            return (low, high)
+    return None
+
+
+# 村田・井村の基準の表：区分（重い順）× 日齢0〜7 の2次元配列。区分は出生体重の境目から bisect で引く
+MURATA_CATEGORY_ORDER = list(MURATA_PHOTOTHERAPY_THRESHOLDS.keys())
+MURATA_WEIGHT_CUTS = [1000, 1500, 2000, 2500]  # この体重以上で1区分上がる
+MURATA_THRESHOLD_MATRIX = tuple(
+    tuple(MURATA_PHOTOTHERAPY_THRESHOLDS[cat][day] for day in range(8)) for cat in MURATA_CATEGORY_ORDER
+)
+
+
+def get_murata_category_index(weight, has_kernicterus_risk=False):
+    """(適用する区分の位置, 元の区分の位置)。危険因子ありは1段階下（≤ 999g で止まる）"""
+    original = len(MURATA_WEIGHT_CUTS) - bisect_right(MURATA_WEIGHT_CUTS, weight)
+    index = min(original + (1 if has_kernicterus_risk else 0), len(MURATA_CATEGORY_ORDER) - 1)
+    return index, original
+
+
+def get_phototherapy_threshold(weight, days_old, has_kernicterus_risk=False):
+    """村田・井村の基準に基づいて光線療法基準値を取得"""
+    index, original = get_murata_category_index(weight, has_kernicterus_risk)
+    category = MURATA_CATEGORY_ORDER[index]
+    original_category = MURATA_CATEGORY_ORDER[original]
+
+    # 0日目は村田・井村の基準として定義がないため、数値を返さない（参考値も返さない）
+    is_day0 = days_old == 0
+    if is_day0:
+        threshold = None
+    else:
+        day = min(days_old, 7)
+        threshold = MURATA_THRESHOLD_MATRIX[index][day if day > 0 else 7]
+    day0_threshold = None
+
+    # 核黄疸危険因子により基準を変更した場合の情報も返す
+    adjusted = has_kernicterus_risk and original_category != category
+
+    return category, threshold, adjusted, original_category, is_day0, day0_threshold
+
+def get_k2_wednesdays(birth_date):
+    """ケイツー3〜12回目の内服日（日齢11以降に迎える最初の水曜日から毎週水曜日）"""
+    first_wednesday_after_day11 = None
+    for i in range(11, 18):  # 日齢11から17の間で最初の水曜日を探す
+        check_date = birth_date + timedelta(days=i)
+        if check_date.weekday() == 2:  # 水曜日
+            first_wednesday_after_day11 = check_date
+            break
+    return [first_wednesday_after_day11 + timedelta(weeks=n) for n in range(10)]
+
+
+def get_due_schedule(birth_date):
+    """日付の決まっている実施項目：[(実施日, 項目ID, 表示名)]（実施日順）"""
+    schedule = [
+        (birth_date + timedelta(days=1), "k2_1", "💊 ケイツー1回目（日齢1・内服）"),
+        (birth_date + timedelta(days=4), "k2_2", "💊 ケイツー2回目（日齢4）"),
+        (birth_date + timedelta(days=4), "mass_screening", "🧪 マススクリーニング（日齢4）"),
+    ]
+    for n, wednesday in enumerate(get_k2_wednesdays(birth_date), start=3):
+        schedule.append((wednesday, f"k2_{n}", f"💊 ケイツー{n}回目（水曜日）"))
+    return schedule
+
+
+def get_management_guidance(weight, is_first_child, delivery_method, gestational_age, days_old,
+                           maternal_diabetes=False, maternal_thyroid_abnormal=False,
+                           apgar_score_5min=9, delivery_stress=False, birth_date=None, birth_time=None,
+                           exchange_transfusion=False, intracranial_hemorrhage=False,
+                           apnea_treatment=False, aminoglycoside_history=False,
+                           high_oxygen=False, corrected_weeks=0,
+                           gestational_weeks=0, gestational_days=0,
+                           weight_lt_p10=False, weight_ge_p90=False):
+    """新生児の体重や状況に基づいて管理方針を決定"""
+    result = get_guidance_records(
+        weight, is_first_child, delivery_method, gestational_age, days_old,
+        maternal_diabetes, maternal_thyroid_abnormal, apgar_score_5min, delivery_stress,
+        birth_date, birth_time, exchange_transfusion, intracranial_hemorrhage,
+        apnea_treatment, aminoglycoside_history, high_oxygen, corrected_weeks,
+        gestational_weeks, gestational_days, weight_lt_p10, weight_ge_p90,
+    )
+    return guidance_records_to_dict(result["category"], result["records"])
+
+
+def get_guidance_records(weight, is_first_child, delivery_method, gestational_age, days_old,
+                         maternal_diabetes=False, maternal_thyroid_abnormal=False,
+                         apgar_score_5min=9, delivery_stress=False, birth_date=None, birth_time=None,
+                         exchange_transfusion=False, intracranial_hemorrhage=False,
+                         apnea_treatment=False, aminoglycoside_history=False,
+                         high_oxygen=False, corrected_weeks=0,
+                         gestational_weeks=0, gestational_days=0,
+                         weight_lt_p10=False, weight_ge_p90=False):
+    """get_management_guidance と同じ判定を、文字列を作らずに GuidanceRecord の並びで返す"""
+    inputs = {
+        "weight": weight,
+        "gestational_age": gestational_age,
+        "apgar_score_5min": apgar_score_5min,
+        "maternal_diabetes": maternal_diabetes,
+        "maternal_thyroid_abnormal": maternal_thyroid_abnormal,
+        "delivery_stress": delivery_stress,
+        "weight_ge_p90": weight_ge_p90,
+        "exchange_transfusion": exchange_transfusion,
+        "intracranial_hemorrhage": intracranial_hemorrhage,
+        "apnea_treatment": apnea_treatment,
+        "aminoglycoside_history": aminoglycoside_history,
+        "high_oxygen": high_oxygen,
+    }
+
+    # ケイツー3回目以降は出生日時が入力されているときだけ日付を出す
+    records = [get_k2_record(birth_date if birth_date and birth_time else None)]
+    records.append(get_mass_screening_record(gestational_age, birth_date))
+    for check, rule in GUIDANCE_RULES.items():
+        reasons = tuple(c["code"] for c in rule["any"] if rule_condition_met(c, inputs))
+        needed = bool(reasons)
+        notes = ()
+        if not needed:
+            # 適応がない理由
+            reasons = tuple(c["code"] for c in GUIDANCE_ABSENT_REASONS[check] if rule_condition_met(c, inputs))
+        elif check == "mri" and weight < 1000:  # 極低出生体重児
+            notes = ("mri_elbw_timing",)
+        records.append(GuidanceRecord(check, needed, reasons, (), notes))
+
+    return {
+        # 分類（出生体重 + 早産の程度）
+        "category": f"{get_prematurity_category(gestational_age)} / {get_weight_category(weight)}",
+        "records": tuple(records),
+    }
+
+
+# 管理のポイントの適応条件（いずれかを満たせば適応）。get_guidance_records・スイープ・ブラウザ内評価で共通に使う
+# code: 理由コード / field: 判定に使う入力名 / op: 比較（省略時は真偽値そのもの） / reason: 適応理由の表示
+GUIDANCE_RULES = {
+    "hypoglycemia": {
+        "title": "🩸 血糖チェック",
+        "any": [
+            {"code": "ga_lt_37", "field": "gestational_age", "op": "lt", "value": 37, "reason": "在胎37週未満"},
+            {"code": "weight_lt_2500", "field": "weight", "op": "lt", "value": 2500, "reason": "出生体重2500g未満"},
+            {"code": "weight_ge_p90", "field": "weight_ge_p90", "reason": "出生体重90%ile以上"},
+            {"code": "maternal_diabetes", "field": "maternal_diabetes", "reason": "妊娠糖尿病"},
+            {"code": "delivery_stress", "field": "delivery_stress", "reason": "分娩ストレス"},
+            {"code": "apgar_lt_7", "field": "apgar_score_5min", "op": "lt", "value": 7, "reason": "Apgar5分値7未満"},
+        ],
+    },
+    "thyroid": {
+        "title": "🦋 甲状腺機能検査",
+        "any": [
+            {"code": "maternal_thyroid_abnormal", "field": "maternal_thyroid_abnormal", "reason": "母体の甲状腺異常あり"},
+        ],
+    },
+    "mri": {
+        "title": "🧠 頭部MRI",
+        "any": [
+            {"code": "ga_lt_34", "field": "gestational_age", "op": "lt", "value": 34, "reason": "在胎34週未満"},
+            {"code": "weight_lt_1500", "field": "weight", "op": "lt", "value": 1500, "reason": "体重1500g未満"},
+            {"code": "exchange_transfusion", "field": "exchange_transfusion", "reason": "交換輸血を実施"},
+            {"code": "intracranial_hemorrhage", "field": "intracranial_hemorrhage", "reason": "頭蓋内出血"},
+        ],
+    },
+    "aabr": {
+        "title": "👂 AABR",
+        "any": [
+            {"code": "ga_lt_35", "field": "gestational_age", "op": "lt", "value": 35, "reason": "在胎35週未満"},
+            {"code": "weight_le_1800", "field": "weight", "op": "le", "value": 1800, "reason": "体重1800g以下"},
+            {"code": "exchange_transfusion", "field": "exchange_transfusion", "reason": "交換輸血を実施"},
+            {"code": "apnea_treatment", "field": "apnea_treatment", "reason": "無呼吸発作治療"},
+            {"code": "aminoglycoside_history", "field": "aminoglycoside_history", "reason": "アミノグリコシド投与歴"},
+            {"code": "intracranial_hemorrhage", "field": "intracranial_hemorrhage", "reason": "頭蓋内出血"},
+        ],
+    },
+    "eye": {
+        "title": "👁️ 眼底検査",
+        "any": [
+            {"code": "ga_lt_34", "field": "gestational_age", "op": "lt", "value": 34, "reason": "在胎34週未満"},
+            {"code": "weight_lt_1800", "field": "weight", "op": "lt", "value": 1800, "reason": "体重1800g未満"},
+            {"code": "high_oxygen", "field": "high_oxygen", "reason": "高濃度酸素投与歴"},
+        ],
+    },
+}
+
+
+def rule_condition_met(condition, inputs):
+    value = inputs[condition["field"]]
+    op = condition.get("op")
+    if op is None:
+        return bool(value)
+    if op == "lt":
+        return value < condition["value"]
+    if op == "le":
+        return value <= condition["value"]
+    if op == "ge":
+        return value >= condition["value"]
+    if op == "gt":
+        return value > condition["value"]
+    if op == "not":
+        return not value
+    raise ValueError(f"未対応の比較です: {op}")
+
+
+def get_kernicterus_risk_factors(inputs):
+    """該当する核黄疸危険因子の表示名の一覧"""
+    return [c["reason"] for c in KERNICTERUS_RISK_FACTORS if rule_condition_met(c, inputs)]
+
+
+def evaluate_guidance_rules(inputs):
+    """GUIDANCE_RULES による適応判定。{check: (needed, [適応理由])}"""
+    result = {}
+    for check, rule in GUIDANCE_RULES.items():
+        reasons = [c["reason"] for c in rule["any"] if rule_condition_met(c, inputs)]
+        result[check] = (bool(reasons), reasons)
+    return result
+
+
+# 適応なしのときに表示する理由（表示するのは先頭から absent_limit 件まで）
+GUIDANCE_ABSENT_REASONS = {
+    "hypoglycemia": [
+        {"code": "ga_ge_37", "field": "gestational_age", "op": "ge", "value": 37, "reason": "在胎37週以上"},
+        {"code": "weight_ge_2500", "field": "weight", "op": "ge", "value": 2500, "reason": "体重2500g以上"},
+        {"code": "no_maternal_diabetes", "field": "maternal_diabetes", "op": "not", "reason": "糖尿病母体なし"},
+        {"code": "no_delivery_stress", "field": "delivery_stress", "op": "not", "reason": "分娩ストレスなし"},
+        {"code": "apgar_ge_7", "field": "apgar_score_5min", "op": "ge", "value": 7, "reason": "Apgar5分値7以上"},
+    ],
+    "thyroid": [
+        {"code": "no_maternal_thyroid", "field": "maternal_thyroid_abnormal", "op": "not", "reason": "母体の甲状腺関連情報なし"},
+    ],
+    "mri": [
+        {"code": "ga_ge_34", "field": "gestational_age", "op": "ge", "value": 34, "reason": "在胎34週以上"},
+        {"code": "weight_ge_1500", "field": "weight", "op": "ge", "value": 1500, "reason": "体重1500g以上"},
+        {"code": "no_exchange_transfusion", "field": "exchange_transfusion", "op": "not", "reason": "交換輸血なし"},
+        {"code": "no_intracranial_hemorrhage", "field": "intracranial_hemorrhage", "op": "not", "reason": "頭蓋内出血なし"},
+    ],
+    "aabr": [
+        {"code": "ga_ge_35", "field": "gestational_age", "op": "ge", "value": 35, "reason": "在胎35週以上"},
+        {"code": "weight_gt_1800", "field": "weight", "op": "gt", "value": 1800, "reason": "体重1800g超"},
+        {"code": "no_exchange_transfusion", "field": "exchange_transfusion", "op": "not", "reason": "交換輸血なし"},
+        {"code": "no_apnea_treatment", "field": "apnea_treatment", "op": "not", "reason": "無呼吸発作治療なし"},
+        {"code": "no_aminoglycoside_history", "field": "aminoglycoside_history", "op": "not", "reason": "アミノグリコシド投与歴なし"},
+        {"code": "no_intracranial_hemorrhage", "field": "intracranial_hemorrhage", "op": "not", "reason": "頭蓋内出血なし"},
+    ],
+    "eye": [
+        {"code": "ga_ge_34", "field": "gestational_age", "op": "ge", "value": 34, "reason": "在胎34週以上"},
+        {"code": "weight_ge_1800", "field": "weight", "op": "ge", "value": 1800, "reason": "体重1800g以上"},
+        {"code": "no_high_oxygen", "field": "high_oxygen", "op": "not", "reason": "高濃度酸素投与歴なし"},
+    ],
+}
+
+# 理由コード → 表示名
+REASON_TEXTS = {
+    c["code"]: c["reason"]
+    for conditions in [rule["any"] for rule in GUIDANCE_RULES.values()] + list(GUIDANCE_ABSENT_REASONS.values())
+    for c in conditions
+}
+
+# 管理のポイント1項目分の判定結果。表示用の文字列は持たず、guidance_items などで必要なときに作る
+# rule_id: GUIDANCE_TEXTS のキー / reasons: 理由コード（適応なしのときは適応にならない理由）
+# dates: (コード, 日付) の組 / notes: 追加で表示する注記のコード
+GuidanceRecord = namedtuple("GuidanceRecord", ["rule_id", "needed", "reasons", "dates", "notes"])
+
+# 管理のポイントの表示文。reason_line は適応理由の行（{reasons} に理由を「、」で並べる）、
+# absent は適応なしの行（{reasons} は先頭 absent_limit 件、なければ absent_default）
+GUIDANCE_TEXTS = {
+    "k2": {
+        "title": "💊 ケイツーシロップ12回投与法",
+        "items": ["・入院中の内服は処置オーダで指示する", "・退院処方として12回目までのケイツーを処方する"],
+    },
+    "mass_screening": {
+        "title": "🧪 マススクリーニング",
+        "items": [],
+    },
+    "hypoglycemia": {
+        "title": GUIDANCE_RULES["hypoglycemia"]["title"],
+        "items": [
+            "・出生後できるだけ早期にミルクを開始（糖水は避ける）",
+            "・その後も3時間毎に哺乳を継続",
+            "・出生3/6/12時間後に簡易血糖測定を実施",
+        ],
+        "absent": "・適応なし（{reasons}）",
+        "absent_limit": 3,
+        "absent_default": "低血糖リスク因子なし",
+    },
+    "thyroid": {
+        "title": GUIDANCE_RULES["thyroid"]["title"],
+        "reason_line": "・適応理由：{reasons}",
+        "items": ["・日齢5でTSH/FT4を測定", "・必要に応じて小児科内分泌に相談"],
+        "absent": "・適応なし（{reasons}）",
+        "absent_limit": 2,
+        "absent_default": "適応条件を満たさない",
+    },
+    "mri": {
+        "title": GUIDANCE_RULES["mri"]["title"],
+        "reason_line": "・適応理由：{reasons}",
+        "items": ["・退院前に頭部MRIを実施", "・時期：全身状態が安定した頃"],
+        "absent": "・適応なし（{reasons}）",
+        "absent_limit": 2,
+        "absent_default": "適応条件を満たさない",
+    },
+    "aabr": {
+        "title": GUIDANCE_RULES["aabr"]["title"],
+        "reason_line": "・保険適応理由：{reasons}",
+        "items": ["・時期：全身状態が安定した頃"],
+        "absent": "・保険適応なし（{reasons}。ご家族の希望により自費で実施可能）",
+        "absent_limit": 2,
+        "absent_default": "適応条件を満たさない",
+    },
+    "eye": {
+        "title": GUIDANCE_RULES["eye"]["title"],
+        "reason_line": "・適応理由：{reasons}",
+        "items": [
+            "・眼科に診察を依頼する",
+            "・時期：生後2-3週毎",
+            "・準備：サンドールP点眼液を事前に処方しておく",
+            "・眼科宛の院内紹介状を作成し、眼科受診の指示をしておく",
+            "・必要な場合には、眼科処置前後のミルク量を減らす指示を出しておく",
+        ],
+        "absent": "・適応なし（{reasons}）",
+        "absent_limit": 2,
+        "absent_default": "適応条件を満たさない",
+    },
+    "weight_pending": {
+        "title": "⚠️ 体重未測定のため一部判定不可",
+        "absent": "・出生体重区分、低血糖リスク、SGA/LGA判定などは体重測定後に評価",
+    },
+}
+
+# 注記コード → 表示文
+GUIDANCE_NOTE_TEXTS = {
+    "mri_elbw_timing": "・極低出生体重児は修正37-44週で検査時体重1500g以上",
+    "preterm_rescreen": "・早産児のため、退院前にマススクリーニング再検を行う",
+}
+
+
+def get_prematurity_category(gestational_age):
+    if gestational_age >= 42:
+        return '過期産'
+    if gestational_age >= 37:
+        return '正期産'
+    if gestational_age >= 34:
+        return '後期早産'
+    return '早産'
+
+
+def get_weight_category(weight):
+    if weight >= 4000:
+        return '高出生体重児'
+    if weight >= 2500:
+        return '正常出生体重児'
+    if weight < 1000:
+        return '超極低出生体重児（ELBW）'
+    if weight < 1500:
+        return '極低出生体重児（VLBW）'
+    return '低出生体重児（LBW）'
+
+
+def get_k2_record(birth_date=None):
+    """ケイツー（全員適応）。birth_date があれば3回目と12回目の日付を持つ"""
+    dates = ()
+    if birth_date:
+        wednesdays = get_k2_wednesdays(birth_date)
+        dates = (("k2_3", wednesdays[0]), ("k2_12", wednesdays[-1]))
+    return GuidanceRecord("k2", True, (), dates, ())
+
+
+def get_mass_screening_record(gestational_age, birth_date=None):
+    """マススクリーニング（全員適応）。早産児は退院前の再検を注記する"""
+    dates = (("day4", birth_date + timedelta(days=4)),) if birth_date else ()
+    notes = ("preterm_rescreen",) if gestational_age < 37 else ()
+    return GuidanceRecord("mass_screening", True, (), dates, notes)
+
+
+def get_weight_pending_records(gestational_age, birth_date=None):
+    """出生体重が未入力のとき：ケイツー・マススクリーニングと判定保留の案内"""
+    return (
+        get_k2_record(),
+        get_mass_screening_record(gestational_age, birth_date),
+        GuidanceRecord("weight_pending", False, (), (), ()),
+    )
+
+
+def guidance_title(record):
+    return GUIDANCE_TEXTS[record.rule_id]["title"]
+
+
+@lru_cache(maxsize=4096)
+def guidance_items(record):
+    """1項目分の表示行（「・」付き）。同じ判定結果の組み合わせはキャッシュから返す"""
+    texts = GUIDANCE_TEXTS[record.rule_id]
+    dates = dict(record.dates)
+    if not record.needed:
+        if "absent_limit" not in texts:
+            return (texts["absent"],)
+        reasons = [REASON_TEXTS[code] for code in record.reasons[:texts["absent_limit"]]]
+        return (texts["absent"].format(reasons="、".join(reasons) if reasons else texts["absent_default"]),)
+
+    items = []
+    if record.rule_id == "mass_screening":
+        if "day4" in dates:
+            items.append(f'・日齢4（{dates["day4"].strftime("%Y/%m/%d")}）：マススクリーニングを実施（希望あれば拡大マスも）')
+        else:
+            items.append('・日齢4：マススクリーニングを実施（希望あれば拡大マスも）')
+    if "reason_line" in texts:
+        items.append(texts["reason_line"].format(reasons="、".join(REASON_TEXTS[code] for code in record.reasons)))
+    items.extend(texts["items"])
+    items.extend(GUIDANCE_NOTE_TEXTS[code] for code in record.notes)
+    return tuple(items)
+
+
+@lru_cache(maxsize=1024)
+def k2_third_to_twelfth_text(record):
+    dates = dict(record.dates)
+    if "k2_3" not in dates:
+        return None
+    return f'{dates["k2_3"].strftime("%Y/%m/%d")}から{dates["k2_12"].strftime("%Y/%m/%d")}まで毎週水曜日に内服'
+
+
+def guidance_records_to_dict(category, records):
+    """従来の get_management_guidance と同じ形の dict にする"""
+    guidance = {
+        'category': category,
+        'recommendations': [],
+        'warnings': [],
+        'special_management': []
+    }
+    for record in records:
+        special = {
+            'title': guidance_title(record),
+            'items': list(guidance_items(record)),
+            'needed': record.needed
+        }
+        if record.rule_id == "k2":
+            special['k2_third_to_twelfth'] = k2_third_to_twelfth_text(record)
+        guidance['special_management'].append(special)
+
+    # 特別な管理項目をrecommendationsに変換
+    for special in guidance['special_management']:
+        guidance['recommendations'].append(f"**{special['title']}**")
+        if special['needed']:
+            guidance['recommendations'].extend(special['items'])
+        else:
+            guidance['recommendations'].append(f"<span style='color: gray;'>{special['items'][0]}</span>")
+    return guidance
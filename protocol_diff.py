@@ -0,0 +1,263 @@
+import argparse
+import importlib.util
+import json
+import os
+import sys
+from datetime import datetime
+
+from protocol import MORIOKA_LABELS, build_morioka_labels
+from lms import get_lms_keys, parse_lms_sheet, resolve_lms_row_key, value_to_lms_z
+
+# プロトコル表（村田・森岡）や体格基準ワークブックの新旧を比較し、
+# 値が変わったセルに依存する患者だけを再判定する。
+# 患者ごとに「判定に使ったセル」を保存しておき、セル→患者の逆引き索引で対象を絞る。
+
+PROTOCOL_TABLE_NAMES = ("MURATA_PHOTOTHERAPY_THRESHOLDS", "MORIOKA_TB_THRESHOLDS", "MORIOKA_UB_THRESHOLDS")
+
+
+def load_protocol_snapshot(path):
+    """protocol.py と同じ形式のファイルをモジュールとして読み込む（表と判定関数をその版のまま使う）"""
+    name = "protocol_snapshot_" + str(abs(hash(os.path.abspath(path))))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for table_name in PROTOCOL_TABLE_NAMES:
+        if not hasattr(module, table_name):
+            raise ValueError(f"{path} に {table_name} がありません")
+    return module
+
+
+def _diff_keyed(old, new):
+    changed = []
+    for key in old.keys() | new.keys():
+        if old.get(key) != new.get(key):
+            changed.append(key)
+    return changed
+
+
+def diff_protocol_tables(old, new):
+    """値が変わったセルを返す。行（カテゴリ・修正週数群）の追加・削除は structure_changed で知らせる"""
+    old_murata = old.MURATA_PHOTOTHERAPY_THRESHOLDS
+    new_murata = new.MURATA_PHOTOTHERAPY_THRESHOLDS
+    old_tb = old.MORIOKA_TB_THRESHOLDS
+    new_tb = new.MORIOKA_TB_THRESHOLDS
+
+    cells = set()
+    for cat in old_murata.keys() & new_murata.keys():
+        for day in _diff_keyed(old_murata[cat], new_murata[cat]):
+            cells.add(("murata", cat, day))
+    for group in old_tb.keys() & new_tb.keys():
+        for bucket in _diff_keyed(old_tb[group], new_tb[group]):
+            cells.add(("morioka_tb", group, bucket))
+    for group in _diff_keyed(old.MORIOKA_UB_THRESHOLDS, new.MORIOKA_UB_THRESHOLDS):
+        cells.add(("morioka_ub", group))
+
+    structure_changed = (
+        old_murata.keys() != new_murata.keys()
+        or old_tb.keys() != new_tb.keys()
+        or any(old_tb[g].keys() != new_tb[g].keys() for g in old_tb.keys() & new_tb.keys())
+        or old.MORIOKA_UB_THRESHOLDS.keys() != new.MORIOKA_UB_THRESHOLDS.keys()
+    )
+    return {"cells": cells, "structure_changed": structure_changed}
+
+
+def diff_lms_rows(old_rows, new_rows):
+    cells = set()
+    for key in old_rows.keys() & new_rows.keys():
+        for column in _diff_keyed(old_rows[key], new_rows[key]):
+            cells.add(("lms", key[0], key[1], column))
+    return {"cells": cells, "structure_changed": old_rows.keys() != new_rows.keys()}
+
+
+def score_cohort_patient(patient, protocol, taikaku_rows):
+    """1患者の判定と、その判定が参照したセルの一覧"""
+    weight = patient.get("birth_weight_g")
+    cells = []
+    scores = {}
+
+    if weight is not None:
+        category, threshold, _, _, is_day0, _ = protocol.get_phototherapy_threshold(
+            weight, patient["days_old"], patient.get("has_kernicterus_risk", False)
+        )
+        scores["murata"] = {"category": category, "threshold": threshold}
+        if not is_day0:
+            cells.append(("murata", category, min(patient["days_old"], 7)))
+
+    pca_weeks = (patient["gestational_weeks"] * 7 + patient["gestational_days"] + patient["days_old"]) // 7
+    morioka = protocol.get_morioka_thresholds(pca_weeks, patient["hours_old"])
+    if morioka is not None:
+        scores["morioka"] = {"tb": morioka["tb"], "ub": morioka["ub"]}
+        cells.append(("morioka_tb", morioka["pca_group"], morioka["time_bucket_hours"]))
+        cells.append(("morioka_ub", morioka["pca_group"]))
+
+    row_key = resolve_lms_row_key(taikaku_rows, patient["gestational_weeks"], patient["gestational_days"])
+    if row_key is not None:
+        lms_keys = get_lms_keys(patient["gender"], patient["is_first_child"])
+        values = {
+            "weight": weight,
+            "length": patient.get("birth_length_cm"),
+            "hc": patient.get("birth_hc_cm"),
+        }
+        for measure, value in values.items():
+            if value is None:
+                continue
+            L, M, S = taikaku_rows[row_key][lms_keys[measure]]
+            scores[f"{measure}_z"] = value_to_lms_z(L, M, S, value)
+            cells.append(("lms", row_key[0], row_key[1], lms_keys[measure]))
+
+    return {"scores": scores, "cells": cells}
+
+
+def build_cell_index(cohort):
+    """保存済みのセル一覧から セル→患者ID の索引を作る（再判定はしない）"""
+    index = {}
+    for patient in cohort:
+        for cell in patient.get("cells", []):
+            index.setdefault(cell, set()).add(patient["id"])
+    return index
+
+
+def rescore_affected(cohort, index, changed, protocol, taikaku_rows):
+    """変更セルに依存する患者だけ再判定する。表の構造が変わった場合は全員を再判定する"""
+    if changed["structure_changed"]:
+        affected = {patient["id"] for patient in cohort}
+    else:
+        # 未判定（cellsなし）の患者はここで初回判定する
+        affected = {patient["id"] for patient in cohort if "cells" not in patient}
+        for cell in changed["cells"]:
+            affected |= index.get(cell, set())
+
+    results = {}
+    for patient in cohort:
+        if patient["id"] not in affected:
+            continue
+        result = score_cohort_patient(patient, protocol, taikaku_rows)
+        old_scores = patient.get("scores")
+        patient["scores"] = result["scores"]
+        patient["cells"] = result["cells"]
+        results[patient["id"]] = {"before": old_scores, "after": result["scores"]}
+    return results
+
+
+# JSON保存用：タプルのセル・inf を含む修正週数群をそのまま往復させる
+def _encode(obj):
+    if isinstance(obj, float) and obj == float("inf"):
+        return {"__float__": "inf"}
+    if isinstance(obj, tuple):
+        return {"__tuple__": [_encode(v) for v in obj]}
+    if isinstance(obj, list):
+        return [_encode(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: _encode(v) for k, v in obj.items()}
+    return obj
+
+
+def _decode(obj):
+    if isinstance(obj, list):
+        return [_decode(v) for v in obj]
+    if isinstance(obj, dict):
+        if set(obj.keys()) == {"__float__"}:
+            return float(obj["__float__"])
+        if set(obj.keys()) == {"__tuple__"}:
+            return tuple(_decode(v) for v in obj["__tuple__"])
+        return {k: _decode(v) for k, v in obj.items()}
+    return obj
+
+
+def load_cohort(path):
+    with open(path, encoding="utf-8") as f:
+        return [_decode(json.loads(line)) for line in f if line.strip()]
+
+
+def save_cohort(path, cohort):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for patient in cohort:
+            f.write(json.dumps(_encode(patient), ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+# 変更セルの表示（--locale en で英語のレポートにする）
+CELL_FORMATS = {
+    "ja": {
+        "murata": "村田・井村 {category} 日齢{day}",
+        "morioka_tb": "森岡 TB {group} {time}",
+        "morioka_ub": "森岡 UB {group}",
+        "lms": "LMS {weeks}週{days}日 {column}",
+    },
+    "en": {
+        "murata": "Murata {category} day {day}",
+        "morioka_tb": "Morioka TB {group} {time}",
+        "morioka_ub": "Morioka UB {group}",
+        "lms": "LMS {weeks}w{days}d {column}",
+    },
+}
+
+
+def snapshot_morioka_labels(snapshots, locale="ja"):
+    """新旧どちらかの表にしかない群・区分も表示できるよう、両方の表示名をまとめる"""
+    labels = {"groups": {}, "buckets": {}}
+    for snapshot in snapshots:
+        built = build_morioka_labels(locale, snapshot.MORIOKA_TB_THRESHOLDS)
+        labels["groups"].update(built["groups"])
+        labels["buckets"].update(built["buckets"])
+    return labels
+
+
+def format_cell(cell, locale="ja", labels=None):
+    kind = cell[0]
+    formats = CELL_FORMATS[locale]
+    if labels is None:
+        labels = MORIOKA_LABELS[locale]
+    if kind == "murata":
+        return formats["murata"].format(category=cell[1], day=cell[2])
+    if kind == "morioka_tb":
+        return formats["morioka_tb"].format(
+            group=labels["groups"][cell[1]]["label"], time=labels["buckets"][cell[2]]["label"]
+        )
+    if kind == "morioka_ub":
+        return formats["morioka_ub"].format(group=labels["groups"][cell[1]]["label"])
+    return formats["lms"].format(weeks=cell[1], days=cell[2], column=cell[3])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="プロトコル表・体格基準の新旧を比較し、影響する患者だけ再判定する")
+    parser.add_argument("old_protocol", help="変更前の protocol.py")
+    parser.add_argument("new_protocol", help="変更後の protocol.py")
+    parser.add_argument("--old-workbook", help="変更前の体格基準ワークブック")
+    parser.add_argument("--new-workbook", default="taikakubirthlongcross_v1.1.xlsx", help="変更後の体格基準ワークブック")
+    parser.add_argument("--cohort", help="判定済みコホート（JSON Lines）。指定時は影響患者を再判定して上書きする")
+    parser.add_argument("--locale", choices=sorted(CELL_FORMATS), default="ja", help="変更セルの表示言語")
+    args = parser.parse_args(argv)
+
+    old = load_protocol_snapshot(args.old_protocol)
+    new = load_protocol_snapshot(args.new_protocol)
+    changed = diff_protocol_tables(old, new)
+
+    new_rows = parse_lms_sheet(args.new_workbook)
+    if args.old_workbook:
+        lms_changed = diff_lms_rows(parse_lms_sheet(args.old_workbook), new_rows)
+        changed = {
+            "cells": changed["cells"] | lms_changed["cells"],
+            "structure_changed": changed["structure_changed"] or lms_changed["structure_changed"],
+        }
+
+    print(f"変更セル: {len(changed['cells'])}件" + ("（表の構造が変更されています）" if changed["structure_changed"] else ""))
+    labels = snapshot_morioka_labels([old, new], args.locale)
+    cell_texts = sorted(format_cell(cell, args.locale, labels) for cell in changed["cells"])
+    for text in cell_texts:
+        print(f"  {text}")
+
+    if args.cohort:
+        cohort = load_cohort(args.cohort)
+        started = datetime.now()
+        results = rescore_affected(cohort, build_cell_index(cohort), changed, new, new_rows)
+        elapsed = (datetime.now() - started).total_seconds()
+        save_cohort(args.cohort, cohort)
+        n_changed = sum(1 for r in results.values() if r["before"] != r["after"])
+        print(f"再判定: {len(results)}/{len(cohort)}人（判定が変わった患者 {n_changed}人、{elapsed:.2f}秒）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""村田・井村／森岡の基準の表を版付きのファイル（JSON）から読み込み、サーバーを止めずに差し替える
+
+    python protocol_tables.py --export protocol_tables.json --version 2024-04
+    python protocol_tables.py --check protocol_tables.json
+
+ファイルは検証してから索引つきの表（修正週数群の下限・時間区分の境目の整列済みリストと numpy 配列）に
+まとめ、変更不可の ProtocolTables にする。ProtocolTableStore は現在の版への参照を1つだけ持ち、
+ファイルが変わったら新しい版を作ってから参照を置き換える。画面の再表示は開始時に current() で版を1回だけ
+取得して最後まで使うため、途中で差し替わっても1回の表示の中で版が混ざらない。
+検証に失敗したファイルは採用せず、それまでの版を使い続ける（error に理由を残す）。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+import numpy as np
+
+import protocol
+from protocol import MORIOKA_LABEL_FORMATS, build_morioka_labels, get_murata_category_index
+
+PROTOCOL_TABLES_PATH = "protocol_tables.json"
+PROTOCOL_WATCH_INTERVAL_SECONDS = 5.0
+BUILTIN_PROTOCOL_VERSION = "組み込み（protocol.py）"
+MURATA_DAYS = 8  # 日齢0〜7
+
+_INF = float("inf")
+
+
+class ProtocolTablesError(ValueError):
+    """基準の表の検証に失敗した。errors に理由の一覧を持つ"""
+
+    def __init__(self, errors):
+        super().__init__("基準の表の検証に失敗しました: " + " / ".join(errors))
+        self.errors = errors
+
+
+def _json_bound(value):
+    return None if value == _INF else value
+
+
+def _bound(value):
+    return _INF if value is None else value
+
+
+def protocol_tables_to_json(version, murata, morioka_tb, morioka_ub):
+    """表を保存用の dict にする（無限大は null）"""
+    return {
+        "version": version,
+        "murata": {cat: [by_day[day] for day in range(MURATA_DAYS)] for cat, by_day in murata.items()},
+        "morioka_tb": [
+            {
+                "weeks": [low, _json_bound(high)],
+                "hours": [[_json_bound(bucket), list(values)] for bucket, values in by_bucket.items()],
+            }
+            for (low, high), by_bucket in morioka_tb.items()
+        ],
+        "morioka_ub": [
+            {"weeks": [low, _json_bound(high)], "values": list(values)}
+            for (low, high), values in morioka_ub.items()
+        ],
+    }
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+
+def _check_lines(values, where, errors):
+    # low ≤ high ≤ 交換輸血 の3つの数
+    if not isinstance(values, (list, tuple)) or len(values) != 3 or not all(_is_number(v) for v in values):
+        errors.append(f"{where}: low/high/交換輸血の3つの数値ではありません")
+        return None
+    if not values[0] <= values[1] <= values[2]:
+        errors.append(f"{where}: low ≤ high ≤ 交換輸血 になっていません（{values[0]}/{values[1]}/{values[2]}）")
+    return tuple(values)
+
+
+def _parse_groups(entries, name, errors):
+    groups = []
+    for i, entry in enumerate(entries):
+        weeks = entry.get("weeks") if isinstance(entry, dict) else None
+        if not isinstance(weeks, list) or len(weeks) != 2 or not isinstance(weeks[0], int) \
+                or not (weeks[1] is None or isinstance(weeks[1], int)):
+            errors.append(f"{name}[{i}]: weeks は [下限, 上限（null は上限なし）] の整数で指定します")
+            return None
+        groups.append((weeks[0], _bound(weeks[1])))
+    if not groups:
+        errors.append(f"{name}: 修正週数群がありません")
+        return None
+    for (low, high), (next_low, _) in zip(groups, groups[1:]):
+        if high == _INF or next_low != high + 1:
+            errors.append(f"{name}: 修正週数群が {low}-{high}週 の次で連続していません")
+    for low, high in groups:
+        if low > high:
+            errors.append(f"{name}: 修正週数群 {low}-{high}週 の下限が上限より大きくなっています")
+    if groups[-1][1] != _INF:
+        errors.append(f"{name}: 最後の修正週数群の上限は null（上限なし）にします")
+    return groups
+
+
+def compile_protocol_tables(data, digest=None, source=None):
+    """保存形式の dict を検証し、索引つきの ProtocolTables にする（不正なら ProtocolTablesError）"""
+    errors = []
+    if not isinstance(data, dict):
+        raise ProtocolTablesError(["最上位が JSON のオブジェクトではありません"])
+    version = data.get("version")
+    if not isinstance(version, str) or not version.strip():
+        errors.append("version（版の名前）がありません")
+
+    murata = {}
+    raw_murata = data.get("murata")
+    if not isinstance(raw_murata, dict) or list(raw_murata) != protocol.MURATA_CATEGORY_ORDER:
+        # 区分は protocol の体重の境目（MURATA_WEIGHT_CUTS）で引くため、名前と順番を変えられない
+        errors.append("murata: 体重区分は重い順に「" + "」「".join(protocol.MURATA_CATEGORY_ORDER) + "」とします")
+    else:
+        for cat, values in raw_murata.items():
+            if not isinstance(values, list) or len(values) != MURATA_DAYS or not all(_is_number(v) for v in values):
+                errors.append(f"murata「{cat}」: 日齢0〜7の{MURATA_DAYS}つの数値ではありません")
+                continue
+            murata[cat] = dict(enumerate(values))
+
+    morioka_tb = {}
+    raw_tb = data.get("morioka_tb")
+    groups = _parse_groups(raw_tb, "morioka_tb", errors) if isinstance(raw_tb, list) else None
+    if groups is None and not isinstance(raw_tb, list):
+        errors.append("morioka_tb: 修正週数群の一覧がありません")
+    bucket_keys = None
+    for group, entry in zip(groups or (), raw_tb or ()):
+        where = f"morioka_tb {group[0]}-{group[1]}週"
+        hours = entry.get("hours")
+        if not isinstance(hours, list) or not hours:
+            errors.append(f"{where}: hours がありません")
+            continue
+        by_bucket = {}
+        for pair in hours:
+            if not isinstance(pair, list) or len(pair) != 2 or not (pair[0] is None or _is_number(pair[0])):
+                errors.append(f"{where}: hours は [時間区分の上限（null は上限なし）, [low, high, 交換輸血]] で指定します")
+                continue
+            lines = _check_lines(pair[1], f"{where} {pair[0]}時間", errors)
+            if lines is not None:
+                by_bucket[_bound(pair[0])] = lines
+        if list(by_bucket) != sorted(by_bucket) or _INF not in by_bucket:
+            errors.append(f"{where}: 時間区分は昇順に並べ、最後を null（上限なし）にします")
+        if bucket_keys is None:
+            bucket_keys = list(by_bucket)
+        elif list(by_bucket) != bucket_keys:
+            errors.append(f"{where}: 時間区分が最初の修正週数群と異なります")
+        morioka_tb[group] = by_bucket
+
+    morioka_ub = {}
+    raw_ub = data.get("morioka_ub")
+    ub_groups = _parse_groups(raw_ub, "morioka_ub", errors) if isinstance(raw_ub, list) else None
+    if ub_groups is None and not isinstance(raw_ub, list):
+        errors.append("morioka_ub: 修正週数群の一覧がありません")
+    for group, entry in zip(ub_groups or (), raw_ub or ()):
+        lines = _check_lines(entry.get("values"), f"morioka_ub {group[0]}-{group[1]}週", errors)
+        if lines is not None:
+            morioka_ub[group] = lines
+    if groups and ub_groups and groups != ub_groups:
+        errors.append("morioka_ub: 修正週数群が morioka_tb と一致しません")
+
+    if errors:
+        raise ProtocolTablesError(errors)
+    return ProtocolTables(version, murata, morioka_tb, morioka_ub, digest=digest, source=source)
+
+
+class ProtocolTables:
+    """1つの版の表と、その版で引く判定関数（protocol と同じ名前・戻り値）。作ったあとは変更しない"""
+
+    def __init__(self, version, murata, morioka_tb, morioka_ub, digest=None, source=None):
+        if digest is None:
+            payload = json.dumps(protocol_tables_to_json(version, murata, morioka_tb, morioka_ub), ensure_ascii=False)
+            digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        self.version = version
+        self.digest = digest
+        self.source = source
+        self.MURATA_PHOTOTHERAPY_THRESHOLDS = murata
+        self.MORIOKA_TB_THRESHOLDS = morioka_tb
+        self.MORIOKA_UB_THRESHOLDS = morioka_ub
+        self.MURATA_CATEGORY_ORDER = list(murata)
+        self.MURATA_THRESHOLD_MATRIX = tuple(tuple(murata[cat][day] for day in range(MURATA_DAYS)) for cat in murata)
+        self.MORIOKA_LABELS = {locale: build_morioka_labels(locale, morioka_tb) for locale in MORIOKA_LABEL_FORMATS}
+
+        # 索引：修正週数群の下限と時間区分の上限（二分探索で引く）
+        self._groups = list(morioka_tb)
+        self._group_lows = [low for low, _ in self._groups]
+        self._buckets = list(next(iter(morioka_tb.values())))
+        # 配列版（bilirubin_forecast.thresholds_at_hours で使う）
+        self.morioka_group_lows = np.array(self._group_lows)
+        self.morioka_hour_edges = np.array([b for b in self._buckets if b != _INF], dtype=float)
+        self.morioka_tb_table = np.array([[morioka_tb[g][b] for b in self._buckets] for g in self._groups], dtype=float)
+        matrix = np.array(self.MURATA_THRESHOLD_MATRIX, dtype=float)
+        matrix[:, 0] = np.nan
+        self.murata_matrix = matrix
+        # 基準値が切り替わる時刻の計算用（sweep・time_schedule・census_scheduler の同名の定数のこの版の値）
+        self.MORIOKA_TIME_BUCKETS = list(self._buckets)
+        self.MORIOKA_HOUR_EDGES = [b for b in self._buckets if b != _INF]
+        self.MURATA_DAY_KEYS = list(range(MURATA_DAYS))
+        self.MORIOKA_GROUP_LOWS = list(self._group_lows)
+
+    def get_morioka_pca_group_from_weeks(self, pca_weeks):
+        if pca_weeks is None:
+            return None
+        w = int(pca_weeks)
+        i = bisect_right(self._group_lows, w) - 1
+        if i < 0 or w > self._groups[i][1]:
+            return None
+        return self._groups[i]
+
+    def get_morioka_thresholds(self, pca_weeks, hours_old):
+        if pca_weeks is None or hours_old is None:
+            return None
+        group = self.get_morioka_pca_group_from_weeks(pca_weeks)
+        if group is None:
+            return None
+        i = bisect_right(self._buckets, hours_old)
+        tb_bucket = self._buckets[i] if i < len(self._buckets) else _INF
+
+        tb_low, tb_high, tb_exchange = self.MORIOKA_TB_THRESHOLDS[group][tb_bucket]
+        ub_low, ub_high, ub_exchange = self.MORIOKA_UB_THRESHOLDS[group]
+        labels = self.MORIOKA_LABELS["ja"]
+        return {
+            "pca_group": group,
+            "pca_label": labels["groups"][group]["label"],
+            "time_bucket_hours": tb_bucket,
+            "time_label": labels["buckets"][tb_bucket]["label"],
+            "tb": {"low": tb_low, "high": tb_high, "exchange": tb_exchange},
+            "ub": {"low": ub_low, "high": ub_high, "exchange": ub_exchange},
+        }
+
+    def get_phototherapy_threshold(self, weight, days_old, has_kernicterus_risk=False):
+        """protocol.get_phototherapy_threshold と同じ戻り値（この版の村田・井村の表で引く）"""
+        index, original = get_murata_category_index(weight, has_kernicterus_risk)
+        category = self.MURATA_CATEGORY_ORDER[index]
+        original_category = self.MURATA_CATEGORY_ORDER[original]
+        is_day0 = days_old == 0
+        day = min(days_old, 7)
+        threshold = None if is_day0 else self.MURATA_THRESHOLD_MATRIX[index][day if day > 0 else 7]
+        adjusted = has_kernicterus_risk and original_category != category
+        return category, threshold, adjusted, original_category, is_day0, None
+
+
+def builtin_protocol_tables():
+    """protocol.py の表をそのまま使う版"""
+    return ProtocolTables(
+        BUILTIN_PROTOCOL_VERSION,
+        protocol.MURATA_PHOTOTHERAPY_THRESHOLDS,
+        protocol.MORIOKA_TB_THRESHOLDS,
+        protocol.MORIOKA_UB_THRESHOLDS,
+        source="protocol.py",
+    )
+
+
+def load_protocol_tables(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    return compile_protocol_tables(json.loads(raw), digest=hashlib.sha256(raw).hexdigest(), source=path)
+
+
+class ProtocolTableStore:
+    """現在の版への参照。ファイルが変わったら検証済みの新しい版に置き換える。Streamlit のセッション間で共有する"""
+
+    def __init__(self, path=PROTOCOL_TABLES_PATH):
+        self.path = path
+        self._current = builtin_protocol_tables()
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.error = None
+        self.history = [(datetime.now(), self._current.version, self._current.digest, None)]
+        self.reload_if_changed()
+
+    def subscribe(self, callback):
+        """版が切り替わったときに callback(新しい版) を呼ぶ（共有の集計・受信が表を持ち替えるため）"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def current(self):
+        """この時点の版（再表示の最初に1回だけ取得し、その表示の中では同じものを使う）"""
+        return self._current
+
+    def reload_if_changed(self):
+        """ファイルの更新時刻・大きさが変わっていれば読み直す。版が切り替わったら True"""
+        with self._lock:
+            tables = self._reload()
+            subscribers = list(self._subscribers)
+        if tables is None:
+            return False
+        for callback in subscribers:
+            callback(tables)
+        return True
+
+    def _reload(self):
+        # 切り替えた場合は新しい版、それ以外は None
+        from protocol_diff import diff_protocol_tables
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None  # ファイルがなければ今の版のまま
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        try:
+            tables = load_protocol_tables(self.path)
+        except (OSError, ValueError) as e:
+            # 書きかけ・不正なファイルは採用しない（次に更新されたときに読み直す）
+            self.error = str(e)
+            return None
+        self.error = None
+        if tables.digest == self._current.digest:
+            return None
+        changed = len(diff_protocol_tables(self._current, tables)["cells"])
+        self._current = tables  # 参照の置き換えは1回の代入。取得済みの古い版はそのまま使える
+        self.history.append((datetime.now(), tables.version, tables.digest, changed))
+        return tables
+
+
+def start_protocol_watch(store, interval=PROTOCOL_WATCH_INTERVAL_SECONDS):
+    """store.path を interval 秒ごとに確認するデーモンスレッドを起動する"""
+    def watch():
+        while True:
+            time.sleep(interval)
+            store.reload_if_changed()
+
+    thread = threading.Thread(target=watch, name="protocol-watch", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    from protocol_diff import diff_protocol_tables
+
+    parser = argparse.ArgumentParser(description="基準の表のファイルを書き出す・検証する")
+    parser.add_argument("--export", metavar="PATH", help="protocol.py の表を JSON に書き出す")
+    parser.add_argument("--version", default=datetime.now().strftime("%Y-%m-%d"), help="書き出す版の名前")
+    parser.add_argument("--check", metavar="PATH", help="JSON を検証し、protocol.py の表との違いを表示する")
+    args = parser.parse_args(argv)
+
+    if args.export:
+        builtin = builtin_protocol_tables()
+        data = protocol_tables_to_json(
+            args.version, builtin.MURATA_PHOTOTHERAPY_THRESHOLDS,
+            builtin.MORIOKA_TB_THRESHOLDS, builtin.MORIOKA_UB_THRESHOLDS,
+        )
+        with open(args.export, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+            f.write("\n")
+        print(f"{args.export} に版「{args.version}」を書き出しました")
+    if args.check:
+        try:
+            tables = load_protocol_tables(args.check)
+        except ValueError as e:
+            print(f"{args.check}: 検証に失敗しました")
+            for error in getattr(e, "errors", [str(e)]):
+                print(f"  - {error}")
+            return 1
+        diff = diff_protocol_tables(builtin_protocol_tables(), tables)
+        print(f"{args.check}: 版「{tables.version}」（{tables.digest[:8]}）")
+        print(f"  protocol.py との違い：{len(diff['cells'])}セル" + ("・行の追加／削除あり" if diff["structure_changed"] else ""))
+        for cell in sorted(diff["cells"], key=str):
+            print(f"  {cell}")
+    if not args.export and not args.check:
+        parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
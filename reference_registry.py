@@ -0,0 +1,286 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+from ga_estimator import build_ga_index
+from lms import build_percentile_curves, parse_lms_sheet
+
+REFERENCE_MANIFEST_PATH = "reference_datasets.json"
+REFERENCE_CACHE_DIR = ".reference_cache"
+DEFAULT_MEMORY_BUDGET_MB = 64
+# 検証内容を変えたら上げる（古い版で作ったキャッシュを作り直させる）
+REFERENCE_VALIDATION_VERSION = 1
+# キャッシュの中身（{"rows", "curves", "ga_index"}）の形を変えたら上げる
+REFERENCE_CACHE_FORMAT = 3
+
+
+class ReferenceValidationError(ValueError):
+    """基準データの検証に失敗した。report に検証結果を持つ"""
+
+    def __init__(self, report):
+        super().__init__(f"基準データの検証に失敗しました: {report['dataset_id']}（{len(report['errors'])}件）")
+        self.report = report
+
+
+def load_reference_manifest(path=REFERENCE_MANIFEST_PATH):
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    datasets = OrderedDict()
+    for spec in manifest.get("datasets", []):
+        dataset_id = spec["id"]
+        if dataset_id in datasets:
+            raise ValueError(f"基準データIDが重複しています: {dataset_id}")
+        datasets[dataset_id] = {
+            "id": dataset_id,
+            "label": spec.get("label", dataset_id),
+            "path": spec["path"],
+            "sheet": spec.get("sheet", 7),
+            "first_row": int(spec.get("first_row", 7)),
+            "week_col": int(spec.get("week_col", 2)),
+            "day_col": int(spec.get("day_col", 3)),
+            "columns": {name: tuple(int(c) for c in cols) for name, cols in spec["columns"].items()},
+            # 収録されているべき在胎週数の範囲（省略時はデータの最小〜最大週）
+            "weeks": tuple(spec["weeks"]) if "weeks" in spec else None,
+        }
+    budget_mb = manifest.get("memory_budget_mb", DEFAULT_MEMORY_BUDGET_MB)
+    return datasets, int(budget_mb * 1024 * 1024)
+
+
+def estimate_rows_size(obj):
+    """常駐メモリの概算（bytes）。dict/tuple/listを再帰的にたどる"""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "nbytes"):
+        return size + obj.nbytes  # numpy 配列（パーセンタイル曲線）
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += estimate_rows_size(k) + estimate_rows_size(v)
+    elif isinstance(obj, (tuple, list)):
+        for v in obj:
+            size += estimate_rows_size(v)
+    return size
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def validate_reference_rows(rows, spec, skipped_rows=()):
+    """コンパイル済みキャッシュを作る前の検証。(週, 日) の欠け・L/M/Sの欠損や型・Mの単調性を調べる
+    errors が1件でもあればキャッシュにしない"""
+    errors = []
+    warnings = [f"{r}行目：在胎日数が空のため読み飛ばしました（L/M/Sに値あり）" for r in skipped_rows]
+
+    keys = sorted(rows)
+    if not keys:
+        errors.append("データ行がありません")
+        weeks = spec.get("weeks")
+    else:
+        weeks = spec.get("weeks") or (keys[0][0], keys[-1][0])
+        missing = [(w, d) for w in range(weeks[0], weeks[1] + 1) for d in range(7) if (w, d) not in rows]
+        for w, d in missing:
+            errors.append(f"{w}週{d}日の行がありません")
+        for w, d in keys:
+            if not 0 <= d <= 6:
+                errors.append(f"{w}週{d}日：在胎日数が0〜6の範囲外です")
+
+    for name in spec["columns"]:
+        previous = None
+        for key in keys:
+            lms = rows[key].get(name)
+            label = f"{key[0]}週{key[1]}日 {name}"
+            if lms is None or len(lms) != 3 or any(v is None for v in lms):
+                errors.append(f"{label}：L/M/Sに空欄があります")
+                continue
+            if not all(_is_number(v) for v in lms):
+                errors.append(f"{label}：L/M/Sが数値ではありません {lms!r}")
+                continue
+            _, M, S = lms
+            if M <= 0 or S <= 0:
+                errors.append(f"{label}：M・Sは正の値である必要があります（M={M}, S={S}）")
+            # 中央値（M）は在胎週数とともに減らない
+            if previous is not None and M < previous[1]:
+                errors.append(f"{label}：Mが{previous[0][0]}週{previous[0][1]}日（{previous[1]}）より小さくなっています（{M}）")
+            previous = (key, M)
+
+    return {
+        "dataset_id": spec["id"],
+        "validation_version": REFERENCE_VALIDATION_VERSION,
+        "rows": len(rows),
+        "weeks": list(weeks) if weeks else None,
+        "columns": list(spec["columns"]),
+        "errors": errors,
+        "warnings": warnings,
+        "ok": not errors,
+    }
+
+
+def format_validation_report(report, limit=20):
+    status = "OK" if report["ok"] else "NG"
+    weeks = report["weeks"]
+    lines = [
+        f"[{status}] {report['dataset_id']}：{report['rows']}行"
+        + (f"（{weeks[0]}週0日〜{weeks[1]}週6日）" if weeks else "")
+        + f" エラー{len(report['errors'])}件・警告{len(report['warnings'])}件"
+    ]
+    for kind, messages in (("エラー", report["errors"]), ("警告", report["warnings"])):
+        for message in messages[:limit]:
+            lines.append(f"  {kind}: {message}")
+        if len(messages) > limit:
+            lines.append(f"  …ほか{len(messages) - limit}件")
+    return "\n".join(lines)
+
+
+def _compiled_cache_path(spec, cache_dir):
+    # ワークブックの更新（サイズ・更新時刻）とマニフェストの記述・検証の版が変われば別ファイルになる
+    st_ = os.stat(spec["path"])
+    fingerprint = json.dumps(
+        [spec, st_.st_size, st_.st_mtime_ns, REFERENCE_VALIDATION_VERSION, REFERENCE_CACHE_FORMAT],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=list,
+    )
+    digest = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:16]
+    safe_id = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in spec["id"])
+    return os.path.join(cache_dir, f"{safe_id}-{digest}.pickle")
+
+
+def compile_reference_dataset(spec, cache_dir=REFERENCE_CACHE_DIR):
+    """ワークブックを解析・検証し、コンパイル済み（pickle）キャッシュを作る。既にあればそれを読む
+    キャッシュは {"rows": LMS行, "curves": パーセンタイル曲線, "ga_index": 在胎週数推定の索引}。曲線と索引もここで1回だけ計算する
+    検証結果は <キャッシュ名>.report.json に書き出し、検証に失敗したらキャッシュを作らずに例外を出す"""
+    cache_path = _compiled_cache_path(spec, cache_dir)
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    skipped_rows = []
+    rows = parse_lms_sheet(
+        spec["path"],
+        sheet=spec["sheet"],
+        first_row=spec["first_row"],
+        week_col=spec["week_col"],
+        day_col=spec["day_col"],
+        columns=spec["columns"],
+        skipped_rows=skipped_rows,
+    )
+    report = validate_reference_rows(rows, spec, skipped_rows)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.splitext(cache_path)[0] + ".report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    if not report["ok"]:
+        raise ReferenceValidationError(report)
+
+    curves = build_percentile_curves(rows, spec["columns"])
+    compiled = {"rows": rows, "curves": curves, "ga_index": build_ga_index(curves)}
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return compiled
+
+
+class ReferenceRegistry:
+    """基準データセットの登録簿。初回利用時に読み込み、メモリ上限を超えたら最も古いものから解放する"""
+
+    def __init__(self, datasets, memory_budget_bytes, cache_dir=REFERENCE_CACHE_DIR):
+        self.datasets = datasets
+        self.memory_budget_bytes = memory_budget_bytes
+        self.cache_dir = cache_dir
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dataset_ids(self):
+        return list(self.datasets.keys())
+
+    def label(self, dataset_id):
+        return self.datasets[dataset_id]["label"]
+
+    def get(self, dataset_id):
+        """LMS行 {(週, 日): {列キー: (L, M, S)}}"""
+        return self._compiled(dataset_id)["rows"]
+
+    def curves(self, dataset_id):
+        """パーセンタイル曲線（lms.build_percentile_curves の形）"""
+        return self._compiled(dataset_id)["curves"]
+
+    def ga_index(self, dataset_id):
+        """在胎週数推定の索引（ga_estimator.build_ga_index の形）"""
+        return self._compiled(dataset_id)["ga_index"]
+
+    def _compiled(self, dataset_id):
+        with self._lock:
+            entry = self._resident.get(dataset_id)
+            if entry is not None:
+                self._resident.move_to_end(dataset_id)
+                return entry[0]
+
+        spec = self.datasets.get(dataset_id)
+        if spec is None:
+            raise KeyError(f"未登録の基準データです: {dataset_id}")
+        compiled = compile_reference_dataset(spec, self.cache_dir)
+        size = estimate_rows_size(compiled)
+
+        with self._lock:
+            self._resident[dataset_id] = (compiled, size)
+            self._resident.move_to_end(dataset_id)
+            self._evict()
+        return compiled
+
+    def _evict(self):
+        # 直近に使ったデータセットは上限を超えていても残す
+        total = sum(size for _, size in self._resident.values())
+        while total > self.memory_budget_bytes and len(self._resident) > 1:
+            _, (_, size) = self._resident.popitem(last=False)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            resident = [(dataset_id, size) for dataset_id, (_, size) in self._resident.items()]
+        return {
+            "resident": resident,
+            "resident_bytes": sum(size for _, size in resident),
+            "memory_budget_bytes": self.memory_budget_bytes,
+        }
+
+
+def build_reference_registry(manifest_path=REFERENCE_MANIFEST_PATH, cache_dir=REFERENCE_CACHE_DIR):
+    datasets, budget = load_reference_manifest(manifest_path)
+    return ReferenceRegistry(datasets, budget, cache_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="基準データを検証し、コンパイル済みキャッシュを作る")
+    parser.add_argument("dataset", nargs="*", help="対象の基準データID（省略時はすべて）")
+    parser.add_argument("--manifest", default=REFERENCE_MANIFEST_PATH)
+    parser.add_argument("--cache-dir", default=REFERENCE_CACHE_DIR)
+    args = parser.parse_args(argv)
+
+    datasets, _ = load_reference_manifest(args.manifest)
+    failed = False
+    for dataset_id in args.dataset or list(datasets):
+        spec = datasets[dataset_id]
+        try:
+            compile_reference_dataset(spec, args.cache_dir)
+        except ReferenceValidationError as e:
+            failed = True
+            print(format_validation_report(e.report))
+            continue
+        report_path = os.path.splitext(_compiled_cache_path(spec, args.cache_dir))[0] + ".report.json"
+        if os.path.exists(report_path):
+            with open(report_path, encoding="utf-8") as f:
+                print(format_validation_report(json.load(f)))
+        else:
+            print(f"[OK] {dataset_id}：検証済みのキャッシュを使用")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
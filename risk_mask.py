@@ -0,0 +1,162 @@
+import numpy as np
+
+from protocol import (
+    GUIDANCE_ABSENT_REASONS,
+    GUIDANCE_RULES,
+    KERNICTERUS_RISK_FACTORS,
+    MURATA_CATEGORY_ORDER,
+    GuidanceRecord,
+    get_k2_record,
+    get_mass_screening_record,
+    get_prematurity_category,
+    get_weight_category,
+    rule_condition_met,
+)
+from sweep import SWEEP_FLAGS, SWEEP_FLAG_INPUTS, murata_category_index
+
+# 危険因子・リスクフラグを1つの整数（ビットマスク）で表す。1患者1列で保存でき、判定は表引きと整数演算で済む
+# 下位8ビット：核黄疸危険因子（KERNICTERUS_RISK_FACTORS の順）
+# その上の10ビット：管理のポイントのフラグ（SWEEP_FLAGS の順。スイープの flags_to_mask と同じ並び）
+KERNICTERUS_FLAGS = tuple(
+    "apgar_5min_le3" if c["field"] == "apgar_score_5min" else c["field"] for c in KERNICTERUS_RISK_FACTORS
+)
+RISK_FLAGS = KERNICTERUS_FLAGS + SWEEP_FLAGS
+RISK_FLAG_BITS = {name: 1 << i for i, name in enumerate(RISK_FLAGS)}
+KERNICTERUS_BITS = (1 << len(KERNICTERUS_FLAGS)) - 1
+GUIDANCE_FLAG_SHIFT = len(KERNICTERUS_FLAGS)
+
+# フラグ → 判定条件（核黄疸危険因子は KERNICTERUS_RISK_FACTORS、管理のポイントは GUIDANCE_RULES の条件）
+RISK_FLAG_CONDITIONS = dict(zip(KERNICTERUS_FLAGS, KERNICTERUS_RISK_FACTORS))
+for _flag in SWEEP_FLAGS:
+    _field = SWEEP_FLAG_INPUTS[_flag][0]
+    RISK_FLAG_CONDITIONS[_flag] = next(
+        c for rule in GUIDANCE_RULES.values() for c in rule["any"] if c["field"] == _field
+    )
+
+
+def pack_risk_mask(inputs):
+    """入力（get_guidance_records・get_kernicterus_risk_factors と同じ項目名）をビットマスクにする"""
+    mask = 0
+    for name in RISK_FLAGS:
+        condition = RISK_FLAG_CONDITIONS[name]
+        if condition["field"] in inputs and rule_condition_met(condition, inputs):
+            mask |= RISK_FLAG_BITS[name]
+    return mask
+
+
+def unpack_risk_mask(mask):
+    return {name: bool(mask & bit) for name, bit in RISK_FLAG_BITS.items()}
+
+
+def _kernicterus_tables():
+    reasons = []
+    for mask in range(1 << len(KERNICTERUS_FLAGS)):
+        reasons.append(tuple(
+            c["reason"] for i, c in enumerate(KERNICTERUS_RISK_FACTORS) if mask & (1 << i)
+        ))
+    shift = np.array([1 if r else 0 for r in reasons], dtype=np.int64)
+    return shift, tuple(reasons)
+
+
+# 核黄疸危険因子のマスク（256通り）→ 村田・井村の基準を下げる段数 / 危険因子の表示名
+KERNICTERUS_SHIFT, KERNICTERUS_REASONS = _kernicterus_tables()
+
+
+def kernicterus_risk_factors(mask):
+    return KERNICTERUS_REASONS[mask & KERNICTERUS_BITS]
+
+
+def murata_category_from_mask(weight, mask):
+    """(適用する区分, 元の区分)。get_phototherapy_threshold と同じ区分を表引きで求める"""
+    original = int(murata_category_index(weight, 0))
+    shifted = int(murata_category_index(weight, KERNICTERUS_SHIFT[mask & KERNICTERUS_BITS]))
+    return MURATA_CATEGORY_ORDER[shifted], MURATA_CATEGORY_ORDER[original]
+
+
+def murata_category_index_batch(weights, masks):
+    masks = np.asarray(masks, dtype=np.int64)
+    return murata_category_index(np.asarray(weights), KERNICTERUS_SHIFT[masks & KERNICTERUS_BITS])
+
+
+def _complement_index(absent, conditions):
+    # 適応なしの理由は適応条件の否定（ga_ge_37 ⇔ ga_lt_37 など）。対応する適応条件の位置を返す
+    complements = {"not": None, "ge": "lt", "gt": "le"}
+    for i, c in enumerate(conditions):
+        if c["field"] == absent["field"] and c.get("op") == complements[absent["op"]] and c.get("value") == absent.get("value"):
+            return i
+    raise ValueError(f"適応条件に対応しない理由です: {absent['code']}")
+
+
+def _guidance_tables():
+    tables = {}
+    for check, rule in GUIDANCE_RULES.items():
+        conditions = rule["any"]
+        flag_bits = []
+        for c in conditions:
+            flag = next((name for name in SWEEP_FLAGS if RISK_FLAG_CONDITIONS[name]["code"] == c.get("code")), None)
+            flag_bits.append(None if flag is None else RISK_FLAGS.index(flag))
+        absent = [(a["code"], _complement_index(a, conditions)) for a in GUIDANCE_ABSENT_REASONS[check]]
+
+        size = 1 << len(conditions)
+        reasons = []
+        absent_reasons = []
+        for bits in range(size):
+            reasons.append(tuple(c["code"] for i, c in enumerate(conditions) if bits & (1 << i)))
+            absent_reasons.append(tuple(code for code, i in absent if not bits & (1 << i)))
+        tables[check] = {
+            "conditions": conditions,
+            "flag_bits": flag_bits,
+            "needed": np.arange(size) != 0,
+            "reasons": tuple(reasons),
+            "absent_reasons": tuple(absent_reasons),
+        }
+    return tables
+
+
+# 項目ごとに「適応条件を満たしたか」をビットにした値（項目の条件数ぶん）→ 適応 / 理由コード / 適応なしの理由コード
+GUIDANCE_MASK_TABLES = _guidance_tables()
+
+
+def guidance_condition_bits(check, masks, gestational_age, weight):
+    """項目の各適応条件の成否をビットにまとめる。配列を渡せば全患者分をまとめて計算する"""
+    table = GUIDANCE_MASK_TABLES[check]
+    masks = np.asarray(masks, dtype=np.int64)
+    numeric = {"gestational_age": np.asarray(gestational_age), "weight": np.asarray(weight)}
+    bits = np.zeros(np.broadcast(masks, numeric["gestational_age"], numeric["weight"]).shape, dtype=np.int64)
+    for i, (condition, flag_bit) in enumerate(zip(table["conditions"], table["flag_bits"])):
+        if flag_bit is None:
+            hit = rule_condition_met(condition, numeric).astype(np.int64)
+        else:
+            hit = (masks >> flag_bit) & 1
+        bits |= hit << i
+    return bits
+
+
+def guidance_indications(masks, gestational_age, weight, checks=None):
+    """{項目: 適応の真偽（配列）}。AABR・MRI・眼底などの適応をマスクと在胎・体重から表引きで求める"""
+    return {
+        check: GUIDANCE_MASK_TABLES[check]["needed"][guidance_condition_bits(check, masks, gestational_age, weight)]
+        for check in (checks or GUIDANCE_MASK_TABLES)
+    }
+
+
+def get_guidance_records_from_mask(weight, gestational_age, mask, birth_date=None, birth_time=None):
+    """get_guidance_records と同じ結果を、リスクフラグのマスクから表引きで作る"""
+    records = [get_k2_record(birth_date if birth_date and birth_time else None)]
+    records.append(get_mass_screening_record(gestational_age, birth_date))
+    for check, table in GUIDANCE_MASK_TABLES.items():
+        bits = int(guidance_condition_bits(check, mask, gestational_age, weight))
+        needed = bool(table["needed"][bits])
+        notes = ()
+        if not needed:
+            reasons = table["absent_reasons"][bits]
+        else:
+            reasons = table["reasons"][bits]
+            if check == "mri" and weight < 1000:  # 極低出生体重児
+                notes = ("mri_elbw_timing",)
+        records.append(GuidanceRecord(check, needed, reasons, (), notes))
+
+    return {
+        "category": f"{get_prematurity_category(gestational_age)} / {get_weight_category(weight)}",
+        "records": tuple(records),
+    }
@@ -0,0 +1,89 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# セッションごとのメモリ量の見積もりと、重い表示結果（HTML・グラフ）を全セッションで共有するLRU
+DEFAULT_SHARED_OUTPUT_BUDGET_MB = 32
+
+
+def estimate_object_size(obj, seen=None):
+    """常駐メモリの概算（bytes）。同じオブジェクトを2回数えないよう id で重複を除く"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        return sys.getsizeof(obj) + nbytes  # numpy 配列
+    if hasattr(obj, "to_plotly_json"):
+        # Plotly の Figure は内部の辞書をたどる（描画用のJSONとほぼ同じ大きさ）
+        return sys.getsizeof(obj) + estimate_object_size(obj.to_plotly_json(), seen)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += estimate_object_size(k, seen) + estimate_object_size(v, seen)
+    elif isinstance(obj, (tuple, list, set, frozenset)):
+        for v in obj:
+            size += estimate_object_size(v, seen)
+    return size
+
+
+def session_memory_report(state):
+    """セッション状態のキーごとの概算バイト数（大きい順）と合計"""
+    seen = set()
+    items = sorted(
+        ((str(key), estimate_object_size(state[key], seen)) for key in list(state.keys())),
+        key=lambda item: -item[1],
+    )
+    return {"items": items, "total_bytes": sum(size for _, size in items)}
+
+
+class SharedOutputCache:
+    """入力値から作り直せる表示結果を全セッションで共有する。上限を超えたら最も古いものから捨てる"""
+
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            entry = self._resident.get(key)
+            if entry is not None:
+                self._resident.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # 作成はロックの外で行う（同時に同じキーを作っても結果は同じ）
+        value = build()
+        size = estimate_object_size(value)
+
+        with self._lock:
+            self._resident[key] = (value, size)
+            self._resident.move_to_end(key)
+            self._evict()
+        return value
+
+    def _evict(self):
+        total = sum(size for _, size in self._resident.values())
+        while total > self.memory_budget_bytes and len(self._resident) > 1:
+            _, (_, size) = self._resident.popitem(last=False)
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            sizes = [size for _, size in self._resident.values()]
+            hits, misses = self.hits, self.misses
+        return {
+            "entries": len(sizes),
+            "resident_bytes": sum(sizes),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "hits": hits,
+            "misses": misses,
+        }
@@ -1,8 +1,74 @@
+import os
+import threading
 import streamlit as st
 from datetime import datetime, date, timedelta
 import plotly.graph_objects as go
-import openpyxl
-import math
+import numpy as np
+import streamlit.components.v1 as components
+from lms import (
+    value_to_lms_z,
+    z_to_percentile,
+    get_birth_size_thresholds,
+    get_lms_keys,
+)
+from protocol import (
+    DELIVERY_STRESS_METHODS,
+    get_due_schedule,
+    get_prematurity_category,
+    get_weight_pending_records,
+    guidance_title,
+    k2_third_to_twelfth_text,
+)
+from bilirubin_forecast import (
+    FORECAST_HORIZON_HOURS,
+    FORECAST_LINE_LABELS,
+    FORECAST_LINES,
+    FORECAST_WINDOW,
+    first_midnight_hours,
+    forecast_bilirubin,
+    pack_bilirubin_samples,
+)
+from zscore_drift import DRIFT_MEASURE_LABELS, DRIFT_MONITOR_PATH, cohort_drift_monitor, load_drift_monitor
+from ga_estimator import estimate_gestational_age, format_ga_days
+from guidance_render import render_guidance_markdown
+from reference_registry import ReferenceValidationError, build_reference_registry, format_validation_report
+from risk_mask import pack_risk_mask, kernicterus_risk_factors, get_guidance_records_from_mask
+from session_memory import DEFAULT_SHARED_OUTPUT_BUDGET_MB, SharedOutputCache, session_memory_report
+from tcb_feed import TCB_CHART_MAX_POINTS, TcbFeed, build_tcb_fig, make_tcb_server, start_tcb_tail
+from time_schedule import get_time_state, next_time_boundary
+from protocol_tables import PROTOCOL_TABLES_PATH, ProtocolTableStore, start_protocol_watch
+from ward_counters import WARD_COUNTER_LABELS, WARD_DUE_CHECKS, WardCounters
+from due_worklist import DueWorklist
+from cohort_plane import (
+    COHORT_FIELDS,
+    build_cohort_plane_fig,
+    classify_birth_size_z,
+    cohort_birth_size_z,
+    parse_cohort_file,
+    synthetic_cohort,
+)
+from offline_bundle import OFFLINE_COMPONENT_DIR, build_offline_bundle
+from sweep import (
+    SWEEP_FLAGS,
+    SWEEP_FLAG_LABELS,
+    SWEEP_CHECKS,
+    SWEEP_CHECK_LABELS,
+    flags_to_mask,
+    run_sweep,
+    sweep_check_grid,
+    sweep_triggered_count,
+)
+from growth import (
+    GROWTH_MEASURES,
+    GROWTH_MEASURE_LABELS,
+    get_growth_profile,
+    get_growth_series,
+    initial_growth_inputs,
+    build_growth_series,
+    add_growth_measurement,
+    build_growth_z_fig,
+    build_percentile_curve_fig,
+)
 
 st.set_page_config(
     page_title="新生児管理チェックリスト",
@@ -50,112 +116,104 @@ ICON_HYPOGLYCEMIA = "🩸"
 ICON_JAUNDICE = "💡"
 
 
-def lms_to_value(L, M, S, z):
-    if L is None or M is None or S is None:
-        return None
-    if L == 0:
-        return M * (2.718281828459045 ** (S * z))
-    return M * ((1 + L * S * z) ** (1 / L))
+@st.cache_resource(show_spinner=False)
+def get_reference_registry():
+    # 全セッションで共有（基準データは初回参照時に読み込む）
+    return build_reference_registry()
 
 
-def value_to_lms_z(L, M, S, value):
-    if L is None or M is None or S is None or value is None:
-        return None
-    if value <= 0 or M <= 0 or S == 0:
-        return None
-    if L == 0:
-        return math.log(value / M) / S
-    return (((value / M) ** L) - 1) / (L * S)
+@st.cache_resource(show_spinner=False)
+def get_shared_outputs():
+    # 入力値から作り直せるHTML・グラフは全セッションで共有し、セッション状態には持たせない
+    return SharedOutputCache(DEFAULT_SHARED_OUTPUT_BUDGET_MB * 1024 * 1024)
 
 
-def z_to_percentile(z):
-    if z is None:
-        return None
-    return 50.0 * (1.0 + math.erf(z / math.sqrt(2.0)))
-
-
-@st.cache_data(show_spinner=False)
-def load_taikaku_birth_lms(path):
-    wb = openpyxl.load_workbook(path, data_only=True)
-    sheet_name = wb.sheetnames[7]
-    sh = wb[sheet_name]
-
-    rows = {}
-    last_week = None
-    for r in range(7, sh.max_row + 1):
-        week = sh.cell(r, 2).value
-        day = sh.cell(r, 3).value
-        if week is None:
-            week = last_week
-        if week is None or day is None:
-            continue
+@st.cache_resource(show_spinner=False)
+def get_tcb_feed():
+    # 経皮ビリルビン計の受信は全セッションで1つ。TCB_FEED_PATH（追記されるファイル）・TCB_FEED_PORT（ローカルのソケット）で受信元を指定する
+    # 到着時の判定は基準の表の現在の版で行い、版が切り替わったら全児を判定し直す
+    protocol_store = get_protocol_store()
+    feed = TcbFeed(tables=protocol_store.current())
+    protocol_store.subscribe(feed.set_tables)
+    if os.environ.get("TCB_FEED_PATH"):
+        start_tcb_tail(feed, os.environ["TCB_FEED_PATH"], from_start=True)  # 既存の記録も読み込んでバッファを作る
+    if os.environ.get("TCB_FEED_PORT"):
+        server = make_tcb_server(feed, port=int(os.environ["TCB_FEED_PORT"]))
+        threading.Thread(target=server.serve_forever, name="tcb-server", daemon=True).start()
+    return feed
 
-        last_week = int(week)
-
-        key = (int(week), int(day))
-        rows[key] = {
-            "maleFB_w": (sh.cell(r, 4).value, sh.cell(r, 5).value, sh.cell(r, 6).value),
-            "maleSB_w": (sh.cell(r, 10).value, sh.cell(r, 11).value, sh.cell(r, 12).value),
-            "femaleFB_w": (sh.cell(r, 16).value, sh.cell(r, 17).value, sh.cell(r, 18).value),
-            "femaleSB_w": (sh.cell(r, 22).value, sh.cell(r, 23).value, sh.cell(r, 24).value),
-            "birthH": (sh.cell(r, 34).value, sh.cell(r, 35).value, sh.cell(r, 36).value),
-            # 頭囲LMS（Cols 28-30、性別・出生順位に関わらず共通）
-            "maleFB_hc": (sh.cell(r, 28).value, sh.cell(r, 29).value, sh.cell(r, 30).value),
-            "maleSB_hc": (sh.cell(r, 28).value, sh.cell(r, 29).value, sh.cell(r, 30).value),
-            "femaleFB_hc": (sh.cell(r, 28).value, sh.cell(r, 29).value, sh.cell(r, 30).value),
-            "femaleSB_hc": (sh.cell(r, 28).value, sh.cell(r, 29).value, sh.cell(r, 30).value),
-        }
-
-    return rows
-
-
-def get_birth_size_thresholds(taikaku_rows, gender, is_first_child_bool, gestational_weeks, gestational_days):
-    key = (int(gestational_weeks), int(gestational_days))
-    row = taikaku_rows.get(key)
-    if row is None:
-        key = (int(gestational_weeks), 0)
-        row = taikaku_rows.get(key)
-    if row is None:
-        w = int(gestational_weeks)
-        for dw in range(1, 8):
-            row = taikaku_rows.get((w - dw, 0))
-            if row is not None:
-                break
-            row = taikaku_rows.get((w + dw, 0))
-            if row is not None:
-                break
-    if row is None:
-        return None
 
-    if gender == "男児":
-        weight_key = "maleFB_w" if is_first_child_bool else "maleSB_w"
-        hc_key = "maleFB_hc" if is_first_child_bool else "maleSB_hc"
+@st.cache_resource(show_spinner=False)
+def get_ward_counters():
+    # 病棟の集計は全セッションで1つ。登録・更新のたびに差分だけを反映する（基準の表の版が切り替わったら全員を判定し直す）
+    protocol_store = get_protocol_store()
+    counters = WardCounters(tables=protocol_store.current())
+    protocol_store.subscribe(counters.set_tables)
+    return counters
+
+
+@st.cache_resource(show_spinner=False)
+def get_due_worklist():
+    # 実施予定の索引も全セッションで1つ。変わった児の項目だけを差し替える
+    return DueWorklist()
+
+
+@st.cache_resource(show_spinner=False)
+def get_drift_monitor():
+    # 病棟の集計に登録した児の出生体格Zスコアのスケッチ（全セッションで1つ。追加のたびにファイルへ保存する）
+    return load_drift_monitor(os.environ.get("DRIFT_MONITOR_PATH", DRIFT_MONITOR_PATH))
+
+
+@st.cache_resource(show_spinner=False)
+def get_protocol_store():
+    # 基準の表（村田・森岡）は全セッションで1つ。PROTOCOL_TABLES_PATH のファイルが変わったら検証してから差し替える
+    store = ProtocolTableStore(os.environ.get("PROTOCOL_TABLES_PATH", PROTOCOL_TABLES_PATH))
+    start_protocol_watch(store)
+    return store
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_cohort_z(cohort_key, reference_dataset_id):
+    # cohort_key: ("synthetic", 人数) または (ファイル名, 内容)
+    if cohort_key[0] == "synthetic":
+        cohort = synthetic_cohort(cohort_key[1])
     else:
-        weight_key = "femaleFB_w" if is_first_child_bool else "femaleSB_w"
-        hc_key = "femaleFB_hc" if is_first_child_bool else "femaleSB_hc"
-
-    wL, wM, wS = row[weight_key]
-    hL, hM, hS = row["birthH"]
-    hcL, hcM, hcS = row.get(hc_key, (None, None, None))
-
-    z10 = -1.281551565545
-    z90 = 1.281551565545
-    z_minus2 = -2.0
-
-    return {
-        "weight_p10_g": lms_to_value(wL, wM, wS, z10),
-        "weight_p90_g": lms_to_value(wL, wM, wS, z90),
-        "weight_minus2sd_g": lms_to_value(wL, wM, wS, z_minus2),
-        "height_p10_cm": lms_to_value(hL, hM, hS, z10),
-        "height_p90_cm": lms_to_value(hL, hM, hS, z90),
-        "height_minus2sd_cm": lms_to_value(hL, hM, hS, z_minus2),
-        "hc_p10_cm": lms_to_value(hcL, hcM, hcS, z10),
-        "hc_p90_cm": lms_to_value(hcL, hcM, hcS, z90),
-        "hc_minus2sd_cm": lms_to_value(hcL, hcM, hcS, z_minus2),
-        "weight_lms": (wL, wM, wS),
-        "height_lms": (hL, hM, hS),
-        "hc_lms": (hcL, hcM, hcS),
-    }
+        cohort = parse_cohort_file(*cohort_key)
+    return cohort_birth_size_z(get_reference_registry().get(reference_dataset_id), cohort)
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def get_cohort_drift_report(cohort_key, reference_dataset_id):
+    # 病棟・出生日を持つ児だけをスケッチに入れ、病棟 × 月 × 項目ごとの判定を返す
+    if cohort_key[0] == "synthetic":
+        return []
+    monitor = cohort_drift_monitor(get_reference_registry().get(reference_dataset_id), parse_cohort_file(*cohort_key))
+    return monitor.report()
+
+
+@st.cache_resource(show_spinner=False)
+def get_offline_bundle(reference_dataset_id, protocol_digest, _protocol_tables):
+    # 基準の表は版（digest）ごとに作り直す。_protocol_tables はキャッシュのキーに含めない
+    return build_offline_bundle(
+        get_reference_registry().get(reference_dataset_id), reference_dataset_id, _protocol_tables
+    )
+
+
+offline_evaluator = components.declare_component("offline_evaluator", path=OFFLINE_COMPONENT_DIR)
+boundary_timer = components.declare_component(
+    "boundary_timer",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "timer_component"),
+)
+
+
+def schedule_boundary_rerun(key, birth_date, birth_time, tables=None):
+    """次の時間区分の境目（翌日0時・出生後24/48/72/96/120時間）で、呼び出し元のフラグメントだけ再実行させる
+    tables は基準の表の版（森岡の時間区分の境目をその版から取る）"""
+    now = datetime.now()
+    boundary = next_time_boundary(birth_date, birth_time, now, tables)
+    # 境目を確実に越えてから再実行されるよう1秒遅らせる
+    delay_ms = int((boundary - now).total_seconds() * 1000) + 1000
+    boundary_timer(delay_ms=delay_ms, token=f"{boundary.isoformat()}@{now.isoformat()}", key=key, default=None)
 
 
 def build_birth_size_plane_fig(birth_weight_g, birth_length_cm, thresholds):
@@ -474,143 +532,15 @@ def build_birth_size_plane_fig(birth_weight_g, birth_length_cm, thresholds):
     fig.update_yaxes(range=[y_edges[0], y_edges[-1]])
     return fig
 
-# 村田基準の基準値（グローバル変数として定義）
-MURATA_PHOTOTHERAPY_THRESHOLDS = {
-    "≥ 2,500g": {
-        0: 11.0, 1: 12.0, 2: 15.0, 3: 17.0,
-        4: 18.0, 5: 19.0, 6: 19.5, 7: 20.0
-    },
-    "2,000 ~ 2,499g": {
-        0: 9.5, 1: 10.0, 2: 12.0, 3: 14.0,
-        4: 16.0, 5: 17.0, 6: 18.0, 7: 18.0
-    },
-    "1,500 ~ 1,999g": {
-        0: 7.5, 1: 8.0, 2: 10.0, 3: 12.0,
-        4: 14.0, 5: 15.0, 6: 16.0, 7: 16.0
-    },
-    "1,000 ~ 1,499g": {
-        0: 6.5, 1: 7.0, 2: 7.0, 3: 8.0,
-        4: 9.0, 5: 10.0, 6: 11.0, 7: 12.0
-    },
-    "≤ 999g": {
-        0: 4.5, 1: 5.0, 2: 5.0, 3: 6.0,
-        4: 7.0, 5: 8.0, 6: 9.0, 7: 10.0
-    }
-}
-
-MORIOKA_TB_THRESHOLDS = {
-    (22, 25): {
-        24: (5, 6, 8),
-        48: (5, 8, 10),
-        72: (5, 8, 12),
-        96: (6, 9, 13),
-        120: (7, 10, 13),
-        float("inf"): (8, 10, 13),
-    },
-    (26, 27): {
-        24: (5, 6, 8),
-        48: (5, 9, 10),
-        72: (6, 9, 12),
-        96: (8, 11, 14),
-        120: (9, 12, 15),
-        float("inf"): (10, 12, 15),
-    },
-    (28, 29): {
-        24: (6, 7, 9),
-        48: (7, 10, 12),
-        72: (8, 12, 14),
-        96: (10, 13, 16),
-        120: (11, 14, 18),
-        float("inf"): (12, 14, 18),
-    },
-    (30, 31): {
-        24: (7, 8, 10),
-        48: (8, 12, 14),
-        72: (10, 14, 16),
-        96: (12, 15, 18),
-        120: (13, 16, 20),
-        float("inf"): (14, 16, 20),
-    },
-    (32, 34): {
-        24: (8, 9, 10),
-        48: (10, 14, 16),
-        72: (12, 16, 18),
-        96: (14, 18, 20),
-        120: (15, 19, 22),
-        float("inf"): (16, 19, 22),
-    },
-    (35, float("inf")): {
-        24: (10, 11, 12),
-        48: (12, 16, 18),
-        72: (14, 18, 20),
-        96: (16, 20, 22),
-        120: (17, 22, 25),
-        float("inf"): (18, 22, 25),
-    },
-}
-
-MORIOKA_UB_THRESHOLDS = {
-    (22, 25): (0.4, 0.6, 0.8),
-    (26, 27): (0.4, 0.6, 0.8),
-    (28, 29): (0.5, 0.7, 0.9),
-    (30, 31): (0.6, 0.8, 1.0),
-    (32, 34): (0.7, 0.9, 1.2),
-    (35, float("inf")): (0.8, 1.0, 1.5),
-}
-
-
-def get_morioka_thresholds(pca_weeks, hours_old):
-    if pca_weeks is None or hours_old is None:
-        return None
-
-    pca_w = int(pca_weeks)
-    group = None
-    for (low, high) in MORIOKA_TB_THRESHOLDS.keys():
-        if low <= pca_w <= high:
-            group = (low, high)
-            break
-    if group is None:
-        return None
-
-    tb_bucket = None
-    for upper_h in sorted(MORIOKA_TB_THRESHOLDS[group].keys(), key=lambda x: float(x)):
-        if hours_old < upper_h:
-            tb_bucket = upper_h
-            break
-    if tb_bucket is None:
-        tb_bucket = float("inf")
-
-    tb_low, tb_high, tb_exchange = MORIOKA_TB_THRESHOLDS[group][tb_bucket]
-    ub_low, ub_high, ub_exchange = MORIOKA_UB_THRESHOLDS[group]
-
-    if tb_bucket == float("inf"):
-        time_label = "120時間以上"
-    else:
-        time_label = f"{int(tb_bucket)}時間未満"
-
-    return {
-        "pca_group": group,
-        "time_bucket_hours": tb_bucket,
-        "time_label": time_label,
-        "tb": {"low": tb_low, "high": tb_high, "exchange": tb_exchange},
-        "ub": {"low": ub_low, "high": ub_high, "exchange": ub_exchange},
-    }
-
 
 def build_morioka_html_table(
+    tables,
     current_pca_group=None,
     current_time_bucket_hours=None,
     highlight_pairs=None,
 ):
-    time_buckets = [24, 48, 72, 96, 120, float("inf")]
-    time_labels = {
-        24: "<24h",
-        48: "<48h",
-        72: "<72h",
-        96: "<96h",
-        120: "<120h",
-        float("inf"): "120h-",
-    }
+    labels = tables.MORIOKA_LABELS["ja"]
+    time_buckets = list(labels["buckets"].keys())
 
     table_style = "border-collapse:collapse;width:100%;font-size:14px"
     th_style = "text-align:center;padding:6px 8px;border:1px solid #333;background:#1b1b1b;color:#eaeaea;white-space:nowrap"
@@ -621,13 +551,10 @@ def build_morioka_html_table(
         highlight_pairs = set()
 
     rows = []
-    for (pca_low, pca_high), tb_by_bucket in MORIOKA_TB_THRESHOLDS.items():
-        if pca_high == float("inf"):
-            pca_label = f"{pca_low}w-"
-        else:
-            pca_label = f"{pca_low}-{pca_high}w"
+    for (pca_low, pca_high), tb_by_bucket in tables.MORIOKA_TB_THRESHOLDS.items():
+        pca_label = labels["groups"][(pca_low, pca_high)]["short"]
 
-        ub_low, ub_high, ub_ex = MORIOKA_UB_THRESHOLDS[(pca_low, pca_high)]
+        ub_low, ub_high, ub_ex = tables.MORIOKA_UB_THRESHOLDS[(pca_low, pca_high)]
         ub_cell = f"{ub_low}/{ub_high}/{ub_ex}"
 
         row_cells = []
@@ -665,7 +592,7 @@ def build_morioka_html_table(
         f"<th style='{th_left_style}'>修正週数</th>"
         + "".join(
             [
-                f"<th style='{th_style}'>{time_labels[b]}</th>"
+                f"<th style='{th_style}'>{labels['buckets'][b]['short']}</th>"
                 for b in time_buckets
             ]
         )
@@ -683,17 +610,7 @@ def build_morioka_html_table(
     )
 
 
-def get_morioka_pca_group_from_weeks(pca_weeks):
-    if pca_weeks is None:
-        return None
-    w = int(pca_weeks)
-    for (low, high) in MORIOKA_TB_THRESHOLDS.keys():
-        if low <= w <= high:
-            return (low, high)
-    return None
-
-
-def build_morioka_ub_html_table(current_pca_group=None):
+def build_morioka_ub_html_table(tables, current_pca_group=None):
     table_style = "border-collapse:collapse;width:100%;font-size:14px"
     th_style = "text-align:center;padding:6px 8px;border:1px solid #333;background:#1b1b1b;color:#eaeaea;white-space:nowrap"
     th_left_style = "text-align:left;padding:6px 8px;border:1px solid #333;background:#1b1b1b;color:#eaeaea;white-space:nowrap"
@@ -709,11 +626,8 @@ def build_morioka_ub_html_table(current_pca_group=None):
     )
 
     rows = []
-    for (pca_low, pca_high), (ub_low, ub_high, ub_ex) in MORIOKA_UB_THRESHOLDS.items():
-        if pca_high == float("inf"):
-            pca_label = f"{pca_low}w-"
-        else:
-            pca_label = f"{pca_low}-{pca_high}w"
+    for (pca_low, pca_high), (ub_low, ub_high, ub_ex) in tables.MORIOKA_UB_THRESHOLDS.items():
+        pca_label = tables.MORIOKA_LABELS["ja"]["groups"][(pca_low, pca_high)]["short"]
 
         is_row_hit = (current_pca_group == (pca_low, pca_high))
         hit_td_style = td_style + ";background:#ffeeba;color:#111;font-weight:800" if is_row_hit else td_style
@@ -736,381 +650,239 @@ def build_morioka_ub_html_table(current_pca_group=None):
         "</div>"
     )
 
-def get_phototherapy_threshold(weight, days_old, has_kernicterus_risk=False):
-    """村田・井村の基準に基づいて光線療法基準値を取得"""
-    
-    # 出生体重カテゴリーの決定
-    if weight >= 2500:
-        category = "≥ 2,500g"
-    elif weight >= 2000:
-        category = "2,000 ~ 2,499g"
-    elif weight >= 1500:
-        category = "1,500 ~ 1,999g"
-    elif weight >= 1000:
-        category = "1,000 ~ 1,499g"
-    else:  # weight < 1000
-        category = "≤ 999g"
-    
-    original_category = category
-    
-    # 核黄疸危険因子がある場合は1段階低い基準を使用
-    if has_kernicterus_risk:
-        if category == "≥ 2,500g":
-            category = "2,000 ~ 2,499g"
-        elif category == "2,000 ~ 2,499g":
-            category = "1,500 ~ 1,999g"
-        elif category == "1,500 ~ 1,999g":
-            category = "1,000 ~ 1,499g"
-        elif category == "1,000 ~ 1,499g":
-            category = "≤ 999g"
-        # ≤ 999g の場合はこれ以上低い基準がないので、そのまま使用
-    
-    thresholds = MURATA_PHOTOTHERAPY_THRESHOLDS[category]
-    
-    # 日齢に応じた基準値を取得
-    if days_old == 0:
-        # 0日目は村田・井村の基準として定義がないため、数値を返さない
-        day = 0
-        threshold = None
-        is_day0 = True
-    else:
-        day = min(days_old, 7)
-        threshold = thresholds.get(day, thresholds[7])
-        is_day0 = False
-    
-    # 0日目の基準は未定義のため、参考値も返さない
-    day0_threshold = None
-    
-    # 核黄疸危険因子により基準を変更した場合の情報も返す
-    adjusted = has_kernicterus_risk and original_category != category
-    
-    return category, threshold, adjusted, original_category, is_day0, day0_threshold
-
-def get_management_guidance(weight, is_first_child, delivery_method, gestational_age, days_old,
-                           maternal_diabetes=False, maternal_thyroid_abnormal=False,
-                           apgar_score_5min=9, delivery_stress=False, birth_date=None, birth_time=None,
-                           exchange_transfusion=False, intracranial_hemorrhage=False,
-                           apnea_treatment=False, aminoglycoside_history=False,
-                           high_oxygen=False, corrected_weeks=0,
-                           gestational_weeks=0, gestational_days=0,
-                           weight_lt_p10=False, weight_ge_p90=False):
-    """新生児の体重や状況に基づいて管理方針を決定"""
-    
-    guidance = {
-        'category': '',
-        'recommendations': [],
-        'warnings': [],
-        'special_management': []
-    }
-    
-    # 分類（出生体重 + 早産の程度）
-    if weight >= 4000:
-        weight_cat = '高出生体重児'
-    elif weight >= 2500:
-        weight_cat = '正常出生体重児'
-    elif weight < 1000:
-        weight_cat = '超極低出生体重児（ELBW）'
-    elif weight < 1500:
-        weight_cat = '極低出生体重児（VLBW）'
-    else:
-        weight_cat = '低出生体重児（LBW）'
-
-    if gestational_age >= 42:
-        prematurity_cat = '過期産'
-    elif gestational_age >= 37:
-        prematurity_cat = '正期産'
-    elif gestational_age >= 34:
-        prematurity_cat = '後期早産'
-    else:
-        prematurity_cat = '早産'
 
-    guidance['category'] = f"{prematurity_cat} / {weight_cat}"
-    
-    # ケイツーシロップ12回投与法（すべての子どもに適応）
-    k2_third_to_twelfth = None
-    
-    # 3回目以降：日齢11以降に迎える水曜日から毎週水曜日に12回目まで
-    if birth_date and birth_time:
-        birth_datetime = datetime.combine(birth_date, birth_time)
-        # 日齢11以降に迎える最初の水曜日を計算
-        first_wednesday_after_day11 = None
-        for i in range(11, 18):  # 日齢11から17の間で最初の水曜日を探す
-            check_date = birth_date + timedelta(days=i)
-            if check_date.weekday() == 2:  # 水曜日
-                first_wednesday_after_day11 = check_date
-                break
-        
-        if first_wednesday_after_day11:
-            last_wednesday = first_wednesday_after_day11 + timedelta(weeks=9)  # 12回目（3回目から10週後）
-            k2_third_to_twelfth = f'{first_wednesday_after_day11.strftime("%Y/%m/%d")}から{last_wednesday.strftime("%Y/%m/%d")}まで毎週水曜日に内服'
-    
-    # すべての子どもに適応があるため、常に表示
-    guidance['special_management'].append({
-        'title': '💊 ケイツーシロップ12回投与法',
-        'k2_third_to_twelfth': k2_third_to_twelfth,
-        'items': [
-            '・入院中の内服は処置オーダで指示する',
-            '・退院処方として12回目までのケイツーを処方する'
-        ],
-        'needed': True
-    })
-    
-    # マススクリーニング（すべての子どもに適応）
-    mass_screening_items = []
-    if birth_date:
-        day4_date = birth_date + timedelta(days=4)
-        mass_screening_items.append(f'・日齢4（{day4_date.strftime("%Y/%m/%d")}）：マススクリーニングを実施（希望あれば拡大マスも）')
+reference_registry = get_reference_registry()
+reference_dataset_id = st.sidebar.selectbox(
+    "体格基準データ",
+    reference_registry.dataset_ids(),
+    format_func=reference_registry.label,
+)
+try:
+    taikaku_rows = reference_registry.get(reference_dataset_id)
+except ReferenceValidationError as e:
+    # 検証に失敗した基準データはキャッシュにせず、判定にも使わない
+    st.error(f"基準データ「{reference_registry.label(reference_dataset_id)}」の検証に失敗したため使用できません。")
+    st.code(format_validation_report(e.report))
+    st.stop()
+shared_outputs = get_shared_outputs()
+# 光線療法基準の表は再表示の最初に版を1回だけ取得し、この再表示の間は同じ版を使う（差し替えは次の再表示から）
+protocol_store = get_protocol_store()
+protocol_tables = protocol_store.current()
+st.sidebar.caption(f"基準の表: {protocol_tables.version}（{protocol_tables.digest[:8]}）")
+if protocol_store.error:
+    st.sidebar.warning(f"基準の表のファイルを読み込めないため、前の版を使用しています: {protocol_store.error}")
+# 開いたままの端末が多くてもメモリを抱え込まないよう、既定では入力値だけをセッションに残す
+compact_session = st.sidebar.toggle("省メモリモード（入力値のみ保持）", value=True, key="compact_session")
+
+# ブラウザ内評価：入力の変更はブラウザ内で判定し、サーバーとは保存時のみ通信する
+if st.sidebar.toggle("ブラウザ内評価モード（通信不安定時）", key="offline_mode"):
+    st.header("📴 ブラウザ内評価")
+    st.caption("入力を変えても再読み込みせず、その場で判定します。「判定結果を保存」を押したときだけサーバーに送信します。")
+
+    offline_bundle = get_offline_bundle(reference_dataset_id, protocol_tables.digest, protocol_tables)
+    offline_value = offline_evaluator(bundle=offline_bundle, initial=None, key="offline_evaluator", default=None)
+
+    if "offline_saved" not in st.session_state:
+        st.session_state["offline_saved"] = []
+    offline_saved = st.session_state["offline_saved"]
+    if offline_value is not None and all(r["saved_at"] != offline_value["saved_at"] for r in offline_saved):
+        offline_saved.append(offline_value)
+
+    if offline_saved:
+        st.markdown("### 💾 保存済みの判定")
+        st.dataframe(
+            [
+                {
+                    "保存時刻": r["saved_at"],
+                    "在胎": f"{r['inputs']['gestational_weeks']}週{r['inputs']['gestational_days']}日",
+                    "体重 (g)": r["inputs"]["weight"],
+                    "体格": r["results"]["birth_size"]["label"],
+                    "村田・井村": None if r["results"]["murata"] is None else r["results"]["murata"]["threshold"],
+                    "基準データ版": r["bundle_version"],
+                    "基準の表": r.get("protocol_version"),
+                }
+                for r in offline_saved
+            ],
+            width='stretch',
+        )
+    st.stop()
+
+
+def render_drift_report(drift_rows):
+    # 病棟 × 月 × 項目ごとの判定（ZScoreDriftMonitor.report の行）をアラートと表で表示する
+    drift_alerts = [row for row in drift_rows if row["reasons"]]
+    if drift_alerts:
+        for row in drift_alerts:
+            st.warning(
+                f"{row['unit']} {row['month']} {DRIFT_MEASURE_LABELS[row['measure']]}（{row['n']:,}人）: "
+                + "、".join(row["reasons"])
+            )
     else:
-        mass_screening_items.append('・日齢4：マススクリーニングを実施（希望あれば拡大マスも）')
-    
-    # 早産児は退院前にマススクリーニング再検
-    if gestational_age < 37:
-        mass_screening_items.append('・早産児のため、退院前にマススクリーニング再検を行う')
-    
-    # すべての子どもに適応があるため、常に表示
-    guidance['special_management'].append({
-        'title': '🧪 マススクリーニング',
-        'items': mass_screening_items,
-        'needed': True
-    })
-    
-    # 血糖チェック
-    hypoglycemia_risk = (
-        gestational_age < 37 or
-        weight < 2500 or
-        maternal_diabetes or
-        weight_ge_p90 or
-        maternal_diabetes or
-        delivery_stress or
-        apgar_score_5min < 7
+        st.success("N(0,1) からの明らかなずれはありません。")
+    st.dataframe(
+        [
+            {
+                "病棟": row["unit"],
+                "月": row["month"],
+                "項目": DRIFT_MEASURE_LABELS[row["measure"]],
+                "人数": row["n"],
+                "中央値（SD）": round(row["median"], 2),
+                "SD（四分位範囲から）": round(row["sd_iqr"], 2),
+                "KS": round(row["ks"], 3),
+                "KS上限": round(row["ks_limit"], 3),
+            }
+            for row in drift_rows
+        ],
+        hide_index=True,
     )
-    
-    if hypoglycemia_risk:
-        # 適応理由を取得
-        risk_reasons = []
-        if gestational_age < 37:
-            risk_reasons.append("在胎37週未満")
-        if weight < 2500:
-            risk_reasons.append("出生体重2500g未満")
-        if weight_ge_p90:
-            risk_reasons.append("出生体重90%ile以上")
-        if maternal_diabetes:
-            risk_reasons.append("妊娠糖尿病")
-        if delivery_stress:
-            risk_reasons.append("分娩ストレス")
-        if apgar_score_5min < 7:
-            risk_reasons.append("Apgar5分値7未満")
-        
-        items = [
-            '・出生後できるだけ早期にミルクを開始（糖水は避ける）',
-            '・その後も3時間毎に哺乳を継続',
-            '・出生3/6/12時間後に簡易血糖測定を実施'
-        ]
-        guidance['special_management'].append({
-            'title': '🩸 血糖チェック',
-            'items': items,
-            'needed': True
-        })
+
+
+# コホート表示（質改善の会議用）：施設全体の出生体格を、Zスコアに直して1枚の体格平面に重ねる
+if st.sidebar.toggle("コホート表示モード（体格平面）", key="cohort_mode"):
+    st.header("👥 コホートの出生体格")
+    st.caption("在胎週数・性別・出生順位の異なる児をZスコアに直して重ねます。人数が多い場合は格子ごとの人数で表示します。")
+
+    st.markdown("#### 📏 Zスコアのドリフト監視（病棟の集計に登録した児）")
+    live_drift_rows = get_drift_monitor().report()
+    if not live_drift_rows:
+        st.caption("病棟の集計に病棟名を付けて登録した児の出生体格Zスコアを、病棟 × 出生月ごとに蓄積して確認します。")
     else:
-        # 適応がない理由を判定
-        reason = []
-        if gestational_age >= 37:
-            reason.append("在胎37週以上")
-        if weight >= 2500:
-            reason.append("体重2500g以上")
-        if not maternal_diabetes:
-            reason.append("糖尿病母体なし")
-        if not delivery_stress:
-            reason.append("分娩ストレスなし")
-        if apgar_score_5min >= 7:
-            reason.append("Apgar5分値7以上")
-        guidance['special_management'].append({
-            'title': '🩸 血糖チェック',
-            'items': [f'・適応なし（{"、".join(reason[:3]) if reason else "低血糖リスク因子なし"}）'],
-            'needed': False
-        })
-    
-    # 甲状腺機能検査の対象児
-    thyroid_check_needed = maternal_thyroid_abnormal
-    
-    if thyroid_check_needed:
-        thyroid_items = [
-            '・適応理由：母体の甲状腺異常あり',
-            '・日齢5でTSH/FT4を測定',
-            '・必要に応じて小児科内分泌に相談'
-        ]
-        guidance['special_management'].append({
-            'title': '🦋 甲状腺機能検査',
-            'items': thyroid_items,
-            'needed': True
-        })
+        render_drift_report(live_drift_rows)
+
+    cohort_file = st.file_uploader("コホート（JSON Lines または CSV）", type=["jsonl", "json", "csv"])
+    st.caption(f"列: {', '.join(COHORT_FIELDS)}（性別は 男児/女児、is_first_child は 1/0）")
+    if cohort_file is None:
+        cohort_synthetic_n = st.number_input("見本：架空のコホートの人数（0で表示しない）", min_value=0, max_value=200000, value=0, step=10000)
+        if not cohort_synthetic_n:
+            st.stop()
+        cohort_key = ("synthetic", int(cohort_synthetic_n))
     else:
-        guidance['special_management'].append({
-            'title': '🦋 甲状腺機能検査',
-            'items': ['・適応なし（母体の甲状腺関連情報なし）'],
-            'needed': False
-        })
-    
-    # 頭部MRIを実施する条件
-    mri_needed = (
-        gestational_age < 34 or
-        weight < 1500 or
-        exchange_transfusion or
-        intracranial_hemorrhage
-    )
-    
-    if mri_needed:
-        # 適応理由を取得
-        mri_reasons = []
-        if gestational_age < 34:
-            mri_reasons.append("在胎34週未満")
-        if weight < 1500:
-            mri_reasons.append("体重1500g未満")
-        if exchange_transfusion:
-            mri_reasons.append("交換輸血を実施")
-        if intracranial_hemorrhage:
-            mri_reasons.append("頭蓋内出血")
-        
-        mri_items = [
-            f'・適応理由：{"、".join(mri_reasons)}',
-            '・退院前に頭部MRIを実施',
-            '・時期：全身状態が安定した頃'
-        ]
-        if weight < 1000:  # 極低出生体重児
-            mri_items.append('・極低出生体重児は修正37-44週で検査時体重1500g以上')
-        guidance['special_management'].append({
-            'title': '🧠 頭部MRI',
-            'items': mri_items,
-            'needed': True
-        })
+        cohort_key = (cohort_file.name, cohort_file.getvalue())
+
+    cohort_weight_z, cohort_length_z = get_cohort_z(cohort_key, reference_dataset_id)
+    st.plotly_chart(build_cohort_plane_fig(cohort_weight_z, cohort_length_z), width='stretch')
+
+    cohort_counts = classify_birth_size_z(cohort_weight_z, cohort_length_z)
+    cohort_total = len(cohort_weight_z)
+    cohort_cols = st.columns(len(cohort_counts))
+    for cohort_col, (zone, count) in zip(cohort_cols, cohort_counts.items()):
+        with cohort_col:
+            st.metric(zone, f"{count:,}人", f"{count / cohort_total * 100:.1f}%" if cohort_total else None, delta_color="off")
+
+    st.markdown("#### 📏 Zスコアのドリフト監視（病棟 × 月）")
+    drift_rows = get_cohort_drift_report(cohort_key, reference_dataset_id)
+    if not drift_rows:
+        st.caption("unit（病棟）と birth_date（出生日）の列があるコホートで、体重・身長・頭囲のZスコアが N(0,1) からずれていないかを確認します。")
     else:
-        # 適応がない理由を判定
-        reason = []
-        if gestational_age >= 34:
-            reason.append("在胎34週以上")
-        if weight >= 1500:
-            reason.append("体重1500g以上")
-        if not exchange_transfusion:
-            reason.append("交換輸血なし")
-        if not intracranial_hemorrhage:
-            reason.append("頭蓋内出血なし")
-        guidance['special_management'].append({
-            'title': '🧠 頭部MRI',
-            'items': [f'・適応なし（{"、".join(reason[:2]) if reason else "適応条件を満たさない"}）'],
-            'needed': False
-        })
-    
-    # AABR
-    aabr_insurance = (
-        gestational_age < 35 or
-        weight <= 1800 or
-        exchange_transfusion or  # 重症黄疸（交換輸血を実施）
-        apnea_treatment or
-        aminoglycoside_history or
-        intracranial_hemorrhage
+        render_drift_report(drift_rows)
+    st.stop()
+
+# What-ifスイープ（プロトコル変更の検討用）：通常の入力画面の代わりに格子全体の判定を表示する
+if st.sidebar.toggle("What-ifスイープモード", key="sweep_mode"):
+    st.header("🧮 What-ifスイープ")
+    st.caption("在胎日数×出生体重×リスクフラグの全組合せについて、管理のポイント・光線療法基準の判定を一括計算します。")
+
+    sw_cols = st.columns(4)
+    with sw_cols[0]:
+        sw_ga_start, sw_ga_end = st.slider("在胎週数（週）", min_value=22, max_value=42, value=(22, 42))
+    with sw_cols[1]:
+        sw_w_start, sw_w_end = st.slider("出生体重 (g)", min_value=400, max_value=6000, value=(400, 6000), step=100)
+    with sw_cols[2]:
+        sw_days_old = st.number_input("日齢（村田・森岡）", min_value=0, max_value=60, value=1, step=1)
+    with sw_cols[3]:
+        sw_hours_old = st.number_input("出生後時間（森岡）", min_value=0.0, max_value=1440.0, value=24.0, step=1.0)
+
+    sw_flags = {}
+    sw_flag_cols = st.columns(5)
+    for i, flag_name in enumerate(SWEEP_FLAGS):
+        with sw_flag_cols[i % 5]:
+            sw_flags[flag_name] = st.checkbox(SWEEP_FLAG_LABELS[flag_name], key=f"sweep_flag_{flag_name}")
+    sw_flag_mask = flags_to_mask(sw_flags)
+
+    sweep_result = run_sweep(
+        sw_ga_start * 7,
+        sw_ga_end * 7 + 6,
+        sw_w_start,
+        sw_w_end,
+        1,
+        int(sw_days_old),
+        float(sw_hours_old),
+        protocol_tables,
     )
-    
-    if aabr_insurance:
-        # 適応理由を取得
-        aabr_reasons = []
-        if gestational_age < 35:
-            aabr_reasons.append("在胎35週未満")
-        if weight <= 1800:
-            aabr_reasons.append("体重1800g以下")
-        if exchange_transfusion:
-            aabr_reasons.append("交換輸血を実施")
-        if apnea_treatment:
-            aabr_reasons.append("無呼吸発作治療")
-        if aminoglycoside_history:
-            aabr_reasons.append("アミノグリコシド投与歴")
-        if intracranial_hemorrhage:
-            aabr_reasons.append("頭蓋内出血")
-        
-        guidance['special_management'].append({
-            'title': '👂 AABR',
-            'items': [
-                f'・保険適応理由：{"、".join(aabr_reasons)}',
-                '・時期：全身状態が安定した頃'
-            ],
-            'needed': True
-        })
-    else:
-        # 適応がない理由を判定
-        reason = []
-        if gestational_age >= 35:
-            reason.append("在胎35週以上")
-        if weight > 1800:
-            reason.append("体重1800g超")
-        if not exchange_transfusion:
-            reason.append("交換輸血なし")
-        if not apnea_treatment:
-            reason.append("無呼吸発作治療なし")
-        if not aminoglycoside_history:
-            reason.append("アミノグリコシド投与歴なし")
-        if not intracranial_hemorrhage:
-            reason.append("頭蓋内出血なし")
-        guidance['special_management'].append({
-            'title': '👂 AABR',
-            'items': [f'・保険適応なし（{"、".join(reason[:2]) if reason else "適応条件を満たさない"}。ご家族の希望により自費で実施可能）'],
-            'needed': False
-        })
-    
-    # 眼底検査
-    eye_exam_needed = (
-        gestational_age < 34 or
-        weight < 1800 or
-        high_oxygen
+
+    sw_view = st.radio(
+        "表示",
+        ["該当数"] + list(SWEEP_CHECKS),
+        format_func=lambda v: v if v == "該当数" else SWEEP_CHECK_LABELS[v],
+        horizontal=True,
     )
-    
-    if eye_exam_needed:
-        # 適応理由を取得
-        eye_reasons = []
-        if gestational_age < 34:
-            eye_reasons.append("在胎34週未満")
-        if weight < 1800:
-            eye_reasons.append("体重1800g未満")
-        if high_oxygen:
-            eye_reasons.append("高濃度酸素投与歴")
-        
-        eye_items = [
-            f'・適応理由：{"、".join(eye_reasons)}',
-            '・眼科に診察を依頼する',
-            '・時期：生後2-3週毎',
-            '・準備：サンドールP点眼液を事前に処方しておく',
-            '・眼科宛の院内紹介状を作成し、眼科受診の指示をしておく',
-            '・必要な場合には、眼科処置前後のミルク量を減らす指示を出しておく'
-        ]
-        guidance['special_management'].append({
-            'title': '👁️ 眼底検査',
-            'items': eye_items,
-            'needed': True
-        })
+    if sw_view == "該当数":
+        sw_grid = sweep_triggered_count(sweep_result, sw_flag_mask)
     else:
-        # 適応がない理由を判定
-        reason = []
-        if gestational_age >= 34:
-            reason.append("在胎34週以上")
-        if weight >= 1800:
-            reason.append("体重1800g以上")
-        if not high_oxygen:
-            reason.append("高濃度酸素投与歴なし")
-        guidance['special_management'].append({
-            'title': '👁️ 眼底検査',
-            'items': [f'・適応なし（{"、".join(reason[:2]) if reason else "適応条件を満たさない"}）'],
-            'needed': False
-        })
-    
-    # 特別な管理項目をrecommendationsに変換
-    for special in guidance['special_management']:
-        if special.get('needed', True):
-            guidance['recommendations'].append(f"**{special['title']}**")
-            for item in special['items']:
-                guidance['recommendations'].append(item)
-        else:
-            guidance['recommendations'].append(f"**{special['title']}**")
-            guidance['recommendations'].append(f"<span style='color: gray;'>{special['items'][0]}</span>")
-    
-    return guidance
+        sw_grid = sweep_check_grid(sweep_result, sw_view, sw_flag_mask).astype(int)
+
+    # 描画は10g刻みに間引く（計算は1g刻み）
+    sw_step = 10
+    sw_ga_labels = [f"{d // 7}w{d % 7}d" for d in sweep_result["ga_total_days"]]
+    sw_fig = go.Figure(go.Heatmap(
+        x=sweep_result["weights"][::sw_step],
+        y=sw_ga_labels,
+        z=sw_grid[:, ::sw_step],
+        colorscale="YlOrRd",
+        hovertemplate="在胎%{y} / %{x}g<br>%{z}<extra></extra>",
+    ))
+    sw_fig.update_layout(
+        xaxis_title="出生体重 (g)",
+        yaxis_title="在胎週数",
+        template="plotly_dark",
+        height=640,
+        margin=dict(l=10, r=10, t=40, b=10),
+    )
+    st.plotly_chart(sw_fig, width='stretch')
+
+    sw_sum_cols = st.columns(len(SWEEP_CHECKS))
+    for sw_col, check in zip(sw_sum_cols, SWEEP_CHECKS):
+        with sw_col:
+            rate = sweep_check_grid(sweep_result, check, sw_flag_mask).mean()
+            st.metric(SWEEP_CHECK_LABELS[check], f"{rate * 100:.1f}%")
+
+    st.markdown("### 💡 光線療法基準")
+    sw_photo_fig = go.Figure()
+    for risk, label in [(False, "核黄疸危険因子なし"), (True, "核黄疸危険因子あり")]:
+        sw_photo_fig.add_trace(go.Scatter(
+            x=sweep_result["weights"],
+            y=sweep_result["phototherapy"][risk],
+            mode="lines",
+            name=f"村田・井村（{label}）",
+            line=dict(shape="hv", dash="dot" if risk else "solid"),
+        ))
+    sw_morioka = sweep_result["morioka"]
+    # group_index が -1（22週未満）のときは末尾の「対象外」を引く
+    sw_group_labels = [g["label"] for g in protocol_tables.MORIOKA_LABELS["ja"]["groups"].values()] + ["対象外"]
+    sw_morioka_groups = [sw_group_labels[i] for i in sw_morioka["group_index"]]
+    sw_bucket_label = protocol_tables.MORIOKA_LABELS["ja"]["buckets"][sw_morioka["time_bucket_hours"]]["label"]
+    for i, label in enumerate(["low", "high", "交換輸血"]):
+        sw_photo_fig.add_trace(go.Scatter(
+            x=sw_ga_labels,
+            y=sw_morioka["tb"][:, i],
+            mode="lines",
+            name=f"森岡 TB {label}",
+            xaxis="x2",
+            line=dict(shape="hv"),
+            customdata=sw_morioka_groups,
+            hovertemplate=f"在胎 %{{x}}<br>修正 %{{customdata}}・{sw_bucket_label}<br>TB {label}: %{{y}} mg/dL<extra></extra>",
+        ))
+    sw_photo_fig.update_layout(
+        xaxis=dict(title="出生体重 (g)（村田・井村）"),
+        xaxis2=dict(title="在胎週数（森岡）", overlaying="x", side="top", showgrid=False),
+        yaxis_title="血清総ビリルビン値（mg/dL）",
+        template="plotly_dark",
+        height=460,
+        margin=dict(l=10, r=10, t=60, b=10),
+    )
+    st.plotly_chart(sw_photo_fig, width='stretch')
+    st.caption(f"日齢{int(sw_days_old)}日・出生後{float(sw_hours_old):.0f}時間の基準値（森岡は在胎日数＋日齢から修正週数を算出）")
+    st.stop()
 
 # 入力フィールド
 st.header("✍️ 入力")
@@ -1293,71 +1065,38 @@ with col2:
     hemolysis = st.checkbox(f"溶血 {ICON_JAUNDICE}")
     cns_abnormality = st.checkbox(f"敗血症を含む中枢神経系の異常徴候 {ICON_JAUNDICE}")
 
-# 日齢の計算
-today = date.today()
-days_old = (today - birth_date).days
-
-now_dt = datetime.now()
-birth_dt = datetime.combine(birth_date, birth_time)
-hours_old = (now_dt - birth_dt).total_seconds() / 3600
-if hours_old < 0:
-    hours_old = 0.0
-
-# 修正週数・日数の計算
-total_gestational_days = gestational_weeks * 7 + gestational_days
-corrected_total_days = total_gestational_days + days_old
-corrected_weeks = corrected_total_days // 7
-corrected_days = corrected_total_days % 7
-
-morioka = get_morioka_thresholds(corrected_weeks, hours_old)
-
-# 核黄疸危険因子の自動判定（Apgarスコア5分値≦3、またはその他の危険因子がある場合）
-has_kernicterus_risk = (
-    apgar_score_5min <= 3 or
-    respiratory_distress or
-    acidosis or
-    hypothermia or
-    hypoproteinemia or
-    hypoglycemia or
-    hemolysis or
-    cns_abnormality
-)
-
-# 光線療法基準の計算
-if birth_weight is None:
-    phototherapy_category = None
-    phototherapy_threshold = None
-    adjusted = False
-    original_category = None
-    is_day0 = False
-    day0_threshold = None
-else:
-    phototherapy_category, phototherapy_threshold, adjusted, original_category, is_day0, day0_threshold = get_phototherapy_threshold(
-        birth_weight,
-        days_old,
-        has_kernicterus_risk
-    )
+# 日齢の計算（時刻に依存する表示は下のフラグメント内で再計算する）
+time_state = get_time_state(birth_date, birth_time, gestational_weeks, gestational_days)
+today = time_state["today"]
+days_old = time_state["days_old"]
+corrected_weeks = time_state["corrected_weeks"]
 
 st.markdown("---")
 st.header("🏷️ 判定結果")
 
 # 日齢と修正週数・日数の表示
-col1, col2 = st.columns(2)
-with col1:
-    st.metric("日齢（今日）", f"{days_old} 日")
-with col2:
-    st.metric("修正週数・日数（今日）", f"{corrected_weeks}週{corrected_days}日")
+@st.fragment
+def render_age_metrics():
+    age_state = get_time_state(birth_date, birth_time, gestational_weeks, gestational_days)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("日齢（今日）", f"{age_state['days_old']} 日")
+    with col2:
+        st.metric("修正週数・日数（今日）", f"{age_state['corrected_weeks']}週{age_state['corrected_days']}日")
+    schedule_boundary_rerun("age_metrics_timer", birth_date, birth_time, get_protocol_store().current())
+
+
+render_age_metrics()
 
 # 分娩ストレスの判定
 delivery_stress = (
-    delivery_method in ["吸引・鉗子分娩", "緊急帝王切開"] or
+    delivery_method in DELIVERY_STRESS_METHODS or
     apgar_score_5min < 7
 )
 
 # 管理方針の取得
 is_first_child_bool = is_first_child == "初産"
 
-taikaku_rows = load_taikaku_birth_lms("taikakubirthlongcross_v1.1.xlsx")
 birth_thresholds = get_birth_size_thresholds(
     taikaku_rows,
     gender,
@@ -1413,80 +1152,47 @@ else:
     aga = (not weight_lt_p10) and (not weight_ge_p90)
     hfd_lga = weight_ge_p90
 
-birth_plane_fig = build_birth_size_plane_fig(birth_weight, birth_length, birth_thresholds)
-if birth_weight is None:
-    if gestational_age >= 42:
-        prematurity_cat = "過期産"
-    elif gestational_age >= 37:
-        prematurity_cat = "正期産"
-    elif gestational_age >= 34:
-        prematurity_cat = "後期早産"
-    else:
-        prematurity_cat = "早産"
+birth_plane_fig = shared_outputs.get_or_build(
+    (
+        "birth_plane",
+        birth_weight,
+        birth_length,
+        None if birth_thresholds is None else tuple(sorted(birth_thresholds.items())),
+    ),
+    lambda: build_birth_size_plane_fig(birth_weight, birth_length, birth_thresholds),
+)
+# 危険因子・リスクフラグは1つのビットマスクにまとめ、判定は表引きで行う
+risk_mask = pack_risk_mask({
+    "apgar_score_5min": apgar_score_5min,
+    "respiratory_distress": respiratory_distress,
+    "acidosis": acidosis,
+    "hypothermia": hypothermia,
+    "hypoproteinemia": hypoproteinemia,
+    "hypoglycemia": hypoglycemia,
+    "hemolysis": hemolysis,
+    "cns_abnormality": cns_abnormality,
+    "maternal_diabetes": maternal_diabetes,
+    "maternal_thyroid_abnormal": maternal_thyroid_abnormal,
+    "delivery_stress": delivery_stress,
+    "weight_ge_p90": weight_ge_p90,
+    "exchange_transfusion": exchange_transfusion,
+    "intracranial_hemorrhage": intracranial_hemorrhage,
+    "apnea_treatment": apnea_treatment,
+    "aminoglycoside_history": aminoglycoside_history,
+    "high_oxygen": high_oxygen,
+})
 
-    mass_screening_items = []
-    if birth_date:
-        day4_date = birth_date + timedelta(days=4)
-        mass_screening_items.append(
-            f"・日齢4（{day4_date.strftime('%Y/%m/%d')}）：マススクリーニングを実施（希望あれば拡大マスも）"
-        )
-    else:
-        mass_screening_items.append("・日齢4：マススクリーニングを実施（希望あれば拡大マスも）")
-    if gestational_age < 37:
-        mass_screening_items.append("・早産児のため、退院前にマススクリーニング再検を行う")
+# 核黄疸危険因子の自動判定（Apgarスコア5分値≦3、またはその他の危険因子がある場合）
+risk_factors = kernicterus_risk_factors(risk_mask)
+has_kernicterus_risk = bool(risk_factors)
 
+if birth_weight is None:
     guidance = {
-        "category": prematurity_cat,
-        "recommendations": [],
-        "warnings": [],
-        "special_management": [
-            {
-                "title": "💊 ケイツーシロップ12回投与法",
-                "k2_third_to_twelfth": None,
-                "items": [
-                    "・入院中の内服は処置オーダで指示する",
-                    "・退院処方として12回目までのケイツーを処方する",
-                ],
-                "needed": True,
-            },
-            {
-                "title": "🧪 マススクリーニング",
-                "items": mass_screening_items,
-                "needed": True,
-            },
-            {
-                "title": "⚠️ 体重未測定のため一部判定不可",
-                "items": [
-                    "・出生体重区分、低血糖リスク、SGA/LGA判定などは体重測定後に評価",
-                ],
-                "needed": False,
-            },
-        ],
+        "category": get_prematurity_category(gestational_age),
+        "records": get_weight_pending_records(gestational_age, birth_date),
     }
 else:
-    guidance = get_management_guidance(
-        birth_weight,
-        is_first_child_bool,
-        delivery_method,
-        gestational_age,
-        days_old,
-        maternal_diabetes,
-        maternal_thyroid_abnormal,
-        apgar_score_5min,
-        delivery_stress,
-        birth_date,
-        birth_time,
-        exchange_transfusion,
-        intracranial_hemorrhage,
-        apnea_treatment,
-        aminoglycoside_history,
-        high_oxygen,
-        corrected_weeks,
-        gestational_weeks,
-        gestational_days,
-        weight_lt_p10,
-        weight_ge_p90
-    )
+    guidance = get_guidance_records_from_mask(birth_weight, gestational_age, risk_mask, birth_date, birth_time)
 
 # 分類の表示
 if birth_thresholds is None:
@@ -1511,12 +1217,15 @@ if birth_size_label:
 else:
     st.subheader(f"分類: {guidance['category']}")
 
+# 出生体格のZスコア（病棟の集計に登録するとドリフト監視のスケッチにも入る）
+birth_size_z = {"weight": None, "length": None, "hc": None}
 if birth_thresholds is not None:
     st.caption(f"{gender} / {is_first_child} / 在胎{gestational_weeks}週{gestational_days}日")
 
     wL, wM, wS = birth_thresholds.get("weight_lms", (None, None, None))
     w_z = value_to_lms_z(wL, wM, wS, birth_weight)
     w_p = z_to_percentile(w_z)
+    birth_size_z["weight"] = w_z
 
     w_z_text = "-" if w_z is None else f"{w_z:+.2f}SD"
     w_p_text = "-" if w_p is None else f"{w_p:.1f}%ile"
@@ -1540,6 +1249,7 @@ if birth_thresholds is not None:
         hL, hM, hS = birth_thresholds.get("height_lms", (None, None, None))
         h_z = value_to_lms_z(hL, hM, hS, birth_length)
         h_p = z_to_percentile(h_z)
+        birth_size_z["length"] = h_z
         h_z_text = "-" if h_z is None else f"{h_z:+.2f}SD"
         h_p_text = "-" if h_p is None else f"{h_p:.1f}%ile"
         st.markdown(
@@ -1558,6 +1268,7 @@ if birth_thresholds is not None:
         if hcL is not None and hcM is not None and hcS is not None:
             hc_z = value_to_lms_z(hcL, hcM, hcS, birth_head_circumference)
             hc_p = z_to_percentile(hc_z)
+            birth_size_z["hc"] = hc_z
             hc_z_text = "-" if hc_z is None else f"{hc_z:+.2f}SD"
             hc_p_text = "-" if hc_p is None else f"{hc_p:.1f}%ile"
             st.markdown(
@@ -1572,289 +1283,614 @@ if birth_thresholds is not None:
     if birth_plane_fig is not None:
         st.plotly_chart(birth_plane_fig, width='stretch')
 
+    # 在胎週数別の標準曲線（曲線は基準データのキャッシュ作成時に計算済み）
+    st.markdown("##### 📈 在胎週数別の標準曲線（-2SD / 10・50・90%ile）")
+    curve_keys = get_lms_keys(gender, is_first_child_bool)
+    curve_ga_weeks = gestational_weeks + gestational_days / 7.0
+    curve_values = {"weight": birth_weight, "length": birth_length, "hc": birth_head_circumference}
+    for curve_tab, measure in zip(st.tabs([GROWTH_MEASURE_LABELS[m] for m in GROWTH_MEASURES]), GROWTH_MEASURES):
+        curve_points = () if curve_values[measure] is None else ((curve_ga_weeks, curve_values[measure]),)
+        with curve_tab:
+            st.plotly_chart(
+                shared_outputs.get_or_build(
+                    ("percentile_curves", reference_dataset_id, curve_keys[measure], measure, curve_points),
+                    lambda: build_percentile_curve_fig(
+                        reference_registry.curves(reference_dataset_id), curve_keys[measure], measure, curve_points
+                    ),
+                ),
+                width='stretch',
+                key=f"percentile_curve_{measure}",
+            )
+
+    # 分娩予定日が不確かな児向け：体格が10〜90%ileに入る在胎週数（基準データのキャッシュの索引を二分探索）
+    if any(v is not None for v in curve_values.values()):
+        with st.expander("📐 出生体格からの在胎週数の推定（分娩予定日が不確かな場合）"):
+            ga_estimate = estimate_gestational_age(
+                reference_registry.ga_index(reference_dataset_id), gender, is_first_child_bool,
+                birth_weight, birth_length, birth_head_circumference,
+            )
+            for measure, entry in ga_estimate["measures"].items():
+                ga_range = entry["range_days"]
+                range_text = "該当なし" if ga_range is None else f"{format_ga_days(ga_range[0])}〜{format_ga_days(ga_range[1])}"
+                st.markdown(
+                    f"- {GROWTH_MEASURE_LABELS[measure]}：10〜90%ile **{range_text}** / 50%ile {format_ga_days(entry['p50_days'])}"
+                )
+            ga_range = ga_estimate["range_days"]
+            range_text = "該当なし" if ga_range is None else f"{format_ga_days(ga_range[0])}〜{format_ga_days(ga_range[1])}"
+            st.markdown(f"**全項目が10〜90%ileに入る在胎週数：{range_text}**（50%ile {format_ga_days(ga_estimate['p50_days'])}）")
+            st.caption("範囲の両端は基準データの在胎週数の範囲で打ち切られます。")
+
 # 推奨事項の表示
 st.subheader("✅ 管理のポイント")
-specials = guidance.get('special_management', [])
-
-for special in specials:
-    is_needed = special.get('needed', True)
-    if is_needed:
-        st.markdown(f"**{special['title']}**")
-        if special.get('title') == '💊 ケイツーシロップ12回投与法':
-            if birth_date:
-                d0 = birth_date.strftime('%Y/%m/%d')
-
-                d1 = (birth_date + timedelta(days=1)).strftime('%Y/%m/%d')
-                d4 = (birth_date + timedelta(days=4)).strftime('%Y/%m/%d')
-                d11 = (birth_date + timedelta(days=11)).strftime('%Y/%m/%d')
+for record in guidance["records"]:
+    if record.rule_id == "k2":
+        st.markdown(f"**{guidance_title(record)}**")
+        if birth_date:
+            d0 = birth_date.strftime('%Y/%m/%d')
+
+            d1 = (birth_date + timedelta(days=1)).strftime('%Y/%m/%d')
+            d4 = (birth_date + timedelta(days=4)).strftime('%Y/%m/%d')
+            d11 = (birth_date + timedelta(days=11)).strftime('%Y/%m/%d')
+        else:
+            d0 = d1 = d4 = d11 = None
+
+        third = k2_third_to_twelfth_text(record)
+
+        b1, b2, b3 = st.columns(3)
+        with b1:
+            st.markdown("#### 1回目")
+            st.caption(f"日齢0（{d0}） / 日齢1（{d1}）" if d0 else "日齢0 / 日齢1")
+            st.markdown("- 点滴あり：日齢0に静注（ELBWは半量）")
+            st.markdown("- 点滴なし：日齢1に内服（ELBWも減量しない）")
+
+        with b2:
+            st.markdown("#### 2回目")
+            st.caption(f"日齢4（{d4}）" if d4 else "日齢4")
+            st.markdown("- 消化不良：静注（ELBWは半量）")
+            st.markdown("- 消化良好：内服")
+
+        with b3:
+            st.markdown("#### 3〜12回目")
+            st.caption(f"日齢11（{d11}）以降" if d11 else "日齢11以降")
+            if third:
+                st.markdown(f"- {third}")
+
             else:
-                d0 = d1 = d4 = d11 = None
-
-            third = special.get('k2_third_to_twelfth')
-           
-            b1, b2, b3 = st.columns(3)
-            with b1:
-                st.markdown("#### 1回目")
-                st.caption(f"日齢0（{d0}） / 日齢1（{d1}）" if d0 else "日齢0 / 日齢1")
-                st.markdown("- 点滴あり：日齢0に静注（ELBWは半量）")
-                st.markdown("- 点滴なし：日齢1に内服（ELBWも減量しない）")
-
-            with b2:
-                st.markdown("#### 2回目")
-                st.caption(f"日齢4（{d4}）" if d4 else "日齢4")
-                st.markdown("- 消化不良：静注（ELBWは半量）")
-                st.markdown("- 消化良好：内服")
-
-            with b3:
-                st.markdown("#### 3〜12回目")
-                st.caption(f"日齢11（{d11}）以降" if d11 else "日齢11以降")
-                if third:
-                    st.markdown(f"- {third}")
-
-                else:
-                    st.markdown("- 日齢11以降の最初の水曜から毎週水曜に内服")
-
-            st.markdown("- 入院中の内服は処置オーダで指示する")
-            st.markdown("- 退院処方として12回目までを処方する")
+                st.markdown("- 日齢11以降の最初の水曜から毎週水曜に内服")
+
+        st.markdown("- 入院中の内服は処置オーダで指示する")
+        st.markdown("- 退院処方として12回目までを処方する")
+        continue
+    st.markdown(render_guidance_markdown(record), unsafe_allow_html=not record.needed)
+
+
+def build_murata_phototherapy_fig(tables, phototherapy_category, phototherapy_threshold, days_old, is_day0):
+    """村田・井村の基準のグラフ。日齢7以上は同じ図になるため、共有キャッシュのキーでは7にまとめる"""
+    fig = go.Figure()
+
+    colors = {
+        "≥ 2,500g": "#1f77b4",
+        "2,000 ~ 2,499g": "#ff7f0e",
+        "1,500 ~ 1,999g": "#2ca02c",
+        "1,000 ~ 1,499g": "#d62728",
+        "≤ 999g": "#9467bd"
+    }
+
+    for cat, row in zip(tables.MURATA_CATEGORY_ORDER, tables.MURATA_THRESHOLD_MATRIX):
+        days = list(range(1, 8))
+        values = [row[d] for d in days]
+        is_highlighted = (cat == phototherapy_category)
+
+        fig.add_trace(go.Scatter(
+            x=days,
+            y=values,
+            mode='lines+markers',
+            name=cat,
+            line=dict(
+                width=4 if is_highlighted else 2,
+                color=colors[cat],
+                dash='solid' if is_highlighted else 'dot'
+            ),
+            marker=dict(
+                size=8 if is_highlighted else 6,
+                symbol='circle'
+            )
+        ))
+
+    if phototherapy_threshold is not None and not is_day0:
+        x_today = 7 if days_old >= 7 else days_old
+        day_label = "7以上" if days_old >= 7 else str(days_old)
+        fig.add_hline(
+            y=phototherapy_threshold,
+            line_dash="dash",
+            line_color=colors[phototherapy_category],
+            line_width=2,
+        )
+
+        fig.add_trace(go.Scatter(
+            x=[x_today],
+            y=[phototherapy_threshold],
+            mode="markers",
+            name="今日の基準",
+            marker=dict(
+                size=16,
+                color=colors[phototherapy_category],
+                line=dict(color="white", width=2),
+                symbol="circle",
+            ),
+            showlegend=False,
+            hovertemplate=(
+                f"日齢: {day_label}日<br>TB基準: {phototherapy_threshold} mg/dL<extra></extra>"
+            ),
+        ))
+
+        fig.add_annotation(
+            x=x_today,
+            y=phototherapy_threshold,
+            text=f"今日（日齢{day_label}日）\nTB基準 {phototherapy_threshold} mg/dL",
+            showarrow=True,
+            arrowhead=2,
+            ax=40,
+            ay=-40,
+            font=dict(size=12, color="white"),
+            bgcolor="rgba(0,0,0,0.55)",
+            bordercolor="rgba(255,255,255,0.35)",
+            borderwidth=1,
+        )
+
+    fig.update_layout(
+        xaxis_title="生後日齢（日）",
+        yaxis_title="血清総ビリルビン値（mg/dL）",
+        hovermode='x unified',
+        height=500,
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.01
+        )
+    )
+
+    fig.update_xaxes(range=[0.5, 7.5], tickmode="linear", dtick=1)
+    return fig
+
+
+def parse_tb_samples(text):
+    """「出生後時間, TB」を1行ずつ書いたテキストを [(時間, TB)] にする。読めない行は行番号を返す"""
+    samples, errors = [], []
+    for n, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
             continue
-        for item in special.get('items', []):
-            st.markdown(item)
-    else:
-        st.markdown(
-            f"<span style='color: gray;'><b>{special['title']}</b></span>",
-            unsafe_allow_html=True
+        try:
+            hours, value = (float(v) for v in line.replace("、", ",").split(","))
+        except ValueError:
+            errors.append(n)
+            continue
+        samples.append((hours, value))
+    return samples, errors
+
+
+def render_bilirubin_forecast(hours_old, tables):
+    st.markdown("---")
+    st.markdown("### 🔮 TBの推移予測（直近の測定から）")
+    st.caption(
+        f"直近{FORECAST_WINDOW}回のTBから上昇速度を求め、各基準線に達する時刻（{FORECAST_HORIZON_HOURS:.0f}時間先まで）と"
+        "次の採血の目安を表示します。時間区分・日齢・修正週数による基準値の変化も考慮します。"
+    )
+    tb_text = st.text_area("TB測定値（1行に「出生後時間, TB（mg/dL）」）", value="", key="tb_samples_text",
+                           placeholder="30, 8.2\n42, 10.1\n54, 11.6")
+    samples, errors = parse_tb_samples(tb_text)
+    if errors:
+        st.warning(f"読み取れない行があります: {', '.join(map(str, errors))}行目")
+    if not samples:
+        return
+
+    birth_dt = datetime.combine(birth_date, birth_time)
+    sample_hours, sample_tb = pack_bilirubin_samples([samples])
+    forecast = forecast_bilirubin(
+        sample_hours, sample_tb,
+        np.array([hours_old]),
+        np.array([gestational_weeks * 7 + gestational_days]),
+        np.array([first_midnight_hours(birth_dt)]),
+        np.array([np.nan if birth_weight is None else birth_weight], dtype=float),
+        np.array([has_kernicterus_risk]),
+        tables=tables,
+    )
+    rate = forecast["rate"][0]
+    f1, f2 = st.columns(2)
+    with f1:
+        st.metric("上昇速度", "-" if np.isnan(rate) else f"{rate * 24:+.1f} mg/dL/日")
+    with f2:
+        st.metric("現在の予測TB", f"{forecast['projected_now'][0]:.1f} mg/dL")
+    if np.isnan(rate):
+        st.caption("上昇速度の計算には時刻の異なる2回以上の測定が必要です（現在値のみで判定）。")
+
+    for i, line in enumerate(FORECAST_LINES):
+        threshold = forecast["thresholds_now"][0, i]
+        if np.isnan(threshold):
+            continue
+        crossing = forecast["crossing_hours"][0, i]
+        if forecast["already_above"][0, i]:
+            text = "**超過中**"
+        elif np.isnan(crossing):
+            text = f"{FORECAST_HORIZON_HOURS:.0f}時間以内に到達しない見込み"
+        else:
+            when = birth_dt + timedelta(hours=float(crossing))
+            text = f"**{when.strftime('%m/%d %H:%M')}** ごろ到達（出生後{crossing:.0f}時間）"
+        st.markdown(f"- {FORECAST_LINE_LABELS[line]}（現在 {threshold:g} mg/dL）: {text}")
+
+    next_sample = birth_dt + timedelta(hours=float(forecast["next_sample_hours"][0]))
+    st.info(f"次の採血の目安: {next_sample.strftime('%m/%d %H:%M')}（施設の方針に合わせて判断してください）")
+
+
+def render_tcb_monitor(tables):
+    tcb_feed = get_tcb_feed()
+    with st.expander("📡 経皮ビリルビン（TcB）モニタ"):
+        tcb_patient_id = st.text_input("TcB機器の患者ID", value="", key="tcb_patient_id").strip()
+        if not tcb_patient_id:
+            st.caption("受信元は環境変数 TCB_FEED_PATH（ファイル）または TCB_FEED_PORT（ソケット）で指定します。")
+            return
+        # 画面の出生情報で到着時の判定を行う（TcBは採血のTB基準と比べた目安）
+        tcb_feed.admit(tcb_patient_id, {
+            "birth_date": birth_date,
+            "birth_time": birth_time,
+            "gestational_weeks": gestational_weeks,
+            "gestational_days": gestational_days,
+            "birth_weight": birth_weight,
+            "has_kernicterus_risk": has_kernicterus_risk,
+        })
+        status = tcb_feed.status(tcb_patient_id, tables)
+        if status["latest"] is None:
+            st.info("この患者IDの測定はまだ受信していません。")
+            return
+        when, value = status["latest"]
+        exceeded = "、".join(FORECAST_LINE_LABELS[line] for line in status["exceeded"]) or "なし"
+        st.markdown(f"最新: **{value:.1f} mg/dL**（{when.strftime('%m/%d %H:%M:%S')}） / 超過中の基準線: **{exceeded}**")
+        times, values = tcb_feed.series(tcb_patient_id)
+        st.plotly_chart(
+            build_tcb_fig(times, values, tcb_feed.infant(tcb_patient_id), tables=tables),
+            width='stretch',
+            key="tcb_chart",
         )
-        for item in special.get('items', []):
-                       st.markdown(f"<span style='color: gray;'>{item}</span>", unsafe_allow_html=True)
+        st.caption(f"保持 {status['count']:,}件（グラフは{TCB_CHART_MAX_POINTS:,}点に間引いて表示）")
+
+
+def discharge_from_ward(patient_id):
+    # 次の再表示で登録し直さないよう、患者IDの入力も空にする
+    get_ward_counters().discharge(patient_id)
+    get_due_worklist().discharge(patient_id)
+    st.session_state["ward_patient_id"] = ""
+
+
+def render_ward_dashboard(tables):
+    ward = get_ward_counters()
+    worklist = get_due_worklist()
+    with st.expander("🏥 病棟の集計（入院児全体）"):
+        ward_patient_id = st.text_input("病棟の集計に登録する患者ID", value="", key="ward_patient_id").strip()
+        if ward_patient_id:
+            k2_items = [(item_id, label) for _, item_id, label in get_due_schedule(birth_date) if item_id.startswith("k2_")]
+            done_options = list(WARD_DUE_CHECKS) + [item_id for item_id, _ in k2_items]
+            done_labels = {check: SWEEP_CHECK_LABELS[check] for check in WARD_DUE_CHECKS}
+            done_labels.update(k2_items)
+            ward_done = st.multiselect(
+                "実施済み", done_options, format_func=lambda item: done_labels[item], key="ward_completed"
+            )
+            ward_tb = st.number_input("最新のTB（mg/dL、0は未測定）", min_value=0.0, max_value=40.0, value=0.0, step=0.1, key="ward_tb")
+            ward_date_cols = st.columns(2)
+            with ward_date_cols[0]:
+                ward_discharge_date = st.date_input("退院予定日（MRI・AABRの予定に使用）", value=None, key="ward_discharge_date")
+            with ward_date_cols[1]:
+                ward_last_eye = st.date_input("最後の眼底検査日", value=None, key="ward_last_eye_exam")
+            ward_unit = st.text_input("病棟（Zスコアのドリフト監視に使用）", value="", key="ward_unit").strip()
+            # 画面の入力で登録・更新する（変わった児の所属・予定だけを判定し直す）
+            ward_infant = {
+                "birth_date": birth_date,
+                "birth_time": birth_time,
+                "gestational_weeks": gestational_weeks,
+                "gestational_days": gestational_days,
+                "birth_weight": birth_weight,
+                "has_kernicterus_risk": has_kernicterus_risk,
+                "risk_mask": risk_mask,
+                "completed": tuple(ward_done),
+                "tb": ward_tb or None,
+                "discharge_date": ward_discharge_date,
+                "last_eye_exam": ward_last_eye,
+            }
+            ward.upsert(ward_patient_id, ward_infant)
+            worklist.upsert(ward_patient_id, ward_infant)
+            # 出生体格のZスコアは患者IDごとに1回だけスケッチへ追加する（再実行で二重に数えない）
+            if ward_unit:
+                drift_monitor = get_drift_monitor()
+                if drift_monitor.observe_patient(ward_patient_id, ward_unit, birth_date, birth_size_z):
+                    drift_monitor.save(os.environ.get("DRIFT_MONITOR_PATH", DRIFT_MONITOR_PATH))
+            st.button("退院（集計から外す）", key="ward_discharge", on_click=discharge_from_ward, args=(ward_patient_id,))
+
+        ward_counts = ward.counts(tables=tables)
+        ward_cols = st.columns(4)
+        for i, (key, count) in enumerate(ward_counts.items()):
+            with ward_cols[i % 4]:
+                st.metric(WARD_COUNTER_LABELS[key], f"{count:,}人")
+        ward_stats = ward.stats()
+        st.caption(f"登録 {ward_stats['patients']:,}人（日付・基準の切り替わり時刻に該当する児だけ判定し直します）")
+
+        now = datetime.now()
+        shift_name, shift_items = worklist.due_in_shift(now)
+        overdue_items = worklist.overdue(now.date())
+        st.markdown(f"#### 📋 実施予定（{shift_name}：{len(shift_items)}件 / 期限切れ：{len(overdue_items)}件）")
+        if shift_items or overdue_items:
+            st.dataframe(
+                [
+                    {"実施日": due_date.strftime("%Y/%m/%d"), "患者ID": patient_id, "項目": label, "状態": status}
+                    for status, items in (("期限切れ", overdue_items), (shift_name, shift_items))
+                    for due_date, patient_id, _, label in items
+                ],
+                hide_index=True,
+                width='stretch',
+            )
+
 
 st.markdown("---")
-st.markdown("## 💡 光線療法基準")
+# 光線療法基準（日齢・出生後時間に依存するため、時間区分の境目でこの部分だけ再実行する）
+@st.fragment
+def render_phototherapy_section():
+    # フラグメントだけの再実行でも版を取り直す。この実行の中ではすべてこの版で判定・表示する
+    protocol_tables = get_protocol_store().current()
+    photo_state = get_time_state(birth_date, birth_time, gestational_weeks, gestational_days, tables=protocol_tables)
+    days_old = photo_state["days_old"]
+    hours_old = photo_state["hours_old"]
+    corrected_weeks = photo_state["corrected_weeks"]
+    morioka = photo_state["morioka"]
+
+    # 光線療法基準の計算
+    if birth_weight is None:
+        phototherapy_category = None
+        phototherapy_threshold = None
+        adjusted = False
+        original_category = None
+        is_day0 = False
+        day0_threshold = None
+    else:
+        phototherapy_category, phototherapy_threshold, adjusted, original_category, is_day0, day0_threshold = protocol_tables.get_phototherapy_threshold(
+            birth_weight,
+            days_old,
+            has_kernicterus_risk
+        )
+
+    st.markdown("## 💡 光線療法基準")
+    st.caption(f"基準の表: {protocol_tables.version}（{protocol_tables.digest[:8]}）")
+
+    st.markdown("### ✅ 現在の基準値")
+    sum1, sum2 = st.columns(2)
+    with sum1:
+        st.markdown("**村田・井村の基準**")
+        if phototherapy_category is None:
+            st.markdown("適用ライン: **体重未測定のため判定不可**")
+        else:
+            st.markdown(f"適用ライン: **{phototherapy_category}**")
+        st.markdown(f"日齢: {days_old}日")
+        if phototherapy_threshold is None:
+            st.metric("TB基準値", "未定義")
+        else:
+            st.metric("TB基準値", f"{phototherapy_threshold} mg/dL")
+
+    with sum2:
+        st.markdown("**📊 神戸大学（森岡）の基準**")
+        if morioka is None:
+            st.markdown("対象外")
+        else:
+            st.markdown(f"修正週数: **{morioka['pca_label']}**")
+            st.markdown(f"出生後時間: **{morioka['time_label']}**（{hours_old:.1f}時間）")
+            morioka_tb1, morioka_tb2, morioka_tb3 = st.columns(3)
+            with morioka_tb1:
+                st.metric("TB low", f"{morioka['tb']['low']} mg/dL")
+            with morioka_tb2:
+                st.metric("TB high", f"{morioka['tb']['high']} mg/dL")
+            with morioka_tb3:
+                st.metric("TB 交換輸血", f"{morioka['tb']['exchange']} mg/dL")
+            st.markdown(f"UB（µg/dL） low/high/交換輸血: **{morioka['ub']['low']}/{morioka['ub']['high']}/{morioka['ub']['exchange']}**")
+
+    if days_old == 0:
+        st.info("日齢0のため、神戸大学（森岡）の基準を参照してください。")
+
+    st.markdown("### 📈 村田・井村の基準")
 
-st.markdown("### ✅ 現在の基準値")
-sum1, sum2 = st.columns(2)
-with sum1:
-    st.markdown("**村田・井村の基準**")
     if phototherapy_category is None:
-        st.markdown("適用ライン: **体重未測定のため判定不可**")
+        st.markdown("適用基準ライン: **体重未測定のため判定不可**")
     else:
-        st.markdown(f"適用ライン: **{phototherapy_category}**")
-    st.markdown(f"日齢: {days_old}日")
-    if phototherapy_threshold is None:
-        st.metric("TB基準値", "未定義")
+        st.markdown(f"適用基準ライン: **{phototherapy_category}**")
+
+    if is_day0:
+        st.caption("今日は0日目です。0日目は村田・井村の基準値が定義されていません。")
+
+    if adjusted:
+        risk_factors_str = "、".join(risk_factors)
+        st.caption(f"⚠️ 核黄疸危険因子（{risk_factors_str}）により基準を1段階低く調整（{original_category} → {phototherapy_category}）")
+    elif has_kernicterus_risk:
+        risk_factors_str = "、".join(risk_factors)
+        st.caption(f"⚠️ 核黄疸危険因子（{risk_factors_str}）あり（最低基準 {phototherapy_category} を適用）")
     else:
-        st.metric("TB基準値", f"{phototherapy_threshold} mg/dL")
+        st.caption("✅ 核黄疸危険因子なし")
+
+    fig = shared_outputs.get_or_build(
+        ("murata", protocol_tables.digest, phototherapy_category, phototherapy_threshold, min(days_old, 7), is_day0),
+        lambda: build_murata_phototherapy_fig(protocol_tables, phototherapy_category, phototherapy_threshold, days_old, is_day0),
+    )
+
+    st.plotly_chart(fig, width='stretch')
 
-with sum2:
-    st.markdown("**📊 神戸大学（森岡）の基準**")
+    st.markdown("---")
+    st.markdown("### 📊 神戸大学（森岡）の基準")
     if morioka is None:
-        st.markdown("対象外")
+        st.info("神戸大学（森岡）の基準は修正週数が22週以上の範囲で参照できます。")
     else:
         pca_low, pca_high = morioka["pca_group"]
-        if pca_high == float("inf"):
-            pca_label = f"{pca_low}週以上"
-        else:
-            pca_label = f"{pca_low}-{pca_high}週" if pca_low != pca_high else f"{pca_low}週"
-
-        st.markdown(f"修正週数: **{pca_label}**")
-        st.markdown(f"出生後時間: **{morioka['time_label']}**（{hours_old:.1f}時間）")
-        morioka_tb1, morioka_tb2, morioka_tb3 = st.columns(3)
-        with morioka_tb1:
-            st.metric("TB low", f"{morioka['tb']['low']} mg/dL")
-        with morioka_tb2:
-            st.metric("TB high", f"{morioka['tb']['high']} mg/dL")
-        with morioka_tb3:
-            st.metric("TB 交換輸血", f"{morioka['tb']['exchange']} mg/dL")
-        st.markdown(f"UB（µg/dL） low/high/交換輸血: **{morioka['ub']['low']}/{morioka['ub']['high']}/{morioka['ub']['exchange']}**")
-
-if days_old == 0:
-    st.info("日齢0のため、神戸大学（森岡）の基準を参照してください。")
-
-st.markdown("### 📈 村田・井村の基準")
-
-if phototherapy_category is None:
-    st.markdown("適用基準ライン: **体重未測定のため判定不可**")
-else:
-    st.markdown(f"適用基準ライン: **{phototherapy_category}**")
-
-risk_factors = []
-if apgar_score_5min <= 3:
-    risk_factors.append("5分Apgar≦3")
-if respiratory_distress:
-    risk_factors.append("呼吸窮迫（PaO2≦40が2時間以上持続）")
-if acidosis:
-    risk_factors.append("アシドーシス（pH≦7.15）")
-if hypothermia:
-    risk_factors.append("低体温（直腸温<35℃が2時間以上持続）")
-if hypoproteinemia:
-    risk_factors.append("低蛋白血症（血清蛋白≦4.0またはAlb≦2.5）")
-if hypoglycemia:
-    risk_factors.append("低血糖")
-if hemolysis:
-    risk_factors.append("溶血")
-if cns_abnormality:
-    risk_factors.append("敗血症を含む中枢神経系の異常徴候")
-
-if is_day0:
-    st.caption("今日は0日目です。0日目は村田・井村の基準値が定義されていません。")
-
-if adjusted:
-    risk_factors_str = "、".join(risk_factors)
-    st.caption(f"⚠️ 核黄疸危険因子（{risk_factors_str}）により基準を1段階低く調整（{original_category} → {phototherapy_category}）")
-elif has_kernicterus_risk:
-    risk_factors_str = "、".join(risk_factors)
-    st.caption(f"⚠️ 核黄疸危険因子（{risk_factors_str}）あり（最低基準 {phototherapy_category} を適用）")
-else:
-    st.caption("✅ 核黄疸危険因子なし")
+        headline = f"修正週数: **{morioka['pca_label']}** / 出生後時間: **{morioka['time_label']}**（{hours_old:.1f}時間）"
+        subline = "（表のTBは low/high/交換輸血 の順。UBは別途閾値。）"
 
-fig = go.Figure()
+        birth_total_days = gestational_weeks * 7 + gestational_days
 
-category_order = ["≥ 2,500g", "2,000 ~ 2,499g", "1,500 ~ 1,999g", "1,000 ~ 1,499g", "≤ 999g"]
-colors = {
-    "≥ 2,500g": "#1f77b4",
-    "2,000 ~ 2,499g": "#ff7f0e",
-    "1,500 ~ 1,999g": "#2ca02c",
-    "1,000 ~ 1,499g": "#d62728",
-    "≤ 999g": "#9467bd"
-}
+        def corrected_weeks_at_day(day_int):
+            return int((birth_total_days + int(day_int)) // 7)
 
-for cat in category_order:
-    thresholds = MURATA_PHOTOTHERAPY_THRESHOLDS[cat]
-    days = list(range(1, 8))
-    values = [thresholds[d] for d in days]
-    is_highlighted = (cat == phototherapy_category)
-
-    fig.add_trace(go.Scatter(
-        x=days,
-        y=values,
-        mode='lines+markers',
-        name=cat,
-        line=dict(
-            width=4 if is_highlighted else 2,
-            color=colors[cat],
-            dash='solid' if is_highlighted else 'dot'
-        ),
-        marker=dict(
-            size=8 if is_highlighted else 6,
-            symbol='circle'
+        highlight_pairs = set()
+        for b, bucket_meta in protocol_tables.MORIOKA_LABELS["ja"]["buckets"].items():
+            if bucket_meta["last_day"] is None:
+                w0 = corrected_weeks_at_day(bucket_meta["first_day"])
+                for g in protocol_tables.MORIOKA_TB_THRESHOLDS.keys():
+                    gl, gh = g
+                    if gh == float("inf"):
+                        if gl <= w0:
+                            highlight_pairs.add((g, b))
+                    else:
+                        if gh >= w0:
+                            highlight_pairs.add((g, b))
+            else:
+                for d in range(bucket_meta["first_day"], bucket_meta["last_day"] + 1):
+                    g = protocol_tables.get_morioka_pca_group_from_weeks(corrected_weeks_at_day(d))
+                    if g is not None:
+                        highlight_pairs.add((g, b))
+
+        if hours_old < 24:
+            st.info("生後24時間未満のため、神戸大学（森岡）の基準は参考値です。")
+        if corrected_weeks < 22:
+            st.warning("修正週数が22週未満のため、神戸大学（森岡）の基準は参考値です。")
+
+        morioka_table_html = shared_outputs.get_or_build(
+            ("morioka_html", protocol_tables.digest, (pca_low, pca_high), morioka["time_bucket_hours"], frozenset(highlight_pairs)),
+            lambda: build_morioka_html_table(
+                protocol_tables,
+                current_pca_group=(pca_low, pca_high),
+                current_time_bucket_hours=morioka["time_bucket_hours"],
+                highlight_pairs=highlight_pairs,
+            ),
         )
-    ))
 
-if phototherapy_threshold is not None and not is_day0:
-    x_today = 7 if days_old >= 7 else days_old
-    day_label = "7以上" if days_old >= 7 else str(days_old)
-    fig.add_hline(
-        y=phototherapy_threshold,
-        line_dash="dash",
-        line_color=colors[phototherapy_category],
-        line_width=2,
-    )
+        st.markdown(headline)
+        st.caption(subline)
+        st.markdown(morioka_table_html, unsafe_allow_html=True)
 
-    fig.add_trace(go.Scatter(
-        x=[x_today],
-        y=[phototherapy_threshold],
-        mode="markers",
-        name="今日の基準",
-        marker=dict(
-            size=16,
-            color=colors[phototherapy_category],
-            line=dict(color="white", width=2),
-            symbol="circle",
-        ),
-        showlegend=False,
-        hovertemplate=(
-            f"日齢: {day_label}日<br>TB基準: {phototherapy_threshold} mg/dL<extra></extra>"
-        ),
-    ))
+        # UBの閾値もテキストで表示
+        ub_low, ub_high, ub_ex = protocol_tables.MORIOKA_UB_THRESHOLDS[(pca_low, pca_high)]
+        st.markdown(f"**UB（µg/dL） low/high/交換輸血:** {ub_low}/{ub_high}/{ub_ex}")
 
-    fig.add_annotation(
-        x=x_today,
-        y=phototherapy_threshold,
-        text=f"今日（日齢{day_label}日）\nTB基準 {phototherapy_threshold} mg/dL",
-        showarrow=True,
-        arrowhead=2,
-        ax=40,
-        ay=-40,
-        font=dict(size=12, color="white"),
-        bgcolor="rgba(0,0,0,0.55)",
-        bordercolor="rgba(255,255,255,0.35)",
-        borderwidth=1,
-    )
+    render_bilirubin_forecast(hours_old, protocol_tables)
+    render_tcb_monitor(protocol_tables)
+    render_ward_dashboard(protocol_tables)
 
-fig.update_layout(
-    xaxis_title="生後日齢（日）",
-    yaxis_title="血清総ビリルビン値（mg/dL）",
-    hovermode='x unified',
-    height=500,
-    legend=dict(
-        yanchor="top",
-        y=0.99,
-        xanchor="left",
-        x=0.01
-    )
-)
+    schedule_boundary_rerun("phototherapy_timer", birth_date, birth_time, protocol_tables)
 
-fig.update_xaxes(range=[0.5, 7.5], tickmode="linear", dtick=1)
 
-st.plotly_chart(fig, width='stretch')
+render_phototherapy_section()
 
 st.markdown("---")
-st.markdown("### 📊 神戸大学（森岡）の基準")
-if morioka is None:
-    st.info("神戸大学（森岡）の基準は修正週数が22週以上の範囲で参照できます。")
-else:
-    pca_low, pca_high = morioka["pca_group"]
-    if pca_high == float("inf"):
-        pca_label = f"{pca_low}週以上"
-    else:
-        pca_label = f"{pca_low}-{pca_high}週" if pca_low != pca_high else f"{pca_low}週"
-
-    headline = f"修正週数: **{pca_label}** / 出生後時間: **{morioka['time_label']}**（{hours_old:.1f}時間）"
-    subline = "（表のTBは low/high/交換輸血 の順。UBは別途閾値。）"
-
-    time_buckets = [24, 48, 72, 96, 120, float("inf")]
-    bucket_ranges = [(0, 24), (24, 48), (48, 72), (72, 96), (96, 120), (120, float("inf"))]
+st.markdown("## 📈 入院中の成長（修正週数別Zスコア）")
+st.caption("出生時体格基準（LMS）を修正週数で参照し、体重・身長・頭囲のZスコア推移を表示します。")
 
-    birth_total_days = gestational_weeks * 7 + gestational_days
+growth_patient_id = st.text_input("患者ID（成長記録の識別用）", value="", key="growth_patient_id")
+growth_profile = get_growth_profile(
+    gender, is_first_child_bool, gestational_weeks, gestational_days, birth_date, reference_dataset_id
+)
+growth_patient_key = growth_patient_id.strip() or "（未入力）"
+if compact_session:
+    if "growth_inputs" not in st.session_state:
+        st.session_state["growth_inputs"] = {}
+    growth_inputs = st.session_state["growth_inputs"]
+    if growth_patient_key not in growth_inputs:
+        growth_inputs[growth_patient_key] = []
+else:
+    if "growth_series" not in st.session_state:
+        st.session_state["growth_series"] = {}
+    growth_series = get_growth_series(
+        st.session_state["growth_series"],
+        growth_patient_key,
+        growth_profile,
+        taikaku_rows,
+        birth_weight,
+        birth_length,
+        birth_head_circumference,
+    )
 
-    def corrected_weeks_at_day(day_int):
-        return int((birth_total_days + int(day_int)) // 7)
+with st.form("growth_entry", clear_on_submit=True):
+    g_cols = st.columns([1.5, 1, 1, 1])
+    with g_cols[0]:
+        growth_date = st.date_input("測定日", value=today, min_value=birth_date, max_value=today)
+    with g_cols[1]:
+        growth_weight = st.number_input("体重 (g)", min_value=200, max_value=8000, value=None, step=1)
+    with g_cols[2]:
+        growth_length = st.number_input("身長 (cm)", min_value=20.0, max_value=80.0, value=None, step=0.1, format="%.1f")
+    with g_cols[3]:
+        growth_hc = st.number_input("頭囲 (cm)", min_value=15.0, max_value=50.0, value=None, step=0.1, format="%.1f")
+    growth_submitted = st.form_submit_button("測定値を追加")
+
+if growth_submitted:
+    if growth_weight is None and growth_length is None and growth_hc is None:
+        st.warning("測定値が入力されていません。")
+    elif compact_session:
+        growth_inputs[growth_patient_key].append(
+            (growth_date, None if growth_weight is None else float(growth_weight), growth_length, growth_hc)
+        )
+    else:
+        add_growth_measurement(
+            growth_series,
+            taikaku_rows,
+            growth_date,
+            None if growth_weight is None else float(growth_weight),
+            growth_length,
+            growth_hc,
+        )
 
-    highlight_pairs = set()
-    for b, (h_start, h_end) in zip(time_buckets, bucket_ranges):
-        if h_end == float("inf"):
-            min_day = int(h_start // 24)
-            w0 = corrected_weeks_at_day(min_day)
-            for g in MORIOKA_TB_THRESHOLDS.keys():
-                gl, gh = g
-                if gh == float("inf"):
-                    if gl <= w0:
-                        highlight_pairs.add((g, b))
-                else:
-                    if gh >= w0:
-                        highlight_pairs.add((g, b))
-        else:
-            min_day = int(h_start // 24)
-            max_day = int((h_end - 1e-9) // 24)
-            for d in range(min_day, max_day + 1):
-                g = get_morioka_pca_group_from_weeks(corrected_weeks_at_day(d))
-                if g is not None:
-                    highlight_pairs.add((g, b))
-
-    if hours_old < 24:
-        st.info("生後24時間未満のため、神戸大学（森岡）の基準は参考値です。")
-    if corrected_weeks < 22:
-        st.warning("修正週数が22週未満のため、神戸大学（森岡）の基準は参考値です。")
-
-    morioka_table_html = build_morioka_html_table(
-        current_pca_group=(pca_low, pca_high),
-        current_time_bucket_hours=morioka["time_bucket_hours"],
-        highlight_pairs=highlight_pairs,
+if compact_session:
+    # 系列とグラフは（出生情報, 測定値）をキーに共有キャッシュから取得する
+    growth_measurements = tuple(
+        initial_growth_inputs(growth_profile, birth_weight, birth_length, birth_head_circumference)
+        + growth_inputs[growth_patient_key]
+    )
+    growth_series = shared_outputs.get_or_build(
+        ("growth", growth_profile, growth_measurements),
+        lambda: build_growth_series(growth_profile, taikaku_rows, growth_measurements),
     )
 
-    st.markdown(headline)
-    st.caption(subline)
-    st.markdown(morioka_table_html, unsafe_allow_html=True)
+if not growth_series["entries"]:
+    st.info("測定値を追加するとZスコアの推移が表示されます。")
+else:
+    growth_cols = st.columns(len(GROWTH_MEASURES))
+    for growth_col, measure in zip(growth_cols, GROWTH_MEASURES):
+        last_z = growth_series["last_z"][measure]
+        birth_z = growth_series["birth_z"][measure]
+        with growth_col:
+            st.metric(
+                f"{GROWTH_MEASURE_LABELS[measure]}（最新）",
+                "-" if last_z is None else f"{last_z:+.2f}SD",
+                None if last_z is None or birth_z is None else f"{last_z - birth_z:+.2f}SD（出生時から）",
+            )
 
-    # UBの閾値もテキストで表示
-    ub_low, ub_high, ub_ex = MORIOKA_UB_THRESHOLDS[(pca_low, pca_high)]
-    st.markdown(f"**UB（µg/dL） low/high/交換輸血:** {ub_low}/{ub_high}/{ub_ex}")
+    eugr_messages = []
+    for measure in GROWTH_MEASURES:
+        flags = growth_series["flags"][measure]
+        if flags["cross"]:
+            eugr_messages.append(f"{GROWTH_MEASURE_LABELS[measure]}が修正週数の10%ile未満")
+        if flags["drop"]:
+            eugr_messages.append(f"{GROWTH_MEASURE_LABELS[measure]}が出生時から1SD以上低下")
+    if eugr_messages:
+        st.warning(f"⚠️ EUGR（子宮外発育遅延）：{'、'.join(eugr_messages)}")
+    else:
+        st.caption("✅ EUGRの基準に該当なし")
+
+    st.plotly_chart(build_growth_z_fig(growth_series), width='stretch')
+    if any(entry["pma_days"] >= 42 * 7 for entry in growth_series["entries"]):
+        st.caption("修正42週以降は基準値がないためZスコアを表示できません。")
+
+with st.sidebar.expander("メモリ使用量"):
+    session_report = session_memory_report(st.session_state)
+    st.caption(f"このセッション: {session_report['total_bytes'] / 1024:.1f} KB")
+    st.dataframe(
+        [{"キー": key, "KB": round(size / 1024, 1)} for key, size in session_report["items"]],
+        width='stretch',
+        hide_index=True,
+    )
+    shared_stats = shared_outputs.stats()
+    st.caption(
+        f"共有キャッシュ: {shared_stats['entries']}件・{shared_stats['resident_bytes'] / 2**20:.1f} MB"
+        f"（上限 {shared_stats['memory_budget_bytes'] / 2**20:.0f} MB）"
+        f"／ヒット {shared_stats['hits']}・ミス {shared_stats['misses']}"
+    )
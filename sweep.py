@@ -0,0 +1,227 @@
+from functools import lru_cache
+
+import numpy as np
+
+from protocol import (
+    GUIDANCE_RULES,
+    MURATA_CATEGORY_ORDER,
+    MURATA_THRESHOLD_MATRIX,
+    MURATA_WEIGHT_CUTS,
+    MORIOKA_TB_THRESHOLDS,
+    MORIOKA_UB_THRESHOLDS,
+)
+
+# What-ifスイープ：在胎日数×出生体重×リスクフラグの全格子で、get_management_guidance /
+# get_phototherapy_threshold / get_morioka_thresholds と同じ判定をまとめて計算する。
+# 各判定（GUIDANCE_RULES）は「在胎・体重の条件」OR「フラグの条件」なので、格子全体は
+# (在胎×体重の2次元マスク) | (フラグ組合せの1次元マスク) のブロードキャストで表せる。
+
+SWEEP_FLAGS = (
+    "maternal_diabetes",
+    "maternal_thyroid_abnormal",
+    "delivery_stress",
+    "apgar_5min_lt7",
+    "weight_ge_p90",
+    "exchange_transfusion",
+    "intracranial_hemorrhage",
+    "apnea_treatment",
+    "aminoglycoside_history",
+    "high_oxygen",
+)
+SWEEP_FLAG_LABELS = {
+    "maternal_diabetes": "妊娠糖尿病",
+    "maternal_thyroid_abnormal": "甲状腺異常",
+    "delivery_stress": "分娩ストレス",
+    "apgar_5min_lt7": "Apgar5分値7未満",
+    "weight_ge_p90": "出生体重90%ile以上",
+    "exchange_transfusion": "交換輸血",
+    "intracranial_hemorrhage": "頭蓋内出血",
+    "apnea_treatment": "無呼吸発作治療",
+    "aminoglycoside_history": "アミノグリコシド投与歴",
+    "high_oxygen": "高濃度酸素投与歴",
+}
+
+SWEEP_CHECKS = ("hypoglycemia", "thyroid", "mri", "aabr", "eye")
+SWEEP_CHECK_LABELS = {check: GUIDANCE_RULES[check]["title"] for check in SWEEP_CHECKS}
+
+MORIOKA_TIME_BUCKETS = [24, 48, 72, 96, 120, float("inf")]
+
+
+# フラグ → (GUIDANCE_RULES の入力名, フラグありの値, フラグなしの値)
+SWEEP_FLAG_INPUTS = {name: (name, True, False) for name in SWEEP_FLAGS}
+SWEEP_FLAG_INPUTS["apgar_5min_lt7"] = ("apgar_score_5min", 6, 9)
+
+
+def _flag_bits(flag_name):
+    return 1 << SWEEP_FLAGS.index(flag_name)
+
+
+def flags_to_mask(flags):
+    mask = 0
+    for name in SWEEP_FLAGS:
+        if flags.get(name):
+            mask |= _flag_bits(name)
+    return mask
+
+
+def _apply_condition(condition, values):
+    op = condition.get("op")
+    if op is None:
+        return values.astype(bool)
+    if op == "lt":
+        return values < condition["value"]
+    if op == "le":
+        return values <= condition["value"]
+    raise ValueError(f"未対応の比較です: {op}")
+
+
+def _flag_mask_table():
+    # 全フラグ組合せ（2^10）ごとの「フラグ側で適応になるか」
+    masks = np.arange(1 << len(SWEEP_FLAGS), dtype=np.int64)
+    field_to_flag = {field: name for name, (field, _, _) in SWEEP_FLAG_INPUTS.items()}
+
+    table = {}
+    for check in SWEEP_CHECKS:
+        hit = np.zeros(masks.shape, dtype=bool)
+        for condition in GUIDANCE_RULES[check]["any"]:
+            flag_name = field_to_flag.get(condition["field"])
+            if flag_name is None:
+                continue
+            _, on_value, off_value = SWEEP_FLAG_INPUTS[flag_name]
+            values = np.where((masks & _flag_bits(flag_name)) != 0, on_value, off_value)
+            hit |= _apply_condition(condition, values)
+        table[check] = hit
+    return table
+
+
+def _base_mask_table(ga_total_days, weights):
+    # 在胎・体重側の条件。在胎は画面と同じく 週 + 日/7 で比較する
+    grid_inputs = {
+        "gestational_age": (ga_total_days // 7 + (ga_total_days % 7) / 7.0)[:, None],
+        "weight": weights[None, :],
+    }
+    shape = (ga_total_days.shape[0], weights.shape[0])
+
+    table = {}
+    for check in SWEEP_CHECKS:
+        hit = np.zeros(shape, dtype=bool)
+        for condition in GUIDANCE_RULES[check]["any"]:
+            values = grid_inputs.get(condition["field"])
+            if values is not None:
+                hit |= _apply_condition(condition, values)
+        table[check] = hit
+    return table
+
+
+def murata_threshold_matrix():
+    """(カテゴリ, 日齢0-7) の2次元配列。日齢0は未定義のためNaN"""
+    matrix = np.array(MURATA_THRESHOLD_MATRIX, dtype=float)
+    matrix[:, 0] = np.nan
+    return matrix
+
+
+def murata_category_index(weights, has_kernicterus_risk):
+    # 2500/2000/1500/1000g 以上かどうかで 0〜4（重い順）。危険因子ありは1段階下（最下段で止まる）
+    idx = len(MURATA_WEIGHT_CUTS) - np.searchsorted(np.array(MURATA_WEIGHT_CUTS), weights, side="right")
+    return np.minimum(idx + np.asarray(has_kernicterus_risk, dtype=np.int64), len(MURATA_CATEGORY_ORDER) - 1)
+
+
+def phototherapy_threshold_arrays(weights, days_old, has_kernicterus_risk=False):
+    """get_phototherapy_threshold の配列版。体重・日齢・危険因子の配列（ブロードキャスト可）をまとめて引く
+    category_index / original_index は MURATA_CATEGORY_ORDER の位置、threshold は日齢0でNaN"""
+    weights = np.asarray(weights)
+    days_old = np.asarray(days_old, dtype=np.int64)
+    risk = np.asarray(has_kernicterus_risk, dtype=bool)
+    original = murata_category_index(weights, False)
+    index = murata_category_index(weights, risk)
+    day = np.minimum(days_old, 7)
+    day = np.where(day < 0, 7, day)  # 従来版と同じく、負の日齢は日齢7以上の値を使う
+    return {
+        "category_index": index,
+        "original_index": original,
+        "threshold": murata_threshold_matrix()[index, day],
+        "adjusted": risk & (index != original),
+        "is_day0": days_old == 0,
+    }
+
+
+def morioka_threshold_arrays(pca_weeks, hours_old, tables=None):
+    """修正週数の配列に対する森岡基準（TB low/high/交換輸血, UB）。対象外はNaN
+    tables（protocol_tables.ProtocolTables）を渡すとその版の表で引く"""
+    tb_thresholds = MORIOKA_TB_THRESHOLDS if tables is None else tables.MORIOKA_TB_THRESHOLDS
+    ub_thresholds = MORIOKA_UB_THRESHOLDS if tables is None else tables.MORIOKA_UB_THRESHOLDS
+    time_buckets = MORIOKA_TIME_BUCKETS if tables is None else tables.MORIOKA_TIME_BUCKETS
+    groups = list(tb_thresholds.keys())
+    lows = np.array([low for low, _ in groups])
+    pca_weeks = np.asarray(pca_weeks)
+    group_idx = np.searchsorted(lows, pca_weeks, side="right") - 1
+    valid = group_idx >= 0
+
+    bucket = next((b for b in time_buckets if hours_old < b), float("inf"))
+    tb = np.array([tb_thresholds[g][bucket] for g in groups], dtype=float)
+    ub = np.array([ub_thresholds[g] for g in groups], dtype=float)
+
+    safe_idx = np.where(valid, group_idx, 0)
+    tb_out = np.where(valid[:, None], tb[safe_idx], np.nan)
+    ub_out = np.where(valid[:, None], ub[safe_idx], np.nan)
+    return {"time_bucket_hours": bucket, "tb": tb_out, "ub": ub_out, "group_index": np.where(valid, group_idx, -1)}
+
+
+@lru_cache(maxsize=8)
+def run_sweep(ga_start_days=22 * 7, ga_end_days=42 * 7 + 6, weight_start_g=400, weight_end_g=6000, weight_step_g=1,
+              days_old=1, hours_old=24.0, tables=None):
+    """格子全体のスイープ結果。同じ条件の再実行はキャッシュから返す（戻り値の配列は書き換えないこと）
+    tables（protocol_tables.ProtocolTables）を渡すと光線療法基準をその版の表で引く（版ごとにキャッシュする）"""
+    ga_total_days = np.arange(ga_start_days, ga_end_days + 1)
+    weights = np.arange(weight_start_g, weight_end_g + 1, weight_step_g)
+
+    base = _base_mask_table(ga_total_days, weights)
+    flag = _flag_mask_table()
+
+    murata = murata_threshold_matrix() if tables is None else tables.murata_matrix
+    day = min(int(days_old), 7)
+    photo = {
+        risk: murata[murata_category_index(weights, risk), day]
+        for risk in (False, True)
+    }
+
+    pca_weeks = (ga_total_days + int(days_old)) // 7
+    morioka = morioka_threshold_arrays(pca_weeks, hours_old, tables)
+
+    # キャッシュした結果を呼び出し側が書き換えないよう、返す配列はすべて読み取り専用にする
+    morioka_arrays = [morioka["tb"], morioka["ub"], morioka["group_index"]]
+    for arr in [ga_total_days, weights] + list(base.values()) + list(flag.values()) + list(photo.values()) + morioka_arrays:
+        arr.setflags(write=False)
+
+    return {
+        "ga_total_days": ga_total_days,
+        "weights": weights,
+        "base": base,
+        "flag": flag,
+        "phototherapy": photo,
+        "morioka": morioka,
+        "days_old": int(days_old),
+        "hours_old": float(hours_old),
+    }
+
+
+def sweep_check_grid(result, check, flag_mask):
+    """1つのフラグ組合せについて、在胎×体重の適応マスクを返す"""
+    return result["base"][check] | bool(result["flag"][check][flag_mask])
+
+
+def sweep_triggered_count(result, flag_mask):
+    count = np.zeros(result["base"][SWEEP_CHECKS[0]].shape, dtype=np.int8)
+    for check in SWEEP_CHECKS:
+        count += sweep_check_grid(result, check, flag_mask)
+    return count
+
+
+def sweep_flag_summary(result):
+    """全フラグ組合せ × 判定ごとの適応セル数（格子を展開せずに数える）"""
+    n_cells = result["base"][SWEEP_CHECKS[0]].size
+    summary = {}
+    for check in SWEEP_CHECKS:
+        base_count = int(result["base"][check].sum())
+        summary[check] = np.where(result["flag"][check], n_cells, base_count)
+    return summary
@@ -0,0 +1,485 @@
+"""経皮ビリルビン計（TcB）の測定値を受け取り、児ごとのリングバッファに溜めて到着時に基準と比べる
+
+    python tcb_feed.py --simulate 20 --days 7 --interval 10
+    python tcb_feed.py --tail tcb.jsonl --infants infants.json
+    python tcb_feed.py --serve 8765 --infants infants.json
+
+機器の代わりに、追記されるファイル（tail）またはローカルのソケットから1行1測定で受け取る。
+1行は JSON（{"patient_id": ..., "at": "2024-01-01T12:00:00", "tcb": 8.2}）または
+CSV（patient_id,at,tcb）。採血より頻度が高いため、グラフは LTTB（largest-triangle-three-buckets）で
+点数を減らしてから描く（1週間分でも描画の重さは一定）。
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import plotly.graph_objects as go
+
+from bilirubin_forecast import FORECAST_LINE_LABELS, FORECAST_LINES, first_midnight_hours, thresholds_at_hours
+from census_scheduler import get_census_thresholds, next_threshold_change
+
+# 1児あたりの保持件数（10秒ごとの測定で1週間分）。超えたら古いものから上書きする
+TCB_BUFFER_CAPACITY = 7 * 24 * 360
+# グラフに描く最大点数
+TCB_CHART_MAX_POINTS = 1500
+
+
+class TcbRingBuffer:
+    """時刻（UNIX秒）と値の固定長リングバッファ"""
+
+    def __init__(self, capacity=TCB_BUFFER_CAPACITY):
+        self.times = np.empty(capacity)
+        self.values = np.empty(capacity)
+        self.capacity = capacity
+        self.count = 0
+        self._next = 0
+
+    def append(self, t, value):
+        self.times[self._next] = t
+        self.values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def snapshot(self):
+        """(時刻, 値) の配列のコピー（古い順）"""
+        if self.count < self.capacity:
+            times, values = self.times[:self.count].copy(), self.values[:self.count].copy()
+        else:
+            times = np.concatenate([self.times[self._next:], self.times[:self._next]])
+            values = np.concatenate([self.values[self._next:], self.values[:self._next]])
+        # 機器の再送などで順序が前後した場合のみ並べ替える
+        if times.size > 1 and np.any(np.diff(times) < 0):
+            order = np.argsort(times, kind="stable")
+            times, values = times[order], values[order]
+        return times, values
+
+    def latest(self):
+        if self.count == 0:
+            return None
+        i = (self._next - 1) % self.capacity
+        return float(self.times[i]), float(self.values[i])
+
+
+def exceeded_lines(thresholds, value):
+    """get_census_thresholds の基準値のうち value 以上のもの（FORECAST_LINES の名前）"""
+    lines = []
+    morioka = thresholds["morioka"]
+    if morioka is not None:
+        lines += [line for line, limit in zip(("low", "high", "exchange"), morioka[2]) if value >= limit]
+    murata = thresholds["murata"]
+    if murata is not None and murata[1] is not None and value >= murata[1]:
+        lines.append("murata")
+    return tuple(lines)
+
+
+class TcbFeed:
+    """児ごとの TcB のリングバッファと、到着時の基準判定。超過した基準線が変わったときだけ購読者に通知する"""
+
+    def __init__(self, capacity=TCB_BUFFER_CAPACITY, tables=None):
+        self.capacity = capacity
+        self.tables = tables  # 判定に使う基準の表（protocol_tables.ProtocolTables。None は protocol の表）
+        self._infants = {}
+        self._buffers = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.received = 0
+        self.rejected = 0
+
+    def subscribe(self, callback):
+        """callback(event) を登録し、登録解除用の関数を返す"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def admit(self, patient_id, infant):
+        """判定に使う出生情報（census_scheduler と同じ項目）を登録・更新する。測定値のバッファは残し、
+        受信済みの最新の測定を新しい出生情報で判定し直す（超過した基準線が変わればイベントを返す）"""
+        with self._lock:
+            previous = self._infants.get(patient_id)
+            if previous is not None and previous["infant"] == infant:
+                return None
+            entry = self._infants[patient_id] = {
+                "infant": infant, "thresholds": None, "valid_from": None, "valid_until": None,
+                "exceeded": () if previous is None else previous["exceeded"],
+            }
+            buffer = self._buffers.get(patient_id)
+            latest = None if buffer is None else buffer.latest()
+            if latest is None:
+                if previous is None:
+                    return None
+                event = self._judge(patient_id, entry, None, None)
+            else:
+                event = self._judge(patient_id, entry, datetime.fromtimestamp(latest[0]), latest[1])
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, event)
+        return event
+
+    def discharge(self, patient_id):
+        with self._lock:
+            self._infants.pop(patient_id, None)
+            self._buffers.pop(patient_id, None)
+
+    def set_tables(self, tables):
+        """基準の表を持ち替え、全児の最新の測定を新しい表で判定し直す（超過した基準線が変わった児のイベントを返す）"""
+        events = []
+        with self._lock:
+            self.tables = tables
+            for patient_id, entry in self._infants.items():
+                entry["thresholds"] = None
+                buffer = self._buffers.get(patient_id)
+                latest = None if buffer is None else buffer.latest()
+                event = None if latest is None else self._judge(
+                    patient_id, entry, datetime.fromtimestamp(latest[0]), latest[1]
+                )
+                if event is not None:
+                    events.append(event)
+            subscribers = list(self._subscribers)
+        for event in events:
+            self._publish(subscribers, event)
+        return events
+
+    def _thresholds_at(self, entry, when):
+        # 基準値は次に変わる時刻まで使い回す（測定ごとに表を引き直さない）
+        if entry["thresholds"] is None or not (entry["valid_from"] <= when < (entry["valid_until"] or datetime.max)):
+            entry["thresholds"] = get_census_thresholds(entry["infant"], when, self.tables)
+            entry["valid_from"] = when
+            entry["valid_until"] = next_threshold_change(entry["infant"], when, self.tables)
+        return entry["thresholds"]
+
+    def ingest(self, patient_id, when, value):
+        """測定値を1件受け取る。基準と比べ、超過した基準線が変わった場合はイベントを返す（購読者にも送る）"""
+        with self._lock:
+            buffer = self._buffers.get(patient_id)
+            if buffer is None:
+                buffer = self._buffers[patient_id] = TcbRingBuffer(self.capacity)
+            buffer.append(when.timestamp(), value)
+            self.received += 1
+
+            entry = self._infants.get(patient_id)
+            if entry is None:
+                return None  # 出生情報が未登録の児は溜めるだけ
+            event = self._judge(patient_id, entry, when, value)
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, event)
+        return event
+
+    def _judge(self, patient_id, entry, when, value):
+        # value を基準と比べて超過中の基準線を更新する（value が None なら測定なし）。変わった場合のイベント
+        exceeded = () if value is None else exceeded_lines(self._thresholds_at(entry, when), value)
+        if exceeded == entry["exceeded"]:
+            return None
+        event = {
+            "type": "tcb",
+            "patient_id": patient_id,
+            "at": when,
+            "tcb": value,
+            "exceeded": exceeded,
+            "previous": entry["exceeded"],
+        }
+        entry["exceeded"] = exceeded
+        return event
+
+    def _publish(self, subscribers, event):
+        if event is None:
+            return
+        for callback in subscribers:
+            callback(event)
+
+    def ingest_line(self, line):
+        """1行を読み取って ingest する。読めない行は数えて捨てる"""
+        try:
+            patient_id, when, value = parse_tcb_line(line)
+        except (ValueError, KeyError, TypeError):
+            with self._lock:
+                self.rejected += 1
+            return None
+        return self.ingest(patient_id, when, value)
+
+    def infant(self, patient_id):
+        with self._lock:
+            entry = self._infants.get(patient_id)
+            return None if entry is None else entry["infant"]
+
+    def series(self, patient_id):
+        """(時刻, 値) の配列（古い順）。測定がなければ空の配列"""
+        with self._lock:
+            buffer = self._buffers.get(patient_id)
+            return (np.empty(0), np.empty(0)) if buffer is None else buffer.snapshot()
+
+    def status(self, patient_id, tables=None):
+        """最新の測定と超過中の基準線
+        tables を渡し、それが受信時の判定に使っている表と異なる場合は（表の差し替え直後の表示など）、
+        最新の測定をその表で判定し直して返す"""
+        with self._lock:
+            buffer = self._buffers.get(patient_id)
+            entry = self._infants.get(patient_id)
+            latest = None if buffer is None else buffer.latest()
+            exceeded = () if entry is None else entry["exceeded"]
+            if entry is not None and latest is not None and tables is not None \
+                    and getattr(self.tables, "digest", None) != tables.digest:
+                when = datetime.fromtimestamp(latest[0])
+                exceeded = exceeded_lines(get_census_thresholds(entry["infant"], when, tables), latest[1])
+            return {
+                "latest": None if latest is None else (datetime.fromtimestamp(latest[0]), latest[1]),
+                "count": 0 if buffer is None else buffer.count,
+                "exceeded": exceeded,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "patients": len(self._buffers),
+                "received": self.received,
+                "rejected": self.rejected,
+                "resident_bytes": sum(b.times.nbytes + b.values.nbytes for b in self._buffers.values()),
+            }
+
+
+def parse_tcb_line(line):
+    """JSON または CSV の1行を (患者ID, 測定日時, 値) にする"""
+    line = line.strip()
+    if line.startswith("{"):
+        record = json.loads(line)
+        return str(record["patient_id"]), datetime.fromisoformat(record["at"]), float(record["tcb"])
+    patient_id, at, value = (v.strip() for v in line.split(","))
+    return patient_id, datetime.fromisoformat(at), float(value)
+
+
+def tail_tcb_file(feed, path, stop_event, poll_seconds=0.5, from_start=False):
+    """追記されるファイルを読み続ける（stop_event が立つまで）。書きかけの行は次の読み込みまで待つ"""
+    if not os.path.exists(path):
+        from_start = True  # 後から作られたファイルは先頭から全部が新しい測定
+    while not os.path.exists(path):
+        if stop_event.wait(poll_seconds):
+            return
+    with open(path, "r", encoding="utf-8") as f:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        pending = ""
+        while not stop_event.is_set():
+            chunk = f.read()
+            if not chunk:
+                stop_event.wait(poll_seconds)
+                continue
+            pending += chunk
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                if line.strip():
+                    feed.ingest_line(line)
+
+
+def start_tcb_tail(feed, path, poll_seconds=0.5, from_start=False):
+    """tail_tcb_file を別スレッドで動かす。停止用の Event を返す"""
+    stop_event = threading.Event()
+    threading.Thread(
+        target=tail_tcb_file, args=(feed, path, stop_event, poll_seconds, from_start), name="tcb-tail", daemon=True
+    ).start()
+    return stop_event
+
+
+def make_tcb_server(feed, host="127.0.0.1", port=8765):
+    """1行1測定を受け付けるローカルのTCPサーバー（機器の代わり）。serve_forever は呼び出し側で行う"""
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode("utf-8", errors="replace")
+                if line.strip():
+                    feed.ingest_line(line)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def lttb_downsample(x, y, n_out):
+    """Largest-Triangle-Three-Buckets。先頭と末尾を残し、各区間から直前の点・次区間の平均と作る三角形が
+    最大になる点を1つずつ選ぶ（波形の山と谷を残したまま点数を n_out に減らす）"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)  # 中間の n_out - 2 区間の境目
+    # 次区間の平均（最後の区間の次は末尾の点）
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    avg_x = np.append(sums_x / sizes, x[-1])[1:]
+    avg_y = np.append(sums_y / sizes, y[-1])[1:]
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - avg_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return x[selected], y[selected]
+
+
+def build_tcb_fig(times, values, infant=None, max_points=TCB_CHART_MAX_POINTS, tables=None):
+    """TcB の推移（LTTBで max_points 点に減らす）。infant を渡すと基準線（tables の版）も階段状に重ねる"""
+    x, y = lttb_downsample(times, values, max_points)
+    when = [datetime.fromtimestamp(t) for t in x]
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=when, y=y, mode="lines", name="TcB",
+        line=dict(color="#ffb000", width=2),
+        hovertemplate="%{x|%m/%d %H:%M}<br>TcB %{y:.1f} mg/dL<extra></extra>",
+    ))
+    if infant is not None and len(x):
+        birth_dt = datetime.combine(infant["birth_date"], infant["birth_time"])
+        hours = (x - birth_dt.timestamp()) / 3600
+        weight = infant.get("birth_weight")
+        lines = thresholds_at_hours(
+            hours,
+            infant["gestational_weeks"] * 7 + infant["gestational_days"],
+            first_midnight_hours(birth_dt),
+            np.nan if weight is None else weight,
+            bool(infant.get("has_kernicterus_risk", False)),
+            tables=tables,
+        )
+        dashes = {"low": "dot", "high": "dash", "exchange": "solid", "murata": "dashdot"}
+        for i, line in enumerate(FORECAST_LINES):
+            fig.add_trace(go.Scatter(
+                x=when, y=lines[:, i], mode="lines", name=FORECAST_LINE_LABELS[line],
+                line=dict(color="rgba(255,255,255,0.5)", width=1, dash=dashes[line], shape="hv"),
+                hovertemplate="%{y} mg/dL<extra>" + FORECAST_LINE_LABELS[line] + "</extra>",
+            ))
+    fig.update_layout(
+        margin=dict(l=10, r=10, t=40, b=10),
+        yaxis_title="経皮ビリルビン値（mg/dL）",
+        template="plotly_dark",
+        height=380,
+        hovermode="x unified",
+    )
+    return fig
+
+
+def load_tcb_infants(path):
+    """{患者ID: {"birth": "2024-01-01T09:30", "gestational_weeks": 36, "gestational_days": 0,
+    "birth_weight": 2400, "has_kernicterus_risk": false}} の JSON を admit に渡す形にする"""
+    with open(path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    infants = {}
+    for patient_id, record in records.items():
+        birth = datetime.fromisoformat(record["birth"])
+        infants[str(patient_id)] = {
+            "birth_date": birth.date(),
+            "birth_time": birth.time(),
+            "gestational_weeks": int(record["gestational_weeks"]),
+            "gestational_days": int(record["gestational_days"]),
+            "birth_weight": record.get("birth_weight"),
+            "has_kernicterus_risk": bool(record.get("has_kernicterus_risk", False)),
+        }
+    return infants
+
+
+def synthetic_tcb_lines(n_patients, days, interval_seconds, start, seed=0):
+    """速度測定用の架空の測定（JSON Lines の行。時刻順）"""
+    rng = np.random.default_rng(seed)
+    steps = int(days * 24 * 3600 / interval_seconds)
+    offsets = np.arange(steps) * interval_seconds
+    lines = []
+    for p in range(n_patients):
+        hours = offsets / 3600
+        curve = 4 + 10 * (1 - np.exp(-hours / 48)) - 0.03 * np.maximum(hours - 96, 0)
+        values = np.round(curve + rng.normal(0, 0.4, steps), 1)
+        for offset, value in zip(offsets, values):
+            at = (start + timedelta(seconds=int(offset))).isoformat()
+            lines.append((offset, json.dumps({"patient_id": f"P{p:03d}", "at": at, "tcb": float(value)})))
+    lines.sort(key=lambda item: item[0])
+    return [line for _, line in lines]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TcB の測定値を受け取って基準と比べる（機器の代わりにファイル・ソケットを使う）")
+    parser.add_argument("--simulate", type=int, default=0, help="架空の児の数（受け取り・グラフ作成の時間を測る）")
+    parser.add_argument("--days", type=float, default=7.0)
+    parser.add_argument("--interval", type=float, default=10.0, help="測定間隔（秒）")
+    parser.add_argument("--tail", help="追記されるファイルを読む（Ctrl+Cで終了）")
+    parser.add_argument("--serve", type=int, help="このポートで1行1測定を受け付ける（Ctrl+Cで終了）")
+    parser.add_argument("--infants", help="判定に使う出生情報（load_tcb_infants の形式の JSON）")
+    args = parser.parse_args(argv)
+
+    feed = TcbFeed()
+    if args.infants:
+        for patient_id, infant in load_tcb_infants(args.infants).items():
+            feed.admit(patient_id, infant)
+
+    def print_event(event):
+        head = f"{event['at']:%m/%d %H:%M:%S} {event['patient_id']} TcB {event['tcb']:.1f}"
+        if event["exceeded"]:
+            print(f"{head}: {'、'.join(FORECAST_LINE_LABELS[line] for line in event['exceeded'])} を超過")
+        else:
+            print(f"{head}: 基準内に戻りました")
+
+    if args.simulate:
+        start = datetime(2024, 1, 1, 9, 30)
+        lines = synthetic_tcb_lines(args.simulate, args.days, args.interval, start)
+        for p in range(args.simulate):
+            feed.admit(f"P{p:03d}", {
+                "birth_date": start.date(), "birth_time": start.time(),
+                "gestational_weeks": 36, "gestational_days": 0, "birth_weight": 2400, "has_kernicterus_risk": False,
+            })
+        started = time.perf_counter()
+        for line in lines:
+            feed.ingest_line(line)
+        ingest_s = time.perf_counter() - started
+
+        times, values = feed.series("P000")
+        build_tcb_fig(times[:10], values[:10])  # テンプレートの読み込みを除くため1回作っておく
+        started = time.perf_counter()
+        payload = build_tcb_fig(times, values).to_json()
+        chart_s = time.perf_counter() - started
+        full_payload = build_tcb_fig(times, values, max_points=len(times)).to_json()
+        stats = feed.stats()
+        print(f"{len(lines):,}件を受信：{ingest_s * 1000:.0f} ms（{len(lines) / ingest_s:,.0f}件/秒）"
+              f" / バッファ {stats['resident_bytes'] / 1024 / 1024:.1f} MB")
+        print(f"1児 {len(times):,}点 → {TCB_CHART_MAX_POINTS:,}点に間引いてグラフ作成：{chart_s * 1000:.0f} ms / "
+              f"JSON {len(payload) / 1024:.0f} KB（間引かない場合 {len(full_payload) / 1024:.0f} KB）")
+        return 0
+
+    feed.subscribe(print_event)
+    if args.tail:
+        stop_event = start_tcb_tail(feed, args.tail)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop_event.set()
+        return 0
+
+    if args.serve:
+        server = make_tcb_server(feed, port=args.serve)
+        print(f"127.0.0.1:{args.serve} で受付中")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
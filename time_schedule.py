@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from protocol import MORIOKA_TB_THRESHOLDS, get_morioka_thresholds
+
+# 出生後時間・日齢に依存する表示（森岡の時間区分、村田の日齢、修正週数）が変わる時刻の計算
+MORIOKA_HOUR_EDGES = sorted({
+    upper_h
+    for tb_by_bucket in MORIOKA_TB_THRESHOLDS.values()
+    for upper_h in tb_by_bucket.keys()
+    if upper_h != float("inf")
+})
+
+
+def get_time_state(birth_date, birth_time, gestational_weeks, gestational_days, now=None, tables=None):
+    """現在時刻での日齢・出生後時間・修正週数と森岡の基準（tables は protocol_tables.ProtocolTables。省略時は protocol の表）"""
+    if now is None:
+        now = datetime.now()
+    today = now.date()
+    days_old = (today - birth_date).days
+
+    birth_dt = datetime.combine(birth_date, birth_time)
+    hours_old = (now - birth_dt).total_seconds() / 3600
+    if hours_old < 0:
+        hours_old = 0.0
+
+    corrected_total_days = gestational_weeks * 7 + gestational_days + days_old
+    corrected_weeks = corrected_total_days // 7
+    return {
+        "now": now,
+        "today": today,
+        "days_old": days_old,
+        "hours_old": hours_old,
+        "corrected_weeks": corrected_weeks,
+        "corrected_days": corrected_total_days % 7,
+        "morioka": (tables.get_morioka_thresholds if tables is not None else get_morioka_thresholds)(corrected_weeks, hours_old),
+    }
+
+
+def next_time_boundary(birth_date, birth_time, now=None, tables=None):
+    """次に表示が変わる時刻：翌日0時（日齢・修正週数）と、出生後24/48/72/96/120時間のうち早い方
+    tables を渡すとその版の森岡の時間区分の境目を使う"""
+    if now is None:
+        now = datetime.now()
+    boundary = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+
+    birth_dt = datetime.combine(birth_date, birth_time)
+    for upper_h in MORIOKA_HOUR_EDGES if tables is None else tables.MORIOKA_HOUR_EDGES:
+        edge = birth_dt + timedelta(hours=upper_h)
+        if edge > now:
+            boundary = min(boundary, edge)
+            break
+    return boundary
@@ -0,0 +1,254 @@
+"""入院児全体の集計（未実施の検査・本日のケイツー・森岡の基準超過）の人数を差分で更新する
+
+    python ward_counters.py --census 2000 --days 3
+
+ページを開くたびに全患者を判定し直す代わりに、患者ごとに「今どのカウンタに入っているか」を覚えておく。
+判定し直すのは、入院・情報更新（TB・実施済みの記録）・退院のときと、その児の所属が変わりうる時刻
+（ケイツーの日の0時と翌日0時、TBがある児は森岡・村田の基準の切り替わり）だけで、差分をカウンタに反映する。
+時刻による変化は優先度付きキューに積み、counts を呼んだときに期限の来たものだけ処理する（日付の切り替わりも同じ）。
+"""
+import argparse
+import heapq
+import itertools
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from bilirubin_forecast import FORECAST_LINE_LABELS
+from census_scheduler import get_census_thresholds, next_threshold_change
+from protocol import GUIDANCE_RULES, get_due_schedule
+from risk_mask import guidance_indications
+from tcb_feed import exceeded_lines
+
+# 未実施を数える検査（管理のポイントで適応ありの項目のうち、実施済みの記録がないもの）
+WARD_DUE_CHECKS = ("mri", "eye", "aabr", "thyroid")
+WARD_MORIOKA_LINES = ("low", "high", "exchange")
+WARD_COUNTERS = (
+    tuple(f"due_{check}" for check in WARD_DUE_CHECKS)
+    + ("k2_today",)
+    + tuple(f"morioka_{line}" for line in WARD_MORIOKA_LINES)
+)
+WARD_COUNTER_LABELS = {
+    **{f"due_{check}": f"{GUIDANCE_RULES[check]['title']}（未実施）" for check in WARD_DUE_CHECKS},
+    "k2_today": "💊 本日のケイツー",
+    **{f"morioka_{line}": f"{FORECAST_LINE_LABELS[line]} 超過" for line in WARD_MORIOKA_LINES},
+}
+
+
+def ward_counter_keys(infant, now, tables=None):
+    """1児が now の時点で入るカウンタの集合
+    infant は census_scheduler と同じ項目に加えて risk_mask（pack_risk_mask の値）・completed（実施済みの
+    検査名・ケイツーの項目ID）・tb（最新のTB mg/dL）を任意で持つ。tables は森岡・村田の基準の表の版"""
+    completed = set(infant.get("completed", ()))
+    keys = set()
+    if infant.get("birth_weight") is not None:
+        ga = infant["gestational_weeks"] + infant["gestational_days"] / 7.0
+        indications = guidance_indications(infant.get("risk_mask", 0), ga, infant["birth_weight"], WARD_DUE_CHECKS)
+        keys.update(f"due_{check}" for check in WARD_DUE_CHECKS if indications[check] and check not in completed)
+
+    today = now.date()
+    if any(
+        due_date == today and item_id.startswith("k2_") and item_id not in completed
+        for due_date, item_id, _ in get_due_schedule(infant["birth_date"])
+    ):
+        keys.add("k2_today")
+
+    if infant.get("tb") is not None:
+        lines = exceeded_lines(get_census_thresholds(infant, now, tables), infant["tb"])
+        keys.update(f"morioka_{line}" for line in WARD_MORIOKA_LINES if line in lines)
+    return frozenset(keys)
+
+
+def next_counter_change(infant, now, tables=None):
+    """ward_counter_keys の結果が次に変わりうる時刻。以後変わらなければ None"""
+    midnight = datetime.min.time()
+    candidates = [
+        datetime.combine(day, midnight)
+        for due_date, item_id, _ in get_due_schedule(infant["birth_date"])
+        if item_id.startswith("k2_")
+        for day in (due_date, due_date + timedelta(days=1))
+    ]
+    if infant.get("tb") is not None:
+        change_at = next_threshold_change(infant, now, tables)
+        if change_at is not None:
+            candidates.append(change_at)
+    future = [t for t in candidates if t > now]
+    return min(future) if future else None
+
+
+def recount_ward(infants, now, tables=None):
+    """全員を判定し直した人数（差分更新と比べる・速度を測るための従来のやり方）"""
+    counts = dict.fromkeys(WARD_COUNTERS, 0)
+    for infant in infants.values():
+        for key in ward_counter_keys(infant, now, tables):
+            counts[key] += 1
+    return counts
+
+
+class WardCounters:
+    """患者ごとの所属カウンタと、所属が変わりうる時刻のキュー。Streamlit のセッション間で共有する"""
+
+    def __init__(self, clock=datetime.now, tables=None):
+        self.clock = clock
+        self.tables = tables  # 森岡・村田の基準の表（protocol_tables.ProtocolTables。None は protocol の表）
+        self._patients = {}
+        self._members = {key: set() for key in WARD_COUNTERS}
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self.recomputed = 0
+
+    def _move(self, patient_id, old, new):
+        for key in old - new:
+            self._members[key].discard(patient_id)
+        for key in new - old:
+            self._members[key].add(patient_id)
+
+    def _refresh(self, patient_id, entry, now):
+        keys = ward_counter_keys(entry["infant"], now, self.tables)
+        self._move(patient_id, entry["keys"], keys)
+        entry["keys"] = keys
+        self.recomputed += 1
+        change_at = next_counter_change(entry["infant"], now, self.tables)
+        if change_at is not None:
+            heapq.heappush(self._heap, (change_at, next(self._seq), patient_id, entry["version"]))
+
+    def _advance(self, now):
+        # 期限の来た児だけその時刻で判定し直す。古い版（情報更新・退院済み）の項目は捨てる
+        while self._heap and self._heap[0][0] <= now:
+            when, _, patient_id, version = heapq.heappop(self._heap)
+            entry = self._patients.get(patient_id)
+            if entry is not None and entry["version"] == version:
+                self._refresh(patient_id, entry, when)
+
+    def upsert(self, patient_id, infant, now=None):
+        """入院または情報の置き換え"""
+        now = now or self.clock()
+        with self._lock:
+            self._advance(now)
+            if patient_id in self._patients and self._patients[patient_id]["infant"] == infant:
+                return  # 再表示など、内容が変わらない登録は判定し直さない
+            entry = self._patients.setdefault(patient_id, {"version": 0, "keys": frozenset()})
+            entry["infant"] = infant
+            entry["version"] += 1
+            self._refresh(patient_id, entry, now)
+
+    def update(self, patient_id, now=None, **changes):
+        """入院中の児の一部の項目（tb・completed など）だけを変える"""
+        with self._lock:
+            self.upsert(patient_id, dict(self._patients[patient_id]["infant"], **changes), now)
+
+    def discharge(self, patient_id):
+        with self._lock:
+            entry = self._patients.pop(patient_id, None)
+            if entry is not None:
+                self._move(patient_id, entry["keys"], frozenset())
+
+    def set_tables(self, tables, now=None):
+        """基準の表を持ち替え、全員を新しい表で判定し直す（キューに残った古い版の項目は捨てられる）"""
+        now = now or self.clock()
+        with self._lock:
+            self._advance(now)
+            self.tables = tables
+            for patient_id, entry in self._patients.items():
+                entry["version"] += 1
+                self._refresh(patient_id, entry, now)
+
+    def counts(self, now=None, tables=None):
+        """{カウンタ: 人数}（WARD_COUNTERS の順）
+        tables を渡し、それが集計に使っている表と異なる場合は（表の差し替え直後の表示など）、その表で数え直す"""
+        now = now or self.clock()
+        with self._lock:
+            if tables is not None and getattr(self.tables, "digest", None) != tables.digest:
+                return recount_ward(self.infants(), now, tables)
+            self._advance(now)
+            return {key: len(self._members[key]) for key in WARD_COUNTERS}
+
+    def members(self, key, now=None):
+        with self._lock:
+            self._advance(now or self.clock())
+            return sorted(self._members[key])
+
+    def infants(self):
+        with self._lock:
+            return {patient_id: entry["infant"] for patient_id, entry in self._patients.items()}
+
+    def stats(self):
+        with self._lock:
+            return {"patients": len(self._patients), "pending": len(self._heap), "recomputed": self.recomputed}
+
+
+def synthetic_ward(n, now, seed=0):
+    """速度測定用の架空の入院児（出生0〜60日、一部に最新のTBと実施済みの記録）"""
+    from risk_mask import KERNICTERUS_BITS, RISK_FLAGS, RISK_FLAG_BITS
+
+    rng = np.random.default_rng(seed)
+    infants = {}
+    for i in range(n):
+        birth_dt = now - timedelta(hours=float(rng.uniform(1, 60 * 24)))
+        ga_days = int(rng.integers(24 * 7, 41 * 7 + 7))
+        mask = 0
+        for flag in RISK_FLAGS:
+            if rng.random() < 0.05:
+                mask |= RISK_FLAG_BITS[flag]
+        infant = {
+            "birth_date": birth_dt.date(),
+            "birth_time": birth_dt.time(),
+            "gestational_weeks": ga_days // 7,
+            "gestational_days": ga_days % 7,
+            "birth_weight": int(rng.uniform(600, 4000)),
+            "has_kernicterus_risk": bool(mask & KERNICTERUS_BITS),
+            "risk_mask": mask,
+            "completed": tuple(check for check in WARD_DUE_CHECKS if rng.random() < 0.3),
+        }
+        if rng.random() < 0.6:
+            infant["tb"] = round(float(rng.uniform(3, 22)), 1)
+        infants[f"P{i:05d}"] = infant
+    return infants
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="架空の入院児で集計カウンタの差分更新と全件再計算を比べる")
+    parser.add_argument("--census", type=int, default=2000, help="入院児の数")
+    parser.add_argument("--days", type=int, default=3, help="時計を進める日数（1時間ごとに表示する想定）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    now = datetime(2024, 1, 1, 8, 0)
+    infants = synthetic_ward(args.census, now, args.seed)
+    counters = WardCounters()
+    started = time.perf_counter()
+    for patient_id, infant in infants.items():
+        counters.upsert(patient_id, infant, now)
+    print(f"{len(infants):,}人の入院：{(time.perf_counter() - started) * 1000:.0f} ms")
+
+    rng = np.random.default_rng(args.seed)
+    ids = list(infants)
+    materialized_s = rescan_s = 0.0
+    mismatches = 0
+    for hour in range(1, args.days * 24 + 1):
+        at = now + timedelta(hours=hour)
+        patient_id = ids[int(rng.integers(len(ids)))]
+        counters.update(patient_id, at, tb=round(float(rng.uniform(3, 22)), 1))  # 1時間に1人TBを更新
+        started = time.perf_counter()
+        counts = counters.counts(at)
+        materialized_s += time.perf_counter() - started
+        started = time.perf_counter()
+        expected = recount_ward(counters.infants(), at)
+        rescan_s += time.perf_counter() - started
+        mismatches += counts != expected
+
+    steps = args.days * 24
+    stats = counters.stats()
+    print(f"{steps}回の表示：差分更新 {materialized_s / steps * 1000:.2f} ms/回 / 全件再計算 {rescan_s / steps * 1000:.1f} ms/回"
+          f"（{rescan_s / materialized_s:.0f}倍）・不一致 {mismatches}回・再判定 {stats['recomputed']:,}回")
+    for key, count in counters.counts(now + timedelta(days=args.days)).items():
+        print(f"  {WARD_COUNTER_LABELS[key]}: {count:,}人")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,364 @@
+"""出生体格のZスコアの分布を病棟・月ごとに分位点スケッチ（KLL）で持ち、N(0,1) からのずれを検出する
+
+    python zscore_drift.py --synthetic 60000 --miscalibrate 3F:150
+
+体重計・身長計の校正ずれは、その病棟のZスコアの分布が N(0,1) からずれることで現れる。
+測定値そのものは保存せず、病棟 × 月 × 項目ごとに KLL スケッチ（数百個の代表値）だけを更新する。
+スケッチは足し合わせられる（merge）ので、病棟全体・複数月の分布も元データを読み直さずに作れる。
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+
+import numpy as np
+
+DRIFT_MEASURES = ("weight", "length", "hc")
+DRIFT_MEASURE_LABELS = {"weight": "体重", "length": "身長", "hc": "頭囲"}
+
+# 画面で採点した児のスケッチの保存先（再起動しても病棟 × 月の分布を引き継ぐ）
+DRIFT_MONITOR_PATH = "zscore_drift.json"
+
+# KLL スケッチの大きさ。k=200 で順位の誤差はおよそ1.3%（99%の確率で）
+KLL_K = 200
+KLL_RANK_ERROR = 0.0133
+# 判定に必要な最小人数
+DRIFT_MIN_COUNT = 30
+# 中央値のずれ（SD）・四分位範囲から求めたSDの許容範囲
+DRIFT_MEDIAN_LIMIT = 0.3
+DRIFT_SCALE_RANGE = (0.8, 1.25)
+# KS 検定（有意水準1%）の係数。スケッチの順位誤差を上乗せして判定する
+DRIFT_KS_COEFFICIENT = 1.63
+
+
+class KllSketch:
+    """KLL 分位点スケッチ。段 h の代表値は 2^h 個分の重みを持つ。容量を超えた段は整列して1つおきに上の段へ送る"""
+
+    def __init__(self, k=KLL_K, c=2 / 3, seed=0):
+        self.k = k
+        self.c = c
+        self.n = 0
+        self.levels = [[]]
+        self._rng = random.Random(seed)
+
+    def _capacity(self, h):
+        return int(math.ceil(self.c ** (len(self.levels) - h - 1) * self.k)) + 1
+
+    def _max_size(self):
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _size(self):
+        return sum(len(level) for level in self.levels)
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for h, level in enumerate(self.levels):
+                if len(level) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                    level.sort()
+                    # 奇数個なら最後の1個はこの段に残す
+                    keep = level[-1:] if len(level) % 2 else []
+                    pairs = level[:len(level) - len(keep)]
+                    self.levels[h + 1].extend(pairs[self._rng.random() < 0.5::2])
+                    self.levels[h] = keep
+                    break
+
+    def update(self, value):
+        self.levels[0].append(float(value))
+        self.n += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def update_many(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.levels[0].extend(values.tolist())
+        self.n += len(values)
+        self._compress()
+
+    def merge(self, other):
+        """other の分を足し込む（other は変更しない）"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def weighted_items(self):
+        """(代表値の配列, 重みの配列)。代表値の昇順"""
+        values = np.array([v for level in self.levels for v in level])
+        weights = np.array([2 ** h for h, level in enumerate(self.levels) for _ in level], dtype=float)
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    def quantile(self, q):
+        values, weights = self.weighted_items()
+        if not len(values):
+            return float("nan")
+        cumulative = np.cumsum(weights)
+        i = int(np.searchsorted(cumulative, q * cumulative[-1], side="left"))
+        return float(values[min(i, len(values) - 1)])
+
+    def to_dict(self):
+        return {"k": self.k, "c": self.c, "n": self.n, "levels": self.levels}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["k"], data["c"])
+        sketch.n = data["n"]
+        sketch.levels = [list(level) for level in data["levels"]]
+        return sketch
+
+
+def _normal_cdf(z):
+    return 0.5 * (1.0 + np.vectorize(math.erf)(np.asarray(z) / math.sqrt(2.0)))
+
+
+def drift_statistics(sketch):
+    """スケッチから N(0,1) とのずれを求める。{"n", "median", "sd_iqr", "ks", "ks_limit"}"""
+    values, weights = sketch.weighted_items()
+    if not len(values):
+        return {"n": 0, "median": float("nan"), "sd_iqr": float("nan"), "ks": float("nan"), "ks_limit": float("nan")}
+    cumulative = np.cumsum(weights) / weights.sum()
+    before = cumulative - weights / weights.sum()
+    phi = _normal_cdf(values)
+    ks = float(max(np.abs(cumulative - phi).max(), np.abs(before - phi).max()))
+    q25, q50, q75 = (sketch.quantile(q) for q in (0.25, 0.5, 0.75))
+    return {
+        "n": sketch.n,
+        "median": q50,
+        "sd_iqr": (q75 - q25) / 1.3489795,
+        "ks": ks,
+        "ks_limit": DRIFT_KS_COEFFICIENT / math.sqrt(sketch.n) + KLL_RANK_ERROR,
+    }
+
+
+def drift_reasons(stats):
+    """アラートの理由（表示用の文字列のタプル）。人数が足りなければ判定しない"""
+    if stats["n"] < DRIFT_MIN_COUNT:
+        return ()
+    reasons = []
+    if abs(stats["median"]) > DRIFT_MEDIAN_LIMIT:
+        reasons.append(f"中央値 {stats['median']:+.2f}SD")
+    lo, hi = DRIFT_SCALE_RANGE
+    if not lo <= stats["sd_iqr"] <= hi:
+        reasons.append(f"ばらつき（四分位範囲から）{stats['sd_iqr']:.2f}SD")
+    if stats["ks"] > stats["ks_limit"]:
+        reasons.append(f"分布の形 KS={stats['ks']:.3f}（上限 {stats['ks_limit']:.3f}）")
+    return tuple(reasons)
+
+
+def month_key(when):
+    """date / datetime / "2024-01-15" から "2024-01" を作る"""
+    if isinstance(when, str):
+        return when[:7]
+    return f"{when.year:04d}-{when.month:02d}"
+
+
+class ZScoreDriftMonitor:
+    """病棟 × 月 × 項目ごとの KLL スケッチ。採点のたびに update し、必要なときに集計・判定する"""
+
+    def __init__(self, k=KLL_K):
+        self.k = k
+        self.sketches = {}
+        # 追加済みの患者ID（再実行・再表示で同じ児を二重に数えない）
+        self.observed = set()
+        self._lock = threading.Lock()
+
+    def _sketch(self, unit, month, measure):
+        key = (unit, month, measure)
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = KllSketch(self.k, seed=zlib.crc32(repr(key).encode()))
+        return sketch
+
+    def observe(self, unit, when, z_scores):
+        """1人分の {項目: Zスコア}（None は無視）を追加する"""
+        month = month_key(when)
+        for measure, z in z_scores.items():
+            if z is not None and not math.isnan(z):
+                self._sketch(unit, month, measure).update(z)
+
+    def observe_patient(self, patient_id, unit, when, z_scores):
+        """患者IDごとに1回だけ observe する。追加したら True"""
+        with self._lock:
+            if patient_id in self.observed:
+                return False
+            self.observed.add(patient_id)
+            self.observe(unit, when, z_scores)
+            return True
+
+    def observe_many(self, unit, when, measure, z_scores):
+        self._sketch(unit, month_key(when), measure).update_many(z_scores)
+
+    def units(self):
+        return sorted({unit for unit, _, _ in self.sketches})
+
+    def months(self):
+        return sorted({month for _, month, _ in self.sketches})
+
+    def merged(self, measure, units=None, months=None):
+        """指定した病棟・月のスケッチを足し合わせる（None は全部）"""
+        sketch = KllSketch(self.k)
+        for (unit, month, m), part in self.sketches.items():
+            if m == measure and (units is None or unit in units) and (months is None or month in months):
+                sketch.merge(part)
+        return sketch
+
+    def report(self, by_month=True):
+        """病棟（× 月）× 項目ごとの統計とアラート理由の一覧"""
+        rows = []
+        with self._lock:
+            for unit in self.units():
+                for month in (self.months() if by_month else [None]):
+                    for measure in DRIFT_MEASURES:
+                        sketch = self.merged(measure, [unit], None if month is None else [month])
+                        if not sketch.n:
+                            continue
+                        stats = drift_statistics(sketch)
+                        rows.append(dict(stats, unit=unit, month=month, measure=measure, reasons=drift_reasons(stats)))
+        return rows
+
+    def alerts(self, by_month=True):
+        return [row for row in self.report(by_month) if row["reasons"]]
+
+    def to_json(self):
+        return json.dumps({
+            "observed": sorted(self.observed),
+            "sketches": [
+                {"unit": unit, "month": month, "measure": measure, "sketch": sketch.to_dict()}
+                for (unit, month, measure), sketch in self.sketches.items()
+            ],
+        })
+
+    @classmethod
+    def from_json(cls, text, k=KLL_K):
+        monitor = cls(k)
+        data = json.loads(text)
+        monitor.observed = set(data["observed"])
+        for item in data["sketches"]:
+            monitor.sketches[(item["unit"], item["month"], item["measure"])] = KllSketch.from_dict(item["sketch"])
+        return monitor
+
+    def save(self, path=DRIFT_MONITOR_PATH):
+        with self._lock:
+            text = self.to_json()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+def load_drift_monitor(path=DRIFT_MONITOR_PATH, k=KLL_K):
+    """保存済みのスケッチを読み込む（ファイルがなければ空から始める）"""
+    if not os.path.exists(path):
+        return ZScoreDriftMonitor(k)
+    with open(path, encoding="utf-8") as f:
+        return ZScoreDriftMonitor.from_json(f.read(), k)
+
+
+def cohort_drift_monitor(taikaku_rows, patients, k=KLL_K):
+    """病棟（unit）・出生日（birth_date）を持つコホートからスケッチを作る。どちらかがない児は含めない"""
+    from cohort_plane import cohort_birth_size_z_all
+
+    index = [i for i, p in enumerate(patients) if p.get("unit") and p.get("birth_date")]
+    subset = [patients[i] for i in index]
+    z = cohort_birth_size_z_all(taikaku_rows, subset)
+    groups = {}
+    for i, p in enumerate(subset):
+        groups.setdefault((str(p["unit"]), month_key(p["birth_date"])), []).append(i)
+    monitor = ZScoreDriftMonitor(k)
+    for (unit, month), rows in groups.items():
+        for measure in DRIFT_MEASURES:
+            monitor.observe_many(unit, month, measure, z[measure][rows])
+    return monitor
+
+
+def synthetic_unit_cohort(taikaku_rows, n, units=("3F", "4F", "NICU"), months=6, seed=0):
+    """架空のコホート（ドリフト監視の見本用）。体格は基準データの LMS から N(0,1) のZスコアで作る
+    （校正ずれがなければアラートが出ないことを確かめられる）"""
+    from lms import get_birth_size_thresholds_batch, lms_to_values
+
+    rng = np.random.default_rng(seed)
+    start = date(2024, 1, 1)
+    ga_days = np.clip(np.round(rng.normal(38.5 * 7, 14, n)), 22 * 7, 41 * 7 + 6).astype(np.int64)
+    genders = rng.choice(["男児", "女児"], n)
+    firsts = rng.random(n) < 0.5
+    cohort = [
+        {
+            "gender": str(genders[i]),
+            "is_first_child": bool(firsts[i]),
+            "gestational_weeks": int(ga_days[i] // 7),
+            "gestational_days": int(ga_days[i] % 7),
+            "unit": str(units[int(rng.integers(len(units)))]),
+            "birth_date": (start + timedelta(days=int(rng.integers(months * 30)))).isoformat(),
+        }
+        for i in range(n)
+    ]
+    fields = {"weight_lms": ("birth_weight_g", 0), "height_lms": ("birth_length_cm", 1), "hc_lms": ("birth_hc_cm", 1)}
+    for gender in ("男児", "女児"):
+        for first in (True, False):
+            index = np.nonzero((genders == gender) & (firsts == first))[0]
+            lms = get_birth_size_thresholds_batch(taikaku_rows, gender, first, ga_days[index] // 7, ga_days[index] % 7)
+            for lms_key, (field, digits) in fields.items():
+                table = lms[lms_key]
+                values = lms_to_values(table[:, 0], table[:, 1], table[:, 2], rng.standard_normal(len(index)))
+                for i, value in zip(index, values):
+                    cohort[i][field] = None if np.isnan(value) else round(float(value), digits)
+    return cohort
+
+
+def main(argv=None):
+    from cohort_plane import cohort_birth_size_z_all
+    from reference_registry import build_reference_registry
+
+    parser = argparse.ArgumentParser(description="架空のコホートでZスコアのドリフト監視を試す")
+    parser.add_argument("--synthetic", type=int, default=60000, help="架空のコホートの人数")
+    parser.add_argument("--miscalibrate", default="3F:150",
+                        help="校正ずれを入れる「病棟:体重のずれ(g)」。最後の1か月の出生だけに加える（空文字で無効）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    registry = build_reference_registry()
+    rows = registry.get(registry.dataset_ids()[0])
+    cohort = synthetic_unit_cohort(rows, args.synthetic, seed=args.seed)
+    if args.miscalibrate:
+        unit, offset = args.miscalibrate.split(":")
+        last_month = max(month_key(p["birth_date"]) for p in cohort)
+        for p in cohort:
+            if p["unit"] == unit and month_key(p["birth_date"]) == last_month:
+                p["birth_weight_g"] += float(offset)
+
+    # 採点のたびに1人ずつ更新する経路の速度（Zスコアはまとめて計算済みとする）
+    z = cohort_birth_size_z_all(rows, cohort)
+    monitor = ZScoreDriftMonitor()
+    started = time.perf_counter()
+    for i, p in enumerate(cohort):
+        monitor.observe(p["unit"], p["birth_date"], {m: float(z[m][i]) for m in DRIFT_MEASURES})
+    update_s = time.perf_counter() - started
+    size = len(monitor.to_json())
+    print(f"{len(cohort):,}人を1人ずつ更新：{update_s * 1000:.0f} ms（1人 {update_s / len(cohort) * 1e6:.1f} µs）"
+          f" / スケッチ {len(monitor.sketches)}個・JSON {size / 1024:.0f} KB")
+
+    started = time.perf_counter()
+    alerts = monitor.alerts()
+    print(f"病棟×月×項目の判定：{(time.perf_counter() - started) * 1000:.0f} ms")
+    for row in alerts:
+        print(f"  ⚠️ {row['unit']} {row['month']} {DRIFT_MEASURE_LABELS[row['measure']]}（{row['n']:,}人）: "
+              + "、".join(row["reasons"]))
+    if not alerts:
+        print("  アラートなし")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())